@@ -0,0 +1,38 @@
+import asyncio
+import os
+import threading
+import weakref
+
+# Upper bound on LLM calls in flight per event loop, shared by every provider
+MAX_CONCURRENT_INFERENCES = int(os.getenv("GENNIE_MAX_CONCURRENT_INFERENCES", "8"))
+
+_semaphores = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def set_max_concurrency(limit):
+    global MAX_CONCURRENT_INFERENCES
+    with _lock:
+        MAX_CONCURRENT_INFERENCES = limit
+        _semaphores.clear()
+
+def get_semaphore():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        semaphore = _semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_INFERENCES)
+            _semaphores[loop] = semaphore
+    return semaphore
+
+async def bounded(coroutine, timeout=None):
+    """Awaits an inference coroutine under the shared semaphore.
+
+    The timeout covers the call itself, not the time spent waiting for a slot.
+    Cancelling the caller cancels the underlying request.
+    """
+    try:
+        async with get_semaphore():
+            return await asyncio.wait_for(coroutine, timeout)
+    finally:
+        # No-op once awaited; avoids "never awaited" warnings when cancelled while queued
+        coroutine.close()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+# Modules
+from bm25_index import BM25Index
+from vector_index import iter_chunks
+from shared import log_message as logr
+
+def synthetic_corpus(passages, vocabulary=50000, words_per_passage=120, seed=0):
+    """Passages of Zipf-distributed words, so postings lengths look like natural text."""
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(vocabulary)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, vocabulary + 1):
+        total += 1 / rank
+        cum_weights.append(total)
+    for i in range(passages):
+        text = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(words_per_passage // 2, words_per_passage * 3 // 2)))
+        yield {"url": f"https://example.com/doc/{i // 20}", "title": f"doc {i // 20}", "text": text}
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names)
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def main(paths, passages, batches, queries, k):
+    chunks = list(iter_chunks(paths)) if paths else list(synthetic_corpus(passages))
+    text_bytes = sum(len(chunk["text"]) for chunk in chunks)
+    logr(f"Corpus: {len(chunks)} passages, {round(text_bytes / 1e6, 2)} MB of text")
+    folder = tempfile.mkdtemp(prefix="bench_bm25-")
+    try:
+        index = BM25Index.create(os.path.join(folder, "index"))
+        batch_size = -(-len(chunks) // batches)
+        start = time.perf_counter()
+        for i in range(0, len(chunks), batch_size):
+            index.add(chunks[i:i + batch_size])
+        build = time.perf_counter() - start
+        size = folder_size(index.index_path)
+        logr(f"build: {round(build, 2)}s in {batches} incremental adds ({round(len(chunks) / build)} passages/s) | "
+             f"segments: {len(index.segments)} | index size: {round(size / 1e6, 2)} MB ({round(size / text_bytes, 2)}x text)")
+
+        rng = random.Random(1)
+        sample = [chunk["text"].split() for chunk in rng.sample(chunks, min(queries, len(chunks)))]
+        query_texts = [" ".join(rng.sample(words, min(len(words), rng.randint(2, 6)))) for words in sample]
+        index.search(query_texts[0], k)
+        timings = []
+        for query in query_texts:
+            start = time.perf_counter()
+            index.search(query, k)
+            timings.append(time.perf_counter() - start)
+        logr(f"query: {len(timings)} queries | median {round(statistics.median(timings) * 1000, 2)}ms | "
+             f"p95 {round(percentile(timings, 0.95) * 1000, 2)}ms | max {round(max(timings) * 1000, 2)}ms")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BM25 index build time, size and query latency")
+    parser.add_argument("paths", nargs="*", help="Scrape outputs to index (default: a synthetic corpus)")
+    parser.add_argument("-n", "--passages", type=int, default=100000, help="Passages in the synthetic corpus")
+    parser.add_argument("-b", "--batches", type=int, default=10, help="Incremental adds used to build the index")
+    parser.add_argument("-q", "--queries", type=int, default=500, help="Queries timed")
+    parser.add_argument("-k", type=int, default=10, help="Results per query")
+    args = parser.parse_args()
+    main(args.paths, args.passages, args.batches, args.queries, args.k)
@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# Modules
+import gennie_core
+import llm_cache
+import model_router
+import page_cache
+import tracing
+from shared import html2markdown
+from shared import log_message as logr
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures", "gennie")
+PROVIDER_MODULE = "bench_gennie_provider"
+CHARS_PER_TOKEN = 4
+# Allowed relative change of a metric before regression mode fails
+TOLERANCE = 0.15
+# Metrics compared against the baseline; for throughput a drop is a regression, for the rest a rise
+LOWER_IS_WORSE = ("throughput",)
+HIGHER_IS_WORSE = ("p50_ms", "p95_ms", "peak_kb")
+# Timings of benchmarks whose median is below this are reported but never flagged: they are mostly noise
+NOISE_FLOOR_MS = 1.0
+# Timed runs a metric needs, in both the results and the baseline, before it can be flagged;
+# a p95 needs enough runs for several of them to lie above it
+MIN_RUNS = {"throughput": 20, "p50_ms": 20, "p95_ms": 100}
+
+class Latency:
+    """Samples simulated latencies from {"median", "sigma"} lognormal specs.
+
+    Draws are seeded by (seed, key, how many times key was drawn), so a run gets the
+    same latencies whatever order its threads make the calls in.
+    """
+    def __init__(self, scale=1.0, seed=0):
+        self.scale = scale
+        self.seed = seed
+        self.draws = {}
+        self.lock = threading.Lock()
+
+    def sample(self, spec, key):
+        if not spec or not self.scale:
+            return 0.0
+        with self.lock:
+            n = self.draws[key] = self.draws.get(key, -1) + 1
+        rng = random.Random(f"{self.seed}:{key}:{n}")
+        return self.scale * spec["median"] * math.exp(spec.get("sigma", 0) * rng.gauss(0, 1))
+
+    def sleep(self, spec, key):
+        time.sleep(self.sample(spec, key))
+
+class Fixtures:
+    """A recorded search: fixture.json, the Custom Search response it names and the saved pages.
+
+    fixture.json holds the question, the search and fetch latencies, the saved page of
+    each URL and the canned LLM responses. Each "llm" rule applies to prompts containing
+    its "match" text and answers with one of its "responses" (picked by payload, so a
+    page always gets the same relevance) or, with "per_document", with a batch
+    relevance JSON array for the documents in the payload.
+    """
+    def __init__(self, folder=FIXTURES):
+        self.folder = folder
+        with open(os.path.join(folder, "fixture.json")) as f:
+            self.config = json.load(f)
+        self.question = self.config["question"]
+        with open(os.path.join(folder, self.config["search"]["file"])) as f:
+            self.search = json.load(f)
+        self.pages = {}
+        for url, path in self.config["fetch"]["pages"].items():
+            with open(os.path.join(folder, path), encoding="utf-8") as f:
+                self.pages[url] = f.read()
+        self.rules = self.config["llm"]
+
+    def rule(self, prompt):
+        for rule in self.rules:
+            if rule["match"] in prompt:
+                return rule
+        raise ValueError(f"No canned LLM response matches the prompt: {prompt.strip()[:80]}")
+
+    def response(self, rule, payload):
+        if "per_document" in rule:
+            scores = rule["per_document"]["scores"]
+            ids = re.findall(r"\[DOCUMENT (\d+)\]", payload)
+            return json.dumps([{"id": int(i), "evaluation": rule["per_document"]["evaluation"],
+                                "score": scores[zlib.crc32(i.encode()) % len(scores)]} for i in ids])
+        responses = rule["responses"]
+        return responses[zlib.crc32(payload.encode()) % len(responses)]
+
+class FakeLLM:
+    """Provider backend answering from the fixtures after a simulated latency.
+
+    The summary latency is the time to the first token; the rest of the response then
+    arrives at the rule's tokens_per_second.
+    """
+    def __init__(self, fixtures, latency):
+        self.fixtures = fixtures
+        self.latency = latency
+
+    def _answer(self, payload, prompt):
+        rule = self.fixtures.rule(prompt)
+        response = self.fixtures.response(rule, payload)
+        first_token = self.latency.sample(rule.get("latency"), rule["name"])
+        rate = rule.get("tokens_per_second")
+        generation = self.latency.scale * len(response) / CHARS_PER_TOKEN / rate if rate else 0.0
+        return response, first_token, generation
+
+    def _record_usage(self, model_id, payload, prompt, response):
+        tracing.record_usage("bench", model_id, (len(payload) + len(prompt)) // CHARS_PER_TOKEN, len(response) // CHARS_PER_TOKEN)
+
+    def run_text_inference(self, payload, prompt, type, model_id, verbose=False, **settings):
+        response, first_token, generation = self._answer(payload, prompt)
+        time.sleep(first_token + generation)
+        self._record_usage(model_id, payload, prompt, response)
+        return response
+
+    async def run_text_inference_async(self, payload, prompt, type, model_id, verbose=False, timeout=None, **settings):
+        response, first_token, generation = self._answer(payload, prompt)
+        await asyncio.wait_for(asyncio.sleep(first_token + generation), timeout)
+        self._record_usage(model_id, payload, prompt, response)
+        return response
+
+    def stream_text_inference(self, payload, prompt, type, model_id, verbose=False, **settings):
+        response, first_token, generation = self._answer(payload, prompt)
+        time.sleep(first_token)
+        pieces = re.findall(r"\S*\s*", response)
+        for piece in pieces:
+            if piece:
+                time.sleep(generation * len(piece) / len(response))
+                yield piece
+        self._record_usage(model_id, payload, prompt, response)
+
+    def count_chars_and_tokens(self, model_id, content):
+        return {"num_chars": len(content), "num_tokens": len(content) // CHARS_PER_TOKEN}
+
+    def as_module(self):
+        module = types.ModuleType(PROVIDER_MODULE)
+        for name in ("run_text_inference", "run_text_inference_async", "stream_text_inference", "count_chars_and_tokens"):
+            setattr(module, name, getattr(self, name))
+        return module
+
+@contextlib.contextmanager
+def offline(fixtures, latency):
+    """Serves Custom Search, page fetches and every LLM provider from fixtures.
+
+    The page and LLM caches are turned off and rate limits lifted, so every run does
+    the same work.
+    """
+    def search_page(base_url, params):
+        latency.sleep(fixtures.config["search"].get("latency"), "search")
+        start = params.get("start", 1) - 1
+        items = fixtures.search.get("items", [])[start:start + params.get("num", 10)]
+        page = {k: v for k, v in fixtures.search.items() if k != "items"}
+        if items:
+            page["items"] = items
+        return page
+
+    def recorded_page(url):
+        latency.sleep(fixtures.config["fetch"].get("latency"), f"fetch:{url}")
+        if url not in fixtures.pages:
+            raise ValueError(f"No recorded page for {url}")
+        return fixtures.pages[url]
+
+    def web_crawler(url, *args, **kwargs):
+        return types.SimpleNamespace(content={"html_body": recorded_page(url)})
+
+    def stream_raw_html(url, chunk_size=64 * 1024, *args, **kwargs):
+        data = recorded_page(url).encode("utf-8")
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    providers = list(model_router.PROVIDER_MODULES)
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.dict(sys.modules, {PROVIDER_MODULE: FakeLLM(fixtures, latency).as_module()}))
+        stack.enter_context(mock.patch.dict(model_router.PROVIDER_MODULES, {provider: PROVIDER_MODULE for provider in providers}))
+        stack.enter_context(mock.patch.dict(model_router._limiters, {provider: model_router.RateLimiter(10 ** 9) for provider in providers}))
+        stack.enter_context(mock.patch.object(gennie_core, "_search_page", search_page))
+        stack.enter_context(mock.patch.object(gennie_core, "web_crawler", web_crawler))
+        stack.enter_context(mock.patch.object(gennie_core, "stream_raw_html", stream_raw_html))
+        stack.enter_context(mock.patch.object(llm_cache, "DEFAULT_PATH", "off"))
+        stack.enter_context(mock.patch.object(page_cache, "DEFAULT_PATH", "off"))
+        yield
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    # The pipeline logs every step to stdout; keep it out of the report
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def summarize_timings(timings, units, wall):
+    return {
+        "runs": len(timings),
+        "throughput": round(units / wall, 3),
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+    }
+
+def peak_memory(fn):
+    """Peak bytes allocated by Python while fn runs, in KB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+def bench_answers(fixtures, iterations, concurrency, model_id, num_results, options):
+    """Times gennie_answer end to end, concurrency answers at a time; throughput is answers/s."""
+    def answer():
+        return gennie_core.gennie_answer(fixtures.question, model_id, num_results, 1, "y2", None, **options)
+
+    def timed(_):
+        start = time.perf_counter()
+        answer()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(timed, range(iterations)))
+    result = summarize_timings(timings, iterations, time.perf_counter() - start)
+    result["peak_kb"] = peak_memory(answer)
+    return result
+
+def bench_html2markdown(fixtures, rounds):
+    """Times html2markdown on every saved page; throughput is MB of HTML converted per second."""
+    pages = list(fixtures.pages.values())
+    timings = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for html in pages:
+            page_start = time.perf_counter()
+            html2markdown(html)
+            timings.append(time.perf_counter() - page_start)
+    megabytes = rounds * sum(len(html.encode("utf-8")) for html in pages) / 1e6
+    result = summarize_timings(timings, megabytes, time.perf_counter() - start)
+    result["peak_kb"] = peak_memory(lambda: html2markdown(max(pages, key=len)))
+    return result
+
+def bench_serialize(search_results, question, rounds, token_budget=None):
+    """Times serialize_search_results over the fixture's results; throughput is calls/s."""
+    timings = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        call_start = time.perf_counter()
+        gennie_core.serialize_search_results(search_results, question, token_budget)
+        timings.append(time.perf_counter() - call_start)
+    result = summarize_timings(timings, rounds, time.perf_counter() - start)
+    result["peak_kb"] = peak_memory(lambda: gennie_core.serialize_search_results(search_results, question, token_budget))
+    return result
+
+def stage_totals():
+    # (seconds, spans) per pipeline stage recorded so far
+    return {h["labels"]["stage"]: (h["sum"], h["count"]) for h in tracing.snapshot()["histograms"] if h["name"] == "gennie_stage_seconds"}
+
+def median_results(passes):
+    """Merges the benchmarks of repeated passes, keeping the median of each metric."""
+    return {name: {metric: statistics.median(p[name][metric] for p in passes) for metric in metrics}
+            for name, metrics in passes[0].items()}
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Logs every metric against the baseline and returns the ones that regressed by more than tolerance.
+
+    Timings are only checked with at least MIN_RUNS runs per pass on both sides, so small
+    quick runs (ex: -n 4 --rounds 2) report their changes without failing on noise.
+    """
+    if baseline.get("config") != results["config"]:
+        logr(f"warning: baseline was run with {baseline.get('config')}")
+    regressions = []
+    for name, metrics in results["benchmarks"].items():
+        reference = baseline["benchmarks"].get(name)
+        if reference is None:
+            logr(f"{name}: not in the baseline")
+            continue
+        for metric in LOWER_IS_WORSE + HIGHER_IS_WORSE:
+            if metric not in metrics or not reference.get(metric):
+                continue
+            change = metrics[metric] / reference[metric] - 1
+            worse = -change if metric in LOWER_IS_WORSE else change
+            noisy = metric != "peak_kb" and reference.get("p50_ms", NOISE_FLOOR_MS) < NOISE_FLOOR_MS
+            runs = min(metrics.get("runs", 0), reference.get("runs", 0))
+            too_few = runs < MIN_RUNS.get(metric, 0)
+            flag = "REGRESSION" if worse > tolerance and not noisy and not too_few else ""
+            note = f" (only {runs} runs, not checked)" if too_few else ""
+            logr(f"{name}.{metric}: {reference[metric]} -> {metrics[metric]} ({change:+.1%}){note} {flag}")
+            if flag:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+def run(args):
+    fixtures = Fixtures(args.fixtures)
+    latency = Latency(args.latency_scale, args.seed)
+    options = dict(max_workers=args.max_workers, batch_relevance=args.batch_relevance,
+                   context_token_budget=args.context_token_budget, streaming_fetch=args.streaming_fetch)
+    config = dict(vars(args))
+    for key in ("fixtures", "save", "baseline", "tolerance", "verbose"):
+        config.pop(key)
+    # Spans are kept in memory for the per-stage breakdown
+    tracing.configure()
+
+    passes = []
+    stage_sums = {}
+    with offline(fixtures, latency):
+        with quiet(not args.verbose):
+            for _ in range(args.repeat):
+                benchmarks = {}
+                latency.scale = args.latency_scale
+                before = stage_totals()
+                benchmarks["gennie_answer"] = bench_answers(fixtures, args.iterations, args.concurrency, args.model_id, args.num_results, options)
+                for stage, (seconds, count) in stage_totals().items():
+                    previous = before.get(stage, (0, 0))
+                    total = stage_sums.get(stage, (0, 0))
+                    stage_sums[stage] = (total[0] + seconds - previous[0], total[1] + count - previous[1])
+                benchmarks["html2markdown"] = bench_html2markdown(fixtures, args.rounds)
+                latency.scale = 0
+                search_results = gennie_core.process_search_results(fixtures.search["items"], fixtures.question, args.model_id, max_workers=args.max_workers)
+                benchmarks["serialize_search_results"] = bench_serialize(search_results, fixtures.question, args.rounds * 10)
+                benchmarks["serialize_search_results_packed"] = bench_serialize(search_results, fixtures.question, args.rounds * 10,
+                                                                                args.context_token_budget or 6000)
+                passes.append(benchmarks)
+    benchmarks = median_results(passes)
+    stages = {stage: round(seconds / count * 1000, 3) for stage, (seconds, count) in stage_sums.items() if count}
+
+    for name, metrics in benchmarks.items():
+        logr(f"{name}: " + " | ".join(f"{k} {v}" for k, v in metrics.items()))
+    logr("gennie_answer stages (mean ms): " + " | ".join(f"{stage} {ms}" for stage, ms in sorted(stages.items())))
+    results = {"config": config, "benchmarks": benchmarks, "stages_ms": stages}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        logr(f"Results saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            logr(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        logr("No regressions")
+
+def record(args):
+    """Saves a live Custom Search response and the pages it links to as fixtures.
+
+    The LLM rules of an existing fixture.json are kept; the question and pages are replaced.
+    """
+    os.makedirs(os.path.join(args.fixtures, "pages"), exist_ok=True)
+    results = gennie_core.google_search(args.query, os.getenv("GOOGLE_SEARCH_API_KEY"), os.getenv("SEARCH_ENGINE_ID"), args.num_results, 1)
+    search = {"searchInformation": {"totalResults": str(len(results))}, "items": results}
+    with open(os.path.join(args.fixtures, "search.json"), "w") as f:
+        json.dump(search, f, indent=2)
+    pages = {}
+    for item in results:
+        url = item["link"]
+        try:
+            html = gennie_core.web_crawler(url).content["html_body"]
+        except Exception as e:
+            logr(f"Failed to record {url}: {e}")
+            continue
+        path = os.path.join("pages", re.sub(r"[^A-Za-z0-9]+", "-", url.split("://", 1)[-1]).strip("-")[:100] + ".html")
+        with open(os.path.join(args.fixtures, path), "w", encoding="utf-8") as f:
+            f.write(html)
+        pages[url] = path
+    config_path = os.path.join(args.fixtures, "fixture.json")
+    config = {"search": {"latency": {"median": 0.35, "sigma": 0.25}}, "fetch": {"latency": {"median": 0.9, "sigma": 0.6}}, "llm": []}
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+    config["question"] = args.question
+    config["search"]["file"] = "search.json"
+    config["fetch"]["pages"] = pages
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+    logr(f"Recorded {len(results)} search results and {len(pages)} pages into {args.fixtures}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Gennie answer pipeline on recorded fixtures")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("run", help="Run the benchmarks")
+    bench.add_argument("--fixtures", default=FIXTURES, help="Fixture folder")
+    bench.add_argument("--model_id", default="gemini-1.5-flash-001", help="Model ID passed to the pipeline (every provider is simulated)")
+    bench.add_argument("-n", "--iterations", type=int, default=20, help="Answers timed")
+    bench.add_argument("-c", "--concurrency", type=int, default=4, help="Answers run at the same time")
+    bench.add_argument("--rounds", type=int, default=20, help="Passes over the saved pages for html2markdown (x10 for serialization)")
+    bench.add_argument("--num_results", type=int, default=8, help="Search results per answer")
+    bench.add_argument("--repeat", type=int, default=3, help="Passes over every benchmark; the median of each metric is reported")
+    bench.add_argument("--max_workers", type=int, default=4, help="Search results processed concurrently per answer")
+    bench.add_argument("--latency_scale", type=float, default=0.1, help="Multiplier of the recorded latencies; 0 measures CPU time only")
+    bench.add_argument("--seed", type=int, default=0, help="Seed of the simulated latencies")
+    bench.add_argument("--batch_relevance", action="store_true", help="Score several search results per LLM call")
+    bench.add_argument("--streaming_fetch", action="store_true", help="Convert pages to markdown while they download")
+    bench.add_argument("--context_token_budget", type=int, default=None, help="Token budget for the search results sent to summarization")
+    bench.add_argument("--save", default=None, help="Write the results as JSON, ex: to use as a baseline")
+    bench.add_argument("--baseline", default=None, help="Results JSON to compare against; exits with 1 on regressions")
+    bench.add_argument("--tolerance", type=float, default=TOLERANCE, help="Relative change allowed before a metric counts as a regression")
+    bench.add_argument("-v", "--verbose", action="store_true", help="Show the pipeline logs")
+    rec = subparsers.add_parser("record", help="Record live search results and pages as fixtures")
+    rec.add_argument("--question", required=True, help="Question the fixture answers")
+    rec.add_argument("--query", required=True, help="Custom Search query to record")
+    rec.add_argument("--num_results", type=int, default=8, help="Search results to record")
+    rec.add_argument("--fixtures", default=FIXTURES, help="Fixture folder")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        record(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import glob
+import os
+import re
+import statistics
+import time
+from bs4 import BeautifulSoup
+
+# Modules
+from shared import html2markdown, HTML_PARSER
+from shared import log_message as logr
+
+def legacy_html2markdown(html):
+    # Recursive html.parser implementation html2markdown replaced, kept as the baseline
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(['script', 'style', 'header', 'footer', 'nav']):
+        element.decompose()
+    body = soup.body if soup.body else soup
+    def convert_element(element):
+        if element.name is None:
+            return element.string
+        if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+            return f"{'#' * int(element.name[1])} {element.get_text().strip()}\n\n"
+        if element.name == 'p':
+            return f"{element.get_text().strip()}\n\n"
+        if element.name == 'a':
+            return f"[{element.get_text()}]({element.get('href', '')})"
+        if element.name == 'img':
+            return f"![{element.get('alt', '')}]({element.get('src', '')})"
+        if element.name in ['ul', 'ol']:
+            items = []
+            for i, li in enumerate(element.find_all('li', recursive=False)):
+                prefix = '- ' if element.name == 'ul' else f"{i+1}. "
+                items.append(f"{prefix}{convert_element(li).strip()}")
+            return '\n'.join(items) + '\n\n'
+        if element.name in ['strong', 'b']:
+            return f"**{element.get_text()}**"
+        if element.name in ['em', 'i']:
+            return f"*{element.get_text()}*"
+        if element.name == 'code':
+            return f"`{element.get_text()}`"
+        if element.name == 'pre':
+            return f"```\n{element.get_text()}\n```\n\n"
+        return ''.join(convert_element(child) for child in element.children)
+    markdown = convert_element(body)
+    markdown = re.sub(r'\n{3,}', '\n\n', markdown)
+    return markdown.strip()
+
+def load_corpus(folder):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(folder, "**", "*.htm*"), recursive=True)):
+        with open(path, "r", errors="replace") as f:
+            pages[path] = f.read()
+    return pages
+
+def time_converter(convert, pages, repeat):
+    timings = []
+    failures = 0
+    for html in pages.values():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                convert(html)
+            except RecursionError:
+                failures += 1
+                break
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if best is not None:
+            timings.append(best)
+    return timings, failures
+
+def report(name, timings, failures, total_bytes):
+    total = sum(timings)
+    logr(f"{name}: total {round(total, 4)}s | median/page {round(statistics.median(timings) * 1000, 2)}ms | "
+         f"{round(total_bytes / total / 1e6, 2)} MB/s | recursion failures: {failures}")
+    return total
+
+def main(folder, repeat):
+    pages = load_corpus(folder)
+    if not pages:
+        logr(f"No .html files found under {folder}")
+        return
+    total_bytes = sum(len(html) for html in pages.values())
+    logr(f"Corpus: {len(pages)} pages, {round(total_bytes / 1e6, 2)} MB (parser: {HTML_PARSER})")
+    legacy = report("legacy (html.parser, recursive)", *time_converter(legacy_html2markdown, pages, repeat), total_bytes)
+    current = report(f"html2markdown ({HTML_PARSER}, iterative)", *time_converter(html2markdown, pages, repeat), total_bytes)
+    logr(f"speedup: {round(legacy / current, 2)}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark html2markdown against the legacy recursive converter")
+    parser.add_argument("-c", "--corpus", type=str, required=True, help="Folder with saved HTML pages")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per page (best time is kept)")
+    args = parser.parse_args()
+    main(args.corpus, args.repeat)
@@ -0,0 +1,239 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+
+# Modules
+import context_packer
+from vector_index import iter_chunks, CHUNK_CHARS
+from shared import log_message as logr
+
+K1 = 1.2
+B = 0.75
+# Segments are merged into one once an index has more than this many
+MAX_SEGMENTS = 8
+
+class Segment:
+    """Immutable slice of the index: a sorted vocabulary and its postings.
+
+    Postings of term i are doc_ids[term_offsets[i]:term_offsets[i + 1]] with the matching
+    term frequencies in tfs. Arrays are memory-mapped; only the vocabulary is held in a dict.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, "vocab.json")) as f:
+            self.vocab = {term: i for i, term in enumerate(json.load(f))}
+        self.term_offsets = np.load(os.path.join(folder, "term_offsets.npy"), mmap_mode="r")
+        self.doc_ids = np.load(os.path.join(folder, "doc_ids.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(folder, "tfs.npy"), mmap_mode="r")
+
+    def postings(self, term):
+        i = self.vocab.get(term)
+        if i is None:
+            return None
+        start, end = self.term_offsets[i], self.term_offsets[i + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    @staticmethod
+    def write(folder, postings):
+        """Writes {term: (doc_ids, tfs)} as a segment; doc_ids must be increasing per term."""
+        building = f"{folder}.building"
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        vocab = sorted(postings)
+        lengths = np.array([len(postings[term][0]) for term in vocab], dtype=np.int64)
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=term_offsets[1:])
+        doc_ids = np.concatenate([np.asarray(postings[term][0], dtype=np.int32) for term in vocab]) if vocab else np.zeros(0, dtype=np.int32)
+        tfs = np.concatenate([np.asarray(postings[term][1], dtype=np.uint16) for term in vocab]) if vocab else np.zeros(0, dtype=np.uint16)
+        with open(os.path.join(building, "vocab.json"), "w") as f:
+            json.dump(vocab, f)
+        np.save(os.path.join(building, "term_offsets.npy"), term_offsets)
+        np.save(os.path.join(building, "doc_ids.npy"), doc_ids)
+        np.save(os.path.join(building, "tfs.npy"), tfs)
+        # Left over by an add that was interrupted before its commit
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(building, folder)
+
+class BM25Index:
+    """Inverted index over chunks of scraped documentation, ranked with Okapi BM25.
+
+    Every add() writes a new segment and then commits it by rewriting meta.json, so an
+    interrupted add leaves the index as it was. Chunk texts live in chunks.jsonl, located
+    by offsets.npy, and document lengths in doc_lens.npy, as in VectorIndex.
+    """
+    kind = "bm25"
+    # Share of the best achievable score a chunk needs to be used as an answer source
+    min_score = 0.3
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        with open(os.path.join(self.index_path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.segments = [Segment(os.path.join(self.index_path, name)) for name in self.meta["segments"]]
+        count = self.meta["count"]
+        self.doc_lens = np.load(os.path.join(self.index_path, "doc_lens.npy"))[:count]
+        self.offsets = np.load(os.path.join(self.index_path, "offsets.npy"))[:count]
+        self.avg_len = float(self.doc_lens.mean()) if count else 0.0
+        if getattr(self, "chunks_file", None):
+            self.chunks_file.close()
+        self.chunks_file = open(os.path.join(self.index_path, "chunks.jsonl"), "rb")
+
+    def __len__(self):
+        return self.meta["count"]
+
+    @classmethod
+    def create(cls, index_path, k1=K1, b=B):
+        """Opens the index at index_path, creating an empty one when there is none."""
+        if not os.path.exists(os.path.join(index_path, "meta.json")):
+            os.makedirs(index_path, exist_ok=True)
+            open(os.path.join(index_path, "chunks.jsonl"), "wb").close()
+            np.save(os.path.join(index_path, "doc_lens.npy"), np.zeros(0, dtype=np.int32))
+            np.save(os.path.join(index_path, "offsets.npy"), np.zeros(0, dtype=np.int64))
+            _write_json(os.path.join(index_path, "meta.json"),
+                        {"kind": cls.kind, "count": 0, "k1": k1, "b": b, "segments": [], "next_segment": 0, "sources": {}})
+        return cls(index_path)
+
+    def add(self, chunks, source=None):
+        """Indexes an iterable of {"url", "title", "text"} chunks; returns how many were added.
+
+        source, when given, is recorded in meta.json in the same write that commits the
+        chunks, so a crash can never leave them indexed but their file unrecorded.
+        """
+        with self.lock:
+            base = self.meta["count"]
+            postings = defaultdict(lambda: ([], []))
+            doc_lens, offsets = [], []
+            with open(os.path.join(self.index_path, "chunks.jsonl"), "ab") as chunks_file:
+                for doc_id, chunk in enumerate(chunks, start=base):
+                    terms = context_packer.tokenize(chunk["text"])
+                    for term, tf in Counter(terms).items():
+                        doc_ids, tfs = postings[term]
+                        doc_ids.append(doc_id)
+                        tfs.append(min(tf, 65535))
+                    doc_lens.append(len(terms))
+                    offsets.append(chunks_file.tell())
+                    chunks_file.write((json.dumps(chunk) + "\n").encode())
+            sources = dict(self.meta["sources"], **{source: len(doc_lens)}) if source else self.meta["sources"]
+            if not doc_lens:
+                if source:
+                    _write_json(os.path.join(self.index_path, "meta.json"), dict(self.meta, sources=sources))
+                    self._load()
+                return 0
+            name = f"segment-{self.meta['next_segment']:05d}"
+            Segment.write(os.path.join(self.index_path, name), postings)
+            _save_array(os.path.join(self.index_path, "doc_lens.npy"), np.concatenate([self.doc_lens, np.array(doc_lens, dtype=np.int32)]))
+            _save_array(os.path.join(self.index_path, "offsets.npy"), np.concatenate([self.offsets, np.array(offsets, dtype=np.int64)]))
+            meta = dict(self.meta, count=base + len(doc_lens), segments=self.meta["segments"] + [name], next_segment=self.meta["next_segment"] + 1,
+                        sources=sources)
+            _write_json(os.path.join(self.index_path, "meta.json"), meta)
+            self._load()
+            if len(self.segments) > MAX_SEGMENTS:
+                self._merge()
+            return len(doc_lens)
+
+    def add_files(self, paths, chunk_chars=CHUNK_CHARS):
+        """Indexes scrape outputs not indexed yet; files already added are skipped."""
+        added = 0
+        for path in paths:
+            source = os.path.abspath(path)
+            if source in self.meta["sources"]:
+                logr(f"{path} is already indexed, skipping")
+                continue
+            count = self.add(iter_chunks([path], chunk_chars), source=source)
+            logr(f"Indexed {count} chunks from {path}")
+            added += count
+        return added
+
+    def _merge(self):
+        # Caller holds self.lock
+        postings = defaultdict(lambda: ([], []))
+        for segment in self.segments:
+            for term, i in segment.vocab.items():
+                start, end = segment.term_offsets[i], segment.term_offsets[i + 1]
+                postings[term][0].append(segment.doc_ids[start:end])
+                postings[term][1].append(segment.tfs[start:end])
+        merged = {term: (np.concatenate(doc_ids), np.concatenate(tfs)) for term, (doc_ids, tfs) in postings.items()}
+        name = f"segment-{self.meta['next_segment']:05d}"
+        Segment.write(os.path.join(self.index_path, name), merged)
+        old = self.meta["segments"]
+        _write_json(os.path.join(self.index_path, "meta.json"), dict(self.meta, segments=[name], next_segment=self.meta["next_segment"] + 1))
+        self._load()
+        for folder in old:
+            shutil.rmtree(os.path.join(self.index_path, folder), ignore_errors=True)
+
+    def chunk(self, position):
+        with self.lock:
+            self.chunks_file.seek(int(self.offsets[position]))
+            return json.loads(self.chunks_file.readline())
+
+    def close(self):
+        with self.lock:
+            self.chunks_file.close()
+
+    def search(self, query, k=5):
+        """Returns the k best chunks for query as dicts with url, title, text and score.
+
+        score is the BM25 score divided by the best score the query terms could reach,
+        so it falls between 0 and 1 like VectorIndex similarities; bm25 is the raw score.
+        """
+        count = len(self)
+        terms = set(context_packer.tokenize(query))
+        if not count or not terms:
+            return []
+        k1, b = self.meta["k1"], self.meta["b"]
+        norms = (k1 * (1 - b + b * self.doc_lens / self.avg_len)).astype(np.float32)
+        scores = np.zeros(count, dtype=np.float32)
+        best = 0.0
+        for term in terms:
+            found = [p for p in (segment.postings(term) for segment in self.segments) if p is not None]
+            df = sum(len(doc_ids) for doc_ids, _ in found)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            best += idf * (k1 + 1)
+            for doc_ids, tfs in found:
+                tf = tfs.astype(np.float32)
+                scores[doc_ids] += idf * tf * (k1 + 1) / (tf + norms[doc_ids])
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.chunk(i), score=float(scores[i] / best), bm25=float(scores[i])) for i in top if scores[i] > 0]
+
+def _save_array(path, array):
+    # Readers reopen the index while it is being added to, so arrays are replaced whole
+    np.save(f"{path}.tmp.npy", array)
+    os.replace(f"{path}.tmp.npy", path)
+
+def _write_json(path, data):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 index over scraped documentation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add = subparsers.add_parser("add", help="Index new scrape outputs (*-scrapejob.md)")
+    add.add_argument("paths", nargs="+", help="Scrape output files")
+    add.add_argument("-i", "--index_path", required=True, help="Index folder, created when missing")
+    add.add_argument("--chunk_chars", type=int, default=CHUNK_CHARS, help="Maximum characters per chunk")
+    search = subparsers.add_parser("search", help="Query an index")
+    search.add_argument("-i", "--index_path", required=True, help="Index folder")
+    search.add_argument("-q", "--query", required=True, help="Query text")
+    search.add_argument("-k", type=int, default=5, help="Number of chunks to return")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        BM25Index.create(args.index_path).add_files(args.paths, args.chunk_chars)
+    else:
+        for hit in BM25Index(args.index_path).search(args.query, args.k):
+            logr(f"{hit['score']:.3f} ({hit['bm25']:.2f}) {hit['url']} - {hit['title']}")
+
+if __name__ == "__main__":
+    main()
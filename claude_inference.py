@@ -1,47 +1,101 @@
 import argparse
-import os
-from anthropic import Anthropic
 from bs4 import BeautifulSoup
 
 # Modules
 from shared import log_message as logr
+import llm_clients
+from async_inference import bounded
+import tracing
 
 def count_chars_and_tokens(model_id, content):
-    anthropic = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    anthropic = llm_clients.anthropic_client()
     num_chars = len(content)
     num_tokens = anthropic.count_tokens(content)
     return { "num_chars" : num_chars, "num_tokens" : num_tokens } 
 
-def run_text_inference(payload, prompt, type, model_id, verbose=False):
-    # Initialize Anthropic client
-    anthropic = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
+def extract_body_text(payload, type):
     # Extract the body content using BeautifulSoup if payload is from a file
     if type == "file":
         with open(payload, "r") as html_file:
             payload = html_file.read()
         soup = BeautifulSoup(payload, 'html.parser')
-        body_text = soup.body.get_text()
-    else:
-        body_text = payload
+        return soup.body.get_text()
+    return payload
+
+MAX_TOKENS = 4096
+CACHE_CONTROL = {"type": "ephemeral"}
+
+def build_messages(body_text, prompt, question=None, cache_context=False):
+    """Instructions, then the content, then the question, as blocks of one user message.
+
+    The first two stay the same between calls that reuse them; with cache_context a cache
+    breakpoint closes that prefix, so later calls read it from Anthropic's prompt cache
+    (prefixes under the model's minimum cacheable length are simply not cached).
+    """
+    blocks = [{"type": "text", "text": prompt}]
+    if body_text:
+        blocks.append({"type": "text", "text": f"Content: {body_text}"})
+    if cache_context:
+        blocks[-1]["cache_control"] = CACHE_CONTROL
+    if question:
+        blocks.append({"type": "text", "text": question})
+    return [{"role": "user", "content": blocks}]
+
+def _record_usage(model_id, usage):
+    if usage is not None:
+        tracing.record_usage("claude", model_id, usage.input_tokens, usage.output_tokens,
+                             cache_write=getattr(usage, "cache_creation_input_tokens", None),
+                             cache_read=getattr(usage, "cache_read_input_tokens", None))
+
+def run_text_inference(payload, prompt, type, model_id, verbose=False, temperature=1, max_tokens=None, question=None, cache_context=False):
+    # Shared Anthropic client (pooled keep-alive connections)
+    anthropic = llm_clients.anthropic_client()
 
-    # Prepare the message for Claude
-    message = f"Content: {body_text}\n\n{prompt}"
+    body_text = extract_body_text(payload, type)
 
     # Generate content using the Messages API
     response = anthropic.messages.create(
         model=model_id,
-        max_tokens=4096,
-        temperature=1,
-        messages=[
-            {"role": "user", "content": message}
-        ]
+        max_tokens=max_tokens or MAX_TOKENS,
+        temperature=temperature,
+        messages=build_messages(body_text, prompt, question, cache_context)
     )
+    _record_usage(model_id, response.usage)
     # Log and return the response
     if verbose:
         logr(response.content[0].text)
     return response.content[0].text
 
+def stream_text_inference(payload, prompt, type, model_id, verbose=False, temperature=1, max_tokens=None, question=None, cache_context=False):
+    """Generator variant of run_text_inference yielding text as it is produced."""
+    anthropic = llm_clients.anthropic_client()
+    body_text = extract_body_text(payload, type)
+    with anthropic.messages.stream(
+        model=model_id,
+        max_tokens=max_tokens or MAX_TOKENS,
+        temperature=temperature,
+        messages=build_messages(body_text, prompt, question, cache_context)
+    ) as stream:
+        for text in stream.text_stream:
+            if verbose:
+                print(text, end="", flush=True)
+            yield text
+        _record_usage(model_id, stream.get_final_message().usage)
+
+async def run_text_inference_async(payload, prompt, type, model_id, verbose=False, timeout=None, temperature=1, max_tokens=None, question=None, cache_context=False):
+    anthropic = llm_clients.async_anthropic_client()
+    body_text = extract_body_text(payload, type)
+    response = await bounded(anthropic.messages.create(
+        model=model_id,
+        max_tokens=max_tokens or MAX_TOKENS,
+        temperature=temperature,
+        messages=build_messages(body_text, prompt, question, cache_context)
+    ), timeout)
+    _record_usage(model_id, response.usage)
+    if verbose:
+        logr(response.content[0].text)
+    return response.content[0].text
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process content using Anthropic's Claude model.")
@@ -0,0 +1,108 @@
+import math
+import re
+
+# Relevance scores at or below this are left out of the summarization context
+MIN_RELEVANCE_SCORE = 4
+CHARS_PER_TOKEN = 4
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "what", "when", "where", "which",
+    "who", "why", "with", "you",
+}
+
+def estimate_tokens(text):
+    """Fast local token estimate (about 4 characters per token)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+def split_passages(markdown):
+    return [p.strip() for p in re.split(r"\n\s*\n", markdown) if p.strip()]
+
+def _pack(pieces, max_chars, separator):
+    packed, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            packed.append(current)
+            current = ""
+        current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        packed.append(current)
+    return packed
+
+def chunk_markdown(markdown, max_chars=1500):
+    """Packs consecutive passages of markdown into chunks of at most max_chars.
+
+    Passages longer than max_chars are split on line breaks, or hard cut as a last resort.
+    """
+    pieces = []
+    for passage in split_passages(markdown):
+        if len(passage) <= max_chars:
+            pieces.append(passage)
+            continue
+        lines = []
+        for line in passage.splitlines():
+            lines.extend(line[i:i + max_chars] for i in range(0, len(line), max_chars))
+        pieces.extend(_pack(lines, max_chars, "\n"))
+    return _pack(pieces, max_chars, "\n\n")
+
+def extract_passages(markdown, question, token_budget, count_tokens=estimate_tokens):
+    """Returns the passages of markdown that best match question within token_budget.
+
+    Passages are ranked by question term overlap (normalized by length) and the chosen
+    ones are emitted in their original order.
+    """
+    if count_tokens(markdown) <= token_budget:
+        return markdown
+    terms = set(tokenize(question))
+    passages = split_passages(markdown)
+    scored = []
+    for position, passage in enumerate(passages):
+        words = tokenize(passage)
+        overlap = sum(1 for w in words if w in terms)
+        scored.append((overlap / math.sqrt(len(words) + 1), position, passage))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    chosen, used = [], 0
+    for _, position, passage in scored:
+        tokens = count_tokens(passage)
+        if used + tokens > token_budget:
+            if not chosen and token_budget > 0:
+                # Nothing fits whole: keep the head of the best passage
+                chosen.append((position, passage[:token_budget * CHARS_PER_TOKEN]))
+                break
+            continue
+        chosen.append((position, passage))
+        used += tokens
+    return "\n\n".join(passage for _, passage in sorted(chosen))
+
+def rank_search_results(search_results, min_score=MIN_RELEVANCE_SCORE):
+    """Orders results by relevance score, dropping those scored below min_score.
+
+    Results without a parsed score are kept, after every scored result.
+    """
+    kept = [r for r in search_results if r.markdown and (r.relevance_score is None or r.relevance_score >= min_score)]
+    return sorted(kept, key=lambda r: -(r.relevance_score or 0))
+
+def pack_search_results(search_results, question, token_budget, min_score=MIN_RELEVANCE_SCORE, count_tokens=estimate_tokens):
+    """Serializes search results into at most token_budget tokens.
+
+    The budget is shared in proportion to relevance score; budget a result does not use
+    rolls over to the results ranked after it. Pages longer than their share are reduced
+    to their most relevant passages.
+    """
+    ranked = rank_search_results(search_results, min_score)
+    remaining = token_budget
+    packed = []
+    for position, result in enumerate(ranked):
+        overhead = count_tokens(result.to_string(content=""))
+        if remaining <= overhead:
+            break
+        weights = [r.relevance_score or 1 for r in ranked[position:]]
+        share = (remaining - overhead) * weights[0] // sum(weights)
+        content = extract_passages(result.markdown, question, share, count_tokens)
+        entry = result.to_string(content=content)
+        packed.append(entry)
+        remaining -= count_tokens(entry)
+    return "\n".join(packed)
@@ -0,0 +1,206 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules
+import context_packer
+import gennie_core
+import model_router
+import tracing
+from shared import normalize_url
+from shared import log_message as logr
+
+# Token budget for the retained search results sent to summarization
+CONTEXT_TOKEN_BUDGET = 32000
+# Gemini models get more: Vertex AI only caches contexts of at least
+# gemini_inference.CONTEXT_CACHE_MIN_TOKENS (32768) tokens, and follow-ups reuse the cached one
+GEMINI_CONTEXT_TOKEN_BUDGET = 48000
+# Smaller view of the retained results shown to the router when it decides whether to search again
+ROUTER_TOKEN_BUDGET = 4000
+ROUTER_MODEL_ID = "gemini-1.5-flash-001"
+# Turns kept verbatim; older ones are folded into the running summary
+MAX_RECENT_TURNS = 3
+# Verbatim turns are also compacted (all but the last one) once they grow past this
+MAX_HISTORY_CHARS = 12000
+MAX_SUMMARY_CHARS = 4000
+# Retained results beyond this are dropped, lowest relevance first
+MAX_RESULTS = 40
+
+_compaction_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gennie-compaction")
+
+def sufficiency_prompt():
+    return """
+        You are routing a follow-up question in a conversation about web search results. You will receive the search results already collected, followed by the conversation so far and the new question.
+
+        Decide whether those results contain what is needed to answer the new question.
+
+        Output exactly one line, with no other text:
+            ANSWER - when the results are enough to answer the question
+            SEARCH: <question> - when new web results are needed; rewrite the question so it is understandable without the conversation
+    """
+
+def parse_sufficiency(response):
+    """Returns None when the retained context suffices, otherwise the standalone question to search for."""
+    match = re.search(r"SEARCH\s*:\s*(.+)", response or "", re.IGNORECASE)
+    if match:
+        return match.group(1).strip().strip('"')
+    if not re.search(r"\bANSWER\b", response or "", re.IGNORECASE):
+        logr(f"Unexpected routing reply, answering from the retained results: {response!r}")
+    return None
+
+def compaction_prompt():
+    return f"""
+        You maintain the memory of a conversation between a user and an answer engine. You will receive the current summary of the conversation, possibly empty, followed by the turns to add to it.
+
+        Write an updated summary, at most {MAX_SUMMARY_CHARS // 6} words, that keeps the questions asked, the key facts, numbers, code and URLs given in the answers, and any preference the user stated. Drop greetings and repetition. Output only the summary.
+    """
+
+def context_token_budget(model_id):
+    """Default token budget for the search results sent to model_id."""
+    return GEMINI_CONTEXT_TOKEN_BUDGET if model_router.resolve_provider(model_id) == "gemini" else CONTEXT_TOKEN_BUDGET
+
+def format_turns(turns):
+    return "\n\n".join(f"Question: {turn['question']}\nAnswer: {turn['answer']}" for turn in turns)
+
+class ConversationSession:
+    """A chat about one set of search results.
+
+    The first question runs the full search pipeline; the SearchResults it fetched (their
+    markdown and relevance scores) are kept, and follow-ups are answered from them. Before
+    each follow-up the router model decides whether that context is enough; when it is not,
+    a new search is run for a standalone version of the question and its results join the
+    retained ones. Turns older than max_recent_turns are summarized in the background so the
+    prompt stays bounded. context_token_budget defaults to the one for the current model.
+
+    search_options are passed to gennie_core.gather_search_results (max_workers,
+    relevance_model_id, batch_relevance, streaming_fetch, max_rounds...).
+    """
+    def __init__(self, model_id, num_results=5, date_restrict="y2", router_model_id=ROUTER_MODEL_ID, context_token_budget=None,
+                 max_recent_turns=MAX_RECENT_TURNS, min_score=context_packer.MIN_RELEVANCE_SCORE, index_path=None, **search_options):
+        self.model_id = model_id
+        self.num_results = num_results
+        self.date_restrict = date_restrict
+        self.router_model_id = router_model_id
+        self.context_token_budget = context_token_budget
+        self.max_recent_turns = max_recent_turns
+        self.min_score = min_score
+        self.index_path = index_path
+        self.search_options = search_options
+        self.reset()
+
+    def reset(self):
+        """Forgets the retained results and the conversation."""
+        self.search_results = []
+        self.urls = set()
+        self.turns = []
+        self.summary = ""
+        self.searches = 0
+        self.payload = None
+        self._compaction = None
+
+    def history(self):
+        """The conversation so far, as passed to the summary prompt."""
+        self._apply_compaction()
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        if self.turns:
+            parts.append(format_turns(self.turns))
+        return "\n\n".join(parts) or None
+
+    def _search(self, question):
+        self.searches += 1
+        results = gennie_core.search_local_index(question, self.index_path) if self.index_path else []
+        results = results or gennie_core.gather_search_results(question, self.model_id, self.num_results, 1, self.date_restrict, **self.search_options)
+        added = 0
+        for result in results:
+            url = normalize_url(result.link or "")
+            if url in self.urls or not result.markdown:
+                continue
+            self.urls.add(url)
+            self.search_results.append(result)
+            added += 1
+        if len(self.search_results) > MAX_RESULTS:
+            self.search_results = context_packer.rank_search_results(self.search_results, min_score=0)[:MAX_RESULTS]
+            self.urls = {normalize_url(r.link or "") for r in self.search_results}
+        if added:
+            self.payload = None
+        logr(f"conversation: {added} new results retained, {len(self.search_results)} in total")
+
+    def needs_search(self, question, history):
+        """Asks the router model whether the retained results can answer question; returns
+        None when they can, otherwise the standalone question to search for."""
+        if not self.search_results:
+            return question
+        context = context_packer.pack_search_results(self.search_results, question, ROUTER_TOKEN_BUDGET, self.min_score)
+        if not context:
+            return question
+        with tracing.span("sufficiency_check", model=self.router_model_id) as span:
+            try:
+                response = model_router.run_text_inference(context, sufficiency_prompt(), "string", self.router_model_id,
+                                                           question=f"[CONVERSATION]\n{history}\n\n[NEW QUESTION]\n{question}")
+            except Exception as e:
+                logr(f"Routing failed, answering from the retained results: {e}")
+                response = None
+            search_question = parse_sufficiency(response)
+            span.set(search=search_question is not None)
+        return search_question
+
+    def _prepare(self, question):
+        history = self.history()
+        search_question = self.needs_search(question, history)
+        if search_question is not None:
+            logr(f"conversation: searching for {search_question!r}")
+            self._search(search_question)
+        tracing.counter("gennie_conversation_turns_total", searched=str(search_question is not None).lower())
+        if self.payload is None:
+            # Serialized once per set of results, for the question that fetched them, so follow-ups
+            # send the same context and read it from the provider's prompt cache
+            self.payload = gennie_core.serialize_search_results(self.search_results, question,
+                                                                self.context_token_budget or context_token_budget(self.model_id))
+        return self.payload, history
+
+    def ask(self, question):
+        """Answers question, searching only when the retained results are not enough."""
+        with tracing.span("conversation_turn", model=self.model_id, turn=len(self.turns) + 1):
+            payload, history = self._prepare(question)
+            answer = gennie_core.summarize_results(payload, question, self.model_id, history, cache_context=True)
+        self._add_turn(question, answer)
+        return answer
+
+    def ask_stream(self, question):
+        """Same as ask, yielding the answer as the model produces it."""
+        chunks = []
+        with tracing.span("conversation_turn", model=self.model_id, turn=len(self.turns) + 1, stream=True):
+            payload, history = self._prepare(question)
+            for chunk in gennie_core.summarize_results_stream(payload, question, self.model_id, history, cache_context=True):
+                chunks.append(chunk)
+                yield chunk
+        self._add_turn(question, "".join(chunks))
+
+    def _add_turn(self, question, answer):
+        self._apply_compaction()
+        self.turns.append({"question": question, "answer": answer})
+        count = len(self.turns) - self.max_recent_turns
+        if count <= 0 and len(format_turns(self.turns)) > MAX_HISTORY_CHARS:
+            count = len(self.turns) - 1
+        if count > 0:
+            # Runs while the user reads the answer; the next question waits for it
+            self._compaction = (count, _compaction_pool.submit(self._compact, self.summary, self.turns[:count]))
+
+    def _compact(self, summary, turns):
+        payload = f"[CURRENT SUMMARY]\n{summary}\n\n[TURNS]\n{format_turns(turns)}"
+        with tracing.span("compaction", model=self.router_model_id, turns=len(turns)):
+            try:
+                compacted = model_router.run_text_inference(payload, compaction_prompt(), "string", self.router_model_id)
+            except Exception as e:
+                logr(f"Failed to summarize the conversation, keeping the questions only: {e}")
+                compacted = " ".join(filter(None, [summary] + [f"Asked: {turn['question']}" for turn in turns]))
+        return (compacted or "").strip()[-MAX_SUMMARY_CHARS:]
+
+    def _apply_compaction(self):
+        if self._compaction is None:
+            return
+        count, future = self._compaction
+        self._compaction = None
+        self.summary = future.result()
+        del self.turns[:count]
@@ -2,103 +2,128 @@
 import argparse
 import sys
 import time
-import gemini_inference
-import claude_inference
-from usescraper_wrapper import create_scrape_job, get_job_info, get_scraped_data
-from shared import scraper_api, convert_integer_to_decimal, convert_string_to_list
+import token_counter
+from concurrent.futures import ThreadPoolExecutor
+from job_watcher import JobWatcher, WebhookReceiver
+import local_crawler
+import usescraper_wrapper
+from link_extractor import DEFAULT_EXCLUDES, extract_links, rerank_links
+from shared import scraper_api, convert_integer_to_decimal
 from shared import log_message as logr
 
+# Scrape job backends, all exposing create_scrape_job / get_job_info / get_scraped_data
+BACKENDS = {
+    "usescraper": usescraper_wrapper,
+    "local": local_crawler,
+}
+
 # DEPENDENCIES_FOLDER ='../../llm-agents' 
 # sys.path.append(DEPENDENCIES_FOLDER)
 
-def main(url, prompt, scrapeuse_token, download_folder, model_id):
-    # stage #1 Scraper
-    logr(f"starting stage #1 scraper")
-    crawler = scraper_api(url, "raw-html", 3000)
-    if not crawler.content:
-        logr(f"Crawling failed to return content!")
-        return False
+def discover_links(url, prompt, model_id, rerank=False, excludes=DEFAULT_EXCLUDES, path_prefix=None):
+    """Stage #1: lists the documentation URLs linked from url.
 
-    # if "html_body" not in crawler.content:
-    #     logr("error: HTML body not found in the result.")
-    #     return
+    Links are parsed from the page and scoped to its domain and to path_prefix (by default
+    the product folder, ex: /run). With rerank the model orders the extracted candidates.
+    Returns (topic, urls), or None when the page could not be fetched."""
+    crawler = scraper_api(url, "raw-html", 3000)
+    if not crawler.content or not isinstance(crawler.content, (str, bytes)):
+        # scraper_api reports failures as a dict instead of the page
+        logr(f"Crawling failed to return content for {url}! {crawler.content or ''}")
+        return None
 
     topic = crawler.url.split('/')[3]
-    payload = str(crawler.content)
-    if prompt is None:
-        prompt = f"""
-        You are a data extractor assistant. Your task is to extract all URLs under {topic}'s documentation following these rules:
-        - Do NOT include URLs related to Release Notes, REST API or SDK References.
-        - Only output URLs inthe same domain as {crawler.url}
-        - Avoid duplicated URLs
-        - Do NOT provide any comments along with the output
-        - It's mandatory to extract the full URL, containing schema (https) and the FQDN, ex: cloud.google.com. 
-        - Provide nothing but a list of URLs, enclosed by quotes, and separated by commas
-        """
-    else:
-        prompt = f"""
-        You are a data extractor assistant. Your task is to extract all URLs under {prompt}'s documentation following these rules:
-        - Do NOT include URLs related to Release Notes, REST API or SDK References.
-        - Only output URLs inthe same domain as {crawler.url}
-        - Avoid duplicated URLs
-        - Do NOT provide any comments along with the output
-        - It's mandatory to extract the full URL, containing schema (https) and the FQDN, ex: cloud.google.com. 
-        - Provide nothing but a list of URLs, enclosed by quotes, and separated by commas
-        """
-    logr('Trying to extract the link URLs from the HTML body ...')
-    # logr(f"prompt: {prompt}")
-    try:
-        if model_id.startswith("gemini"):
-            result = gemini_inference.run_text_inference(payload, prompt, "string", model_id)
-        else:
-            result = claude_inference.run_text_inference(payload, prompt, "string", model_id)   
-    except Exception as e:
-        logr(f"error: failed to generate content - {e}")
-        return
-    logr(f'result from stage #1 scraper: {result}')
-    result = convert_string_to_list(result)
-    logr(f'stage #1 scraper has returned {len(result)} URLs')
-    time.sleep(3)
+    result = extract_links(crawler.content, crawler.url, path_prefix=path_prefix or f"/{topic}", excludes=excludes)
+    logr(f'stage #1 scraper has extracted {len(result)} URLs for {topic}')
+    if rerank:
+        result = rerank_links(result, prompt or topic, model_id)
+        logr(f'stage #1 scraper has kept {len(result)} URLs for {topic} after reranking')
+    return topic, result
+
+def main(urls, prompt, scrapeuse_token, download_folder, model_id, timeout=3600, webhook_port=None, webhook_url=None,
+         rerank=False, excludes=DEFAULT_EXCLUDES, path_prefix=None, backend="usescraper", webhook_host="127.0.0.1", webhook_secret=None):
+    scraper = BACKENDS[backend]
+    if isinstance(urls, str):
+        urls = [urls]
+
+    # stage #1 Scraper
+    logr(f"starting stage #1 scraper for {len(urls)} URLs")
+    with ThreadPoolExecutor(max_workers=len(urls) or 1) as executor:
+        extracted = [r for r in executor.map(lambda u: discover_links(u, prompt, model_id, rerank, excludes, path_prefix), urls) if r]
+    if not extracted:
+        logr("stage #1 scraper returned no URLs")
+        return False
 
     # stage #2 Scraper
+    receiver = WebhookReceiver(webhook_host, webhook_port, webhook_secret).start() if webhook_port else None
+    if receiver and webhook_url:
+        webhook_url = receiver.callback_url(webhook_url)
     try:
-        job_id = create_scrape_job(result, scrapeuse_token, "markdown")
-        logr(f"stage #2 job created with ID: {job_id}")
-    except Exception as e:
-        logr(f"error: Failed to stage #2 scraper job - {e}")
-        return
-    
-    # Check job status
-    while True:
-        r = get_job_info(job_id, scrapeuse_token)
-        status = r["status"]
-        logr(f"stage #2 job status: {status}")
-        if status == 'succeeded':
-            break
-        time.sleep(10)
+        jobs = {}
+        for topic, links in extracted:
+            if not links:
+                logr(f"stage #1 scraper found no URLs for {topic}, skipping")
+                continue
+            try:
+                if backend == "local":
+                    job_id = scraper.create_scrape_job(links, output_format="markdown", excludes=excludes,
+                                                       path_prefix=path_prefix or f"/{topic}")
+                else:
+                    job_id = scraper.create_scrape_job(links, scrapeuse_token, "markdown", webhook_url=webhook_url)
+            except Exception as e:
+                logr(f"error: Failed to stage #2 scraper job for {topic} - {e}")
+                continue
+            if job_id:
+                logr(f"stage #2 job created for {topic} with ID: {job_id}")
+                jobs[job_id] = topic
+        if not jobs:
+            return False
+
+        watcher = JobWatcher(scraper.get_job_info, scrapeuse_token, timeout=timeout, receiver=receiver,
+                             progress=lambda job_id, status, info: logr(f"stage #2 job {jobs[job_id]} ({job_id}) status: {status}"))
+        outcomes = watcher.watch_many(jobs)
+    finally:
+        if receiver:
+            receiver.stop()
 
     # Download the content
-    output_path = f'{download_folder}/{int(time.time())}-{topic}-scrapejob.md'
-    get_scraped_data(job_id, scrapeuse_token, output_path, json_output=True)
-    logr(f"stage #2 scraper data downloaded to: {output_path}")
+    output_paths = []
+    for job_id, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            continue
+        output_path = f'{download_folder}/{int(time.time())}-{jobs[job_id]}-scrapejob.md'
+        if scraper.get_scraped_data(job_id, scrapeuse_token, output_path, json_output=True) is None:
+            logr(f"error: Failed to download stage #2 data for {jobs[job_id]} ({job_id})")
+            continue
+        logr(f"stage #2 scraper data downloaded to: {output_path}")
+        output_paths.append(output_path)
 
-    with open(output_path, "r") as f:
-        payload = f.read()
-        if model_id.startswith("gemini"):
-            r = gemini_inference.count_chars_and_tokens(model_id, payload)
-        else:
-            r = claude_inference.count_chars_and_tokens(model_id, payload)
-        logr(f"characters: {convert_integer_to_decimal(r['num_chars'])}")
-        logr(f"tokens: {convert_integer_to_decimal(r['num_tokens'])}")
+    for output_path in output_paths:
+        r = token_counter.count_file_tokens(output_path, model_id)
+        for document in sorted(r["documents"], key=lambda d: -d["num_tokens"])[:10]:
+            logr(f"{document['url']} tokens: {convert_integer_to_decimal(document['num_tokens'])}")
+        logr(f"{output_path} characters: {convert_integer_to_decimal(r['num_chars'])}")
+        logr(f"{output_path} tokens: {convert_integer_to_decimal(r['num_tokens'])}{' (estimated)' if r['estimated'] else ''}")
+    return output_paths
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Web Scraper Script")
-    parser.add_argument("-u", "--url", type=str, help="URL to scrape")
-    parser.add_argument("-p", "--prompt", type=str, default=None, help="Prompt for data extraction")
+    parser.add_argument("-u", "--url", type=str, nargs="+", help="URLs to scrape, one scrape job per URL")
+    parser.add_argument("-p", "--prompt", type=str, default=None, help="Topic used to rerank the extracted URLs")
     parser.add_argument("-t", "--scrapeuse_token", type=str, help="SCRAPEUSE_TOKEN for authentication")
     parser.add_argument("-f", "--folder", type=str, default="/mnt/genai/scraper_downloads",help="Download folder")
     parser.add_argument("-m", "--model", type=str, default="gemini-1.5-flash-001", help="Model for inference")
+    parser.add_argument("--rerank", action="store_true", help="Let the model rerank the extracted URLs")
+    parser.add_argument("--exclude", type=str, nargs="*", default=DEFAULT_EXCLUDES, help="Glob (or re:regex) path patterns to skip")
+    parser.add_argument("--path_prefix", type=str, default=None, help="Only keep URLs under this path (default: /<product>)")
+    parser.add_argument("--backend", type=str, default="usescraper", choices=sorted(BACKENDS), help="Where stage #2 crawls run")
+    parser.add_argument("--timeout", type=int, default=3600, help="Seconds to wait for the scrape jobs")
+    parser.add_argument("--webhook_port", type=int, default=None, help="Receive job status callbacks on this port")
+    parser.add_argument("--webhook_url", type=str, default=None, help="Public URL of the webhook receiver; the secret is appended to it")
+    parser.add_argument("--webhook_host", type=str, default="127.0.0.1", help="Interface the webhook receiver listens on")
+    parser.add_argument("--webhook_secret", type=str, default=None, help="Shared secret webhook callbacks must carry (random by default)")
 
     args = parser.parse_args()
-    main(args.url, args.prompt, args.scrapeuse_token, args.folder, args.model)
\ No newline at end of file
+    main(args.url, args.prompt, args.scrapeuse_token, args.folder, args.model, args.timeout, args.webhook_port, args.webhook_url,
+         args.rerank, args.exclude, args.path_prefix, args.backend, args.webhook_host, args.webhook_secret)
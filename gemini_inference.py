@@ -1,58 +1,172 @@
 import argparse
-import os
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part, FinishReason
+import asyncio
+import datetime
+import hashlib
+import threading
+import time
 import vertexai.preview.generative_models as generative_models
 from bs4 import BeautifulSoup
 
 # Modules
 from shared import log_message as logr
+import llm_clients
+from async_inference import bounded
+import tracing
 
 def count_chars_and_tokens(model_id, content):
-    model = GenerativeModel(model_id)
+    model = llm_clients.gemini_model(model_id)
     num_chars = len(content)
     num_tokens = model.count_tokens(content).total_tokens
     return { "num_chars" : num_chars, "num_tokens" : num_tokens } 
 
-def run_text_inference(payload, prompt, type, model_id, verbose=False):
-    # Initialize Vertex AI
-    vertexai.init(project=os.getenv("VERTEX_IA_PROJECT"), location=os.getenv("VERTEX_IA_REGION"))
-
+def extract_body_text(payload, type):
     # Extract the body content using BeautifulSoup if payload is from a file
     if type == "file":
         with open(payload, "r") as html_file:
             payload = html_file.read()
         soup = BeautifulSoup(payload, 'html.parser')
-        body_text = soup.body.get_text()
-    else:
-        body_text = payload
-
-    # Define generation and safety settings
-    generation_config = {
-        "max_output_tokens": 8192,
-        "temperature": 1,
-        "top_p": 0.95,
-    }
-
-    safety_settings = {
-        generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_NONE,
-        generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_NONE,
-        generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_NONE,
-        generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_NONE,
-    }
-
-    # Load the generative model
-    model = GenerativeModel(model_id)
+        return soup.body.get_text()
+    return payload
+
+# Define generation and safety settings
+GENERATION_CONFIG = {
+    "max_output_tokens": 8192,
+    "temperature": 1,
+    "top_p": 0.95,
+}
+
+SAFETY_SETTINGS = {
+    generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_NONE,
+    generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_NONE,
+    generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_NONE,
+    generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_NONE,
+}
+
+def generation_config(temperature=None, max_tokens=None):
+    config = dict(GENERATION_CONFIG)
+    if temperature is not None:
+        config["temperature"] = temperature
+    if max_tokens:
+        config["max_output_tokens"] = max_tokens
+    return config
+
+# Vertex AI only accepts cached contents of at least this many tokens (about 4 characters each)
+CONTEXT_CACHE_MIN_TOKENS = 32768
+CHARS_PER_TOKEN = 4
+CONTEXT_CACHE_TTL = 15 * 60
+
+_context_caches = {}
+_context_caches_lock = threading.Lock()
+
+def build_contents(body_text, prompt, question=None):
+    # Instructions, then the content, then the question: what calls repeat comes first
+    return [part for part in (prompt, body_text, question) if part]
+
+def cached_context(model_id, prompt, body_text):
+    """Returns a Vertex AI CachedContent holding prompt (as system instruction) and body_text, or None.
+
+    A context is only cached the second time it is sent within CONTEXT_CACHE_TTL, since a
+    first send does not show it will be reused, and only when it is long enough for
+    Vertex AI to accept it. Caches are kept until shortly before they expire.
+    """
+    if len(prompt) + len(body_text) < CONTEXT_CACHE_MIN_TOKENS * CHARS_PER_TOKEN:
+        logr(f"Context of {len(body_text)} characters is below the Vertex AI cache minimum of {CONTEXT_CACHE_MIN_TOKENS} tokens, not cached")
+        return None
+    key = hashlib.sha256("\0".join((model_id, prompt, body_text)).encode()).hexdigest()
+    now = time.time()
+    with _context_caches_lock:
+        for stale in [k for k, entry in _context_caches.items() if entry["expires_at"] <= now]:
+            del _context_caches[stale]
+        entry = _context_caches.get(key)
+        if entry is None:
+            _context_caches[key] = {"cache": None, "state": "seen", "expires_at": now + CONTEXT_CACHE_TTL}
+            return None
+        if entry["state"] != "seen":
+            return entry["cache"]
+        entry["state"] = "creating"
+    try:
+        from vertexai.preview import caching
+        llm_clients.gemini_model(model_id)  # Initializes Vertex AI for the project
+        cache = caching.CachedContent.create(model_name=model_id, system_instruction=prompt, contents=[body_text],
+                                             ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL))
+        logr(f"Context of {len(body_text)} characters cached on Vertex AI: {cache.name}")
+    except Exception as e:
+        logr(f"Failed to cache the context on Vertex AI: {e}")
+        cache = None
+    with _context_caches_lock:
+        # A failed context is not retried until its entry expires
+        _context_caches[key] = {"cache": cache, "state": "cached" if cache else "failed", "expires_at": time.time() + CONTEXT_CACHE_TTL - 60}
+    return cache
+
+def _model_and_contents(model, cache, body_text, prompt, question):
+    # With a cached context only the question is sent; the cache holds the instructions and content
+    if cache is None:
+        return model, build_contents(body_text, prompt, question)
+    from vertexai.preview.generative_models import GenerativeModel
+    return GenerativeModel.from_cached_content(cached_content=cache), [question or "Follow the instructions."]
+
+def _record_usage(model_id, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        tracing.record_usage("gemini", model_id, usage.prompt_token_count, usage.candidates_token_count,
+                             cache_read=getattr(usage, "cached_content_token_count", None))
+
+def run_text_inference(payload, prompt, type, model_id, verbose=False, temperature=1, max_tokens=None, question=None, cache_context=False):
+    body_text = extract_body_text(payload, type)
+
+    # Shared generative model (Vertex AI initialized once per project/region), or one reading a cached context
+    cache = cached_context(model_id, prompt, body_text) if cache_context else None
+    model, contents = _model_and_contents(llm_clients.gemini_model(model_id), cache, body_text, prompt, question)
     if verbose:
         print(f'PROMPT: {prompt}')
         print(f'PROMPT SIZE: {len(prompt)}')
     # Generate content
     response = model.generate_content(
-        [body_text, prompt],
-        generation_config=generation_config,
-        safety_settings=safety_settings,
+        contents,
+        generation_config=generation_config(temperature, max_tokens),
+        safety_settings=SAFETY_SETTINGS,
         stream=False,
     )
+    _record_usage(model_id, response)
+    if verbose:
+        logr(response.candidates[0].content.parts[0].text)
+    return response.candidates[0].content.parts[0].text
+
+def stream_text_inference(payload, prompt, type, model_id, verbose=False, temperature=1, max_tokens=None, question=None, cache_context=False):
+    """Generator variant of run_text_inference yielding text as it is produced."""
+    body_text = extract_body_text(payload, type)
+    cache = cached_context(model_id, prompt, body_text) if cache_context else None
+    model, contents = _model_and_contents(llm_clients.gemini_model(model_id), cache, body_text, prompt, question)
+    responses = model.generate_content(
+        contents,
+        generation_config=generation_config(temperature, max_tokens),
+        safety_settings=SAFETY_SETTINGS,
+        stream=True,
+    )
+    chunk = None
+    for chunk in responses:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. a final finish_reason chunk)
+            continue
+        if verbose:
+            print(text, end="", flush=True)
+        yield text
+    # The last chunk carries the usage of the whole response
+    _record_usage(model_id, chunk)
+
+async def run_text_inference_async(payload, prompt, type, model_id, verbose=False, timeout=None, temperature=1, max_tokens=None, question=None, cache_context=False):
+    body_text = extract_body_text(payload, type)
+    # Creating the cache is a blocking call
+    cache = await asyncio.to_thread(cached_context, model_id, prompt, body_text) if cache_context else None
+    model, contents = _model_and_contents(llm_clients.async_gemini_model(model_id), cache, body_text, prompt, question)
+    response = await bounded(model.generate_content_async(
+        contents,
+        generation_config=generation_config(temperature, max_tokens),
+        safety_settings=SAFETY_SETTINGS,
+    ), timeout)
+    _record_usage(model_id, response)
     if verbose:
         logr(response.candidates[0].content.parts[0].text)
     return response.candidates[0].content.parts[0].text
@@ -1,33 +1,45 @@
+import asyncio
+import contextvars
+import json
 import requests
 import time
 import re
 import argparse
 import os
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from IPython.display import Markdown, display
 
 # My modules
-import gemini_inference, claude_inference
-from shared import web_crawler
+import context_packer
+import http_session
+import llm_clients
+import model_router
+import page_cache
+import tracing
+from shared import web_crawler, html2markdown, html2markdown_stream, stream_raw_html, normalize_url
 from shared import log_message as logr
 
 class SearchResult:
-    def __init__(self, json_data, question, llm_model, verbose=False):
+    def __init__(self, json_data, question, llm_model, verbose=False, evaluate=True, cache=None, streaming_fetch=False):
         self.json_data = json_data
         self.question = question
         self.llm_model = llm_model
         self.verbose = verbose
+        self.evaluate = evaluate
+        self.streaming_fetch = streaming_fetch
+        self.cache = cache if cache is not None else page_cache.get_default_cache()
         self.title = None
         self.link = None
         self.raw_content = None
         self.markdown = None
         self.relevance = None
+        self.relevance_score = None
         self.extract_search_info()
         
-    def to_string(self):
+    def to_string(self, content=None):
         return (
             f"Title: {self.title}\n\n"
-            f"Content: {self.markdown}\n\n"
+            f"Content: {self.markdown if content is None else content}\n\n"
             f"URL: {self.link}\n\n"
             f"Relevance: {self.relevance}\n"
         )
@@ -49,26 +61,64 @@ class SearchResult:
         self.link = item.get('link', '')
         if self.link:
             try:
-                self.raw_content = self.fetch_raw_content(self.link)
-                self.markdown = self.convert_to_markdown(self.raw_content)
-                self.relevance = self.evaluate_relevance(self.markdown, self.question, self.llm_model)
+                cached = self.cache.get(self.link) if self.cache else None
+                if self.cache:
+                    tracing.counter("gennie_page_cache_requests_total", result="hit" if cached else "miss")
+                if cached and cached["markdown"] is not None:
+                    # Repeat URL: skip both the crawler round-trip and the conversion
+                    logr(f"page cache hit for: {self.link}")
+                    self.markdown = cached["markdown"]
+                elif self.streaming_fetch and not (cached and cached["html"]):
+                    self.markdown = self.fetch_markdown_streaming(self.link)
+                    if self.cache and self.markdown is not None:
+                        self.cache.put(self.link, markdown=self.markdown)
+                else:
+                    self.raw_content = cached["html"] if cached and cached["html"] else self.fetch_raw_content(self.link)
+                    self.markdown = self.convert_to_markdown(self.raw_content)
+                    if self.cache and self.markdown is not None:
+                        self.cache.put_markdown(self.link, self.markdown)
+                if self.evaluate:
+                    self.relevance = self.evaluate_relevance(self.markdown, self.question, self.llm_model)
+                    self.relevance_score = parse_relevance_score(self.relevance)
             except Exception as e:
                 logr(f"Error processing result for link {self.link}: {e}")
 
     def fetch_raw_content(self, url):
         logr(f"fetching raw content for: {url}")
         try:
-            return web_crawler(url).content["html_body"]
+            with tracing.span("fetch", url=url) as span:
+                html = web_crawler(url).content["html_body"]
+                span.set(bytes=len(html or ""))
+            tracing.counter("gennie_fetch_bytes_total", len(html or ""))
+            if self.cache and html:
+                self.cache.put(url, html=html)
+            return html
         except Exception as e:
             logr(f"Failed to fetch raw content for {url}: {e}")
             return None
 
+    def fetch_markdown_streaming(self, url):
+        # The page is converted chunk by chunk as it arrives; raw HTML is never held whole
+        logr(f"streaming and converting: {url}")
+        try:
+            start_time = time.time()
+            with tracing.span("fetch_convert", url=url) as span:
+                m = html2markdown_stream(stream_raw_html(url))
+                span.set(chars=len(m or ""))
+            if self.verbose:
+                logr(f"fetch_markdown_streaming execution time: {round(time.time() - start_time, 5)} seconds")
+            return m
+        except Exception as e:
+            logr(f"Failed to stream and convert {url}: {e}")
+            return None
+
     def convert_to_markdown(self, raw_content):
         logr("Converting raw HTML to markdown")
         try:
             start_time = time.time()
             # m = html2markdown2(raw_content, self.llm_model)
-            m = html2markdown(raw_content)
+            with tracing.span("convert", url=self.link, bytes=len(raw_content or "")):
+                m = html2markdown(raw_content)
             del self.raw_content
             end_time = time.time()
             if self.verbose:
@@ -82,26 +132,9 @@ class SearchResult:
         try:
             logr(f"evaluating the relevance of the content scraped ...")
             start_time = time.time()
-            PROMPT = f"""
-                You are an advanced AI assistant specialized in analyzing web search results. Please perform the following tasks:
-
-                1. Make sense of all the information provided. Ingest the data thoughtfully and make your own conclusions.
-
-                2. Provide a concise and blunt review of the content provided
-
-                3. Relevance score:
-                Assign a relevance score from 1 to 5 (where 1 is least relevant and 5 is most relevant). Provide a score based on how relevant is the content related to the user's question: {question}.
-
-                4. Format your output as follows:
-                    evaluation : <Direct and blunt review of the content>,
-                    score : <relevance Score [1-5]>
-                5. Do NOT output nothing but the json as instructed.
-                6. Remember to base your responses solely on the provided data and maintain a neutral, informative tone.
-            """
-            if llm_model.startswith("gemini"):
-                content_check = gemini_inference.run_text_inference(markdown, PROMPT, "string", llm_model)
-            else:
-                content_check = claude_inference.run_text_inference(markdown, PROMPT, "string", llm_model)
+            PROMPT = relevance_prompt()
+            with tracing.span("relevance", url=self.link, model=llm_model):
+                content_check = model_router.run_text_inference(markdown, PROMPT, "string", llm_model, question=question_message(question))
             end_time = time.time()
             if self.verbose:
                 logr(f"evaluate_relevance execution time: {round(end_time - start_time, 5)} seconds")
@@ -110,6 +143,159 @@ class SearchResult:
             logr(f"Failed to evaluate relevance: {e}")
             return None
 
+    async def evaluate_relevance_async(self, timeout=None):
+        if not self.markdown:
+            return None
+        try:
+            start_time = time.time()
+            PROMPT = relevance_prompt()
+            with tracing.span("relevance", url=self.link, model=self.llm_model):
+                self.relevance = await model_router.run_text_inference_async(self.markdown, PROMPT, "string", self.llm_model, timeout=timeout,
+                                                                             question=question_message(self.question))
+            self.relevance_score = parse_relevance_score(self.relevance)
+            if self.verbose:
+                logr(f"evaluate_relevance_async execution time: {round(time.time() - start_time, 5)} seconds")
+        except asyncio.TimeoutError:
+            logr(f"Relevance evaluation timed out for {self.link}")
+        except Exception as e:
+            logr(f"Failed to evaluate relevance: {e}")
+        return self.relevance
+
+
+# Prompts hold only fixed instructions; the question is sent after the content (question_message),
+# so instructions and content form a prefix providers can cache across calls
+def question_message(question):
+    return f"User's question: {question}"
+
+def relevance_prompt():
+    return """
+        You are an advanced AI assistant specialized in analyzing web search results. Please perform the following tasks:
+
+        1. Make sense of all the information provided. Ingest the data thoughtfully and make your own conclusions.
+
+        2. Provide a concise and blunt review of the content provided
+
+        3. Relevance score:
+        Assign a relevance score from 1 to 5 (where 1 is least relevant and 5 is most relevant). Provide a score based on how relevant is the content related to the user's question, given after the content.
+
+        4. Format your output as follows:
+            evaluation : <Direct and blunt review of the content>,
+            score : <relevance Score [1-5]>
+        5. Do NOT output nothing but the json as instructed.
+        6. Remember to base your responses solely on the provided data and maintain a neutral, informative tone.
+    """
+
+def parse_relevance_score(relevance):
+    """Extracts the 1-5 score from a free-form "evaluation / score" reply."""
+    if not relevance:
+        return None
+    match = re.search(r'score"?\s*[:=]\s*"?\s*([1-5])\b', relevance, re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+def batch_relevance_prompt():
+    return """
+        You are an advanced AI assistant specialized in analyzing web search results. You will receive several documents, each enclosed by [DOCUMENT <id>] and [/DOCUMENT <id>] markers. For every document:
+
+        1. Provide a concise and blunt review of its content.
+
+        2. Assign a relevance score from 1 to 5 (where 1 is least relevant and 5 is most relevant) based on how relevant the content is to the user's question, given after the documents.
+
+        3. Format your output as a JSON array with exactly one object per document:
+            [{"id": <document id>, "evaluation": "<direct and blunt review>", "score": <relevance score [1-5]>}]
+        4. Do NOT output anything but the JSON array.
+        5. Base your responses solely on the provided data and maintain a neutral, informative tone.
+    """
+
+# Local token estimate used to size relevance batches
+CHARS_PER_TOKEN = 4
+BATCH_TOKEN_BUDGET = 24000
+BATCH_MAX_DOC_TOKENS = 3000
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def parse_batch_scores(response, document_ids):
+    """Parses the JSON array returned for a relevance batch into {id: (score, evaluation)}.
+
+    Entries with unknown ids or scores outside 1-5 are discarded.
+    """
+    start, end = response.find('['), response.rfind(']')
+    if start == -1 or end < start:
+        return {}
+    try:
+        items = json.loads(response[start:end + 1])
+    except ValueError:
+        return {}
+    scores = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            doc_id = int(item.get("id"))
+            score = int(float(item.get("score")))
+        except (TypeError, ValueError, OverflowError):
+            # OverflowError: json reads Infinity as a float
+            continue
+        if doc_id in document_ids and 1 <= score <= 5:
+            scores[doc_id] = (score, str(item.get("evaluation", "")).strip())
+    return scores
+
+def _pack_relevance_batches(search_results, token_budget, max_doc_tokens):
+    batches, batch, used = [], [], 0
+    for result in search_results:
+        content = result.markdown[:max_doc_tokens * CHARS_PER_TOKEN]
+        tokens = estimate_tokens(content) + estimate_tokens(f"{result.title} {result.link}")
+        if batch and used + tokens > token_budget:
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append((result, content))
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _format_relevance_batch(batch):
+    return "\n\n".join(
+        f"[DOCUMENT {doc_id}]\nTitle: {result.title}\nURL: {result.link}\nContent: {content}\n[/DOCUMENT {doc_id}]"
+        for doc_id, (result, content) in enumerate(batch)
+    )
+
+def evaluate_relevance_batch(search_results, question, model_id, token_budget=BATCH_TOKEN_BUDGET, max_doc_tokens=BATCH_MAX_DOC_TOKENS, verbose=False, budget=None):
+    """Scores several search results per LLM call.
+
+    Trimmed markdowns are packed into prompts of up to token_budget (estimated) tokens,
+    and the structured reply sets relevance and relevance_score on each result. Results
+    the model skipped or scored invalidly fall back to one evaluate_relevance call each.
+    Every call made is charged to budget (a SearchBudget) when one is given.
+    """
+    pending = [r for r in search_results if r.markdown]
+    for batch in _pack_relevance_batches(pending, token_budget, max_doc_tokens):
+        start_time = time.time()
+        payload = _format_relevance_batch(batch)
+        if budget:
+            budget.charge(llm_calls=1)
+        try:
+            with tracing.span("relevance_batch", documents=len(batch), model=model_id):
+                response = model_router.run_text_inference(payload, batch_relevance_prompt(), "string", model_id, question=question_message(question))
+            scores = parse_batch_scores(response or "", set(range(len(batch))))
+        except Exception as e:
+            logr(f"Failed to evaluate relevance batch: {e}")
+            scores = {}
+        if verbose:
+            logr(f"relevance batch of {len(batch)} scored in {round(time.time() - start_time, 5)} seconds")
+        for doc_id, (result, _) in enumerate(batch):
+            if doc_id in scores:
+                score, evaluation = scores[doc_id]
+                result.relevance = f"evaluation : {evaluation},\nscore : {score}"
+                result.relevance_score = score
+            else:
+                logr(f"no valid batch score for {result.link}, scoring it individually")
+                if budget:
+                    budget.charge(llm_calls=1)
+                result.relevance = result.evaluate_relevance(result.markdown, question, model_id)
+                result.relevance_score = parse_relevance_score(result.relevance)
+    return search_results
+
 def llm_based_html2markdown(html, model_id):
     HTML_BODY_EXTRACTOR_PROMPT = """
         You are an expert HTML parser and markdown converter. Your task is to take raw HTML code as input, extract only the relevant content from the HTML body, and convert it to markdown format. Follow these steps:
@@ -130,87 +316,83 @@ def llm_based_html2markdown(html, model_id):
         6. Preserve the overall structure and hierarchy of the content.
         7. Output the resulting markdown-formatted text.
     """
-    if model_id.startswith("gemini"):
-        markdown = gemini_inference.run_text_inference(html, HTML_BODY_EXTRACTOR_PROMPT, "string", model_id)
-    else:
-        markdown = claude_inference.run_text_inference(html, HTML_BODY_EXTRACTOR_PROMPT, "string", model_id)
+    markdown = model_router.run_text_inference(html, HTML_BODY_EXTRACTOR_PROMPT, "string", model_id)
     return markdown
 
-def html2markdown(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    # Remove unnecessary elements
-    for element in soup(['script', 'style', 'header', 'footer', 'nav']):
-        element.decompose()
-    body = soup.body if soup.body else soup
-    def convert_element(element):
-        if element.name is None:
-            return element.string
-        if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-            return f"{'#' * int(element.name[1])} {element.get_text().strip()}\n\n"
-        if element.name == 'p':
-            return f"{element.get_text().strip()}\n\n"
-        if element.name == 'a':
-            return f"[{element.get_text()}]({element.get('href', '')})"
-        if element.name == 'img':
-            return f"![{element.get('alt', '')}]({element.get('src', '')})"
-        if element.name in ['ul', 'ol']:
-            items = []
-            for i, li in enumerate(element.find_all('li', recursive=False)):
-                prefix = '- ' if element.name == 'ul' else f"{i+1}. "
-                items.append(f"{prefix}{convert_element(li).strip()}")
-            return '\n'.join(items) + '\n\n'
-        if element.name in ['strong', 'b']:
-            return f"**{element.get_text()}**"
-        if element.name in ['em', 'i']:
-            return f"*{element.get_text()}*"
-        if element.name == 'code':
-            return f"`{element.get_text()}`"
-        if element.name == 'pre':
-            return f"```\n{element.get_text()}\n```\n\n"
-        return ''.join(convert_element(child) for child in element.children)
-    markdown = convert_element(body)
-    # Clean up extra newlines
-    markdown = re.sub(r'\n{3,}', '\n\n', markdown)
-    return markdown.strip()
-
-def get_search_query(question, model_id):
-    logr(f"Generating Google Search Query for: {question}")
-    PROMPT = f"""
+def search_query_prompt(question, previous_queries=None):
+    prompt = f"""
     You are very creative and sharp. You have mastered the skills related to finding information on the web, knowing every trick to get relevant results from Google search. Your task is to provide the best search query to submit on Google Search to obtain the most relevant results for this question: {question}. Output only the search query. Do not include line breaks, quotes, or any comments.
     """
-    search_string = gemini_inference.run_text_inference(question, PROMPT, 'string', model_id)
+    if previous_queries:
+        tried = "; ".join(previous_queries)
+        prompt += f"""
+    These queries were already tried and did not bring relevant results: {tried}. Provide a different query approaching the question from another angle.
+    """
+    return prompt
+
+def get_search_query(question, model_id, previous_queries=None):
+    logr(f"Generating Google Search Query for: {question}")
+    PROMPT = search_query_prompt(question, previous_queries)
+    with tracing.span("query_generation", model=model_id):
+        search_string = model_router.run_text_inference(question, PROMPT, 'string', model_id)
     return search_string
 
-def google_search(query, api_key, cx, num_results, start_index, date_restrict='y2'):
-    logr(f"Obtaining search results for: {query}")
-    base_url = "https://www.googleapis.com/customsearch/v1"
+async def get_search_query_async(question, model_id, timeout=None):
+    logr(f"Generating Google Search Query for: {question}")
+    PROMPT = search_query_prompt(question)
+    with tracing.span("query_generation", model=model_id):
+        return await model_router.run_text_inference_async(question, PROMPT, 'string', model_id, timeout=timeout)
 
-    results = []
+# Custom Search never returns results past position 100
+SEARCH_MAX_POSITION = 100
 
-    while len(results) < num_results:
-        params = {
-            'q': query,
-            'key': api_key,
-            'cx': cx,
-            'num': min(10, num_results - len(results)),  # API allows max 10 results per request
-            'start': start_index,
-            'dateRestrict' : date_restrict
-        }
+def _search_page(base_url, params):
+    response = http_session.get(base_url, params=params)
+    response.raise_for_status()
+    return response.json()
 
-        try:
-            response = requests.get(base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+def google_search(query, api_key, cx, num_results, start_index, date_restrict='y2'):
+    with tracing.span("search", query=query, start_index=start_index) as span:
+        results = _google_search(query, api_key, cx, num_results, start_index, date_restrict)
+        span.set(results=len(results))
+    return results
 
-            if 'items' in data:
-                results.extend(data['items'])
-                start_index += len(data['items'])
-            else:
+def _google_search(query, api_key, cx, num_results, start_index, date_restrict):
+    logr(f"Obtaining search results for: {query}")
+    base_url = "https://www.googleapis.com/customsearch/v1"
+    params = {
+        'q': query,
+        'key': api_key,
+        'cx': cx,
+        'dateRestrict' : date_restrict
+    }
+
+    # The first page tells how many results exist; the remaining pages are fetched in parallel
+    try:
+        data = _search_page(base_url, dict(params, num=min(10, num_results), start=start_index))  # API allows max 10 results per request
+    except requests.exceptions.RequestException as e:
+        logr(f"An error occurred: {e}")
+        return []
+    results = data.get('items', [])
+    if not results or len(results) >= num_results:
+        return results[:num_results]
+
+    total = int(data.get('searchInformation', {}).get('totalResults', 0) or 0)
+    last_position = min(start_index + num_results, start_index + total, SEARCH_MAX_POSITION + 1)
+    starts = range(start_index + len(results), last_position, 10)
+    if not starts:
+        return results[:num_results]
+    with ThreadPoolExecutor(max_workers=len(starts)) as executor:
+        pages = [executor.submit(_search_page, base_url, dict(params, num=min(10, last_position - start), start=start)) for start in starts]
+        for page in pages:
+            try:
+                items = page.result().get('items')
+            except requests.exceptions.RequestException as e:
+                logr(f"An error occurred: {e}")
+                break
+            if not items:
                 break  # No more results
-
-        except requests.exceptions.RequestException as e:
-            logr(f"An error occurred: {e}")
-            break
+            results.extend(items)
 
     return results[:num_results]
 
@@ -220,26 +402,35 @@ def validate_date_restrict(value):
         raise argparse.ArgumentTypeError('Invalid date_restrict format. Must be d[number], w[number], m[number], or y[1-3].')
     return value
 
-def serialize_search_results(search_results):
-    return "\n".join([result.to_string() for result in search_results])       
+def serialize_search_results(search_results, question=None, token_budget=None):
+    if token_budget:
+        # Rank by relevance, drop weak results and trim pages to fit the budget
+        return context_packer.pack_search_results(search_results, question or "", token_budget)
+    return "\n".join([result.to_string() for result in search_results])
 
-def summarize_results(html_payload, question, model_id, chat_history):
-    PROMPT = f"""
+def summary_question(question, chat_history):
+    return f"""
+        [CHAT HISTORY]
+        {chat_history}
+
+        [QUESTION]
+        {question}
+    """
+
+def summary_prompt():
+    return """
         You are an advanced AI assistant specialized in analyzing web search results. Please perform the following tasks:
 
-        1. You're going to be exposed to a series of web search results, supposedly relevant to the question described as follows. having that in mind, make sense of all the information provided to you. Ingest all that data carefully and make your own conclusions.
+        1. You're going to be exposed to a series of web search results, supposedly relevant to the question given after them. having that in mind, make sense of all the information provided to you. Ingest all that data carefully and make your own conclusions.
         
-        2. Include Chat History as part of the context if it does make sense.
+        2. Include the Chat History, given with the question, as part of the context if it does make sense.
 
-        3. Once you're done ingesting, provide a through answer. Focus on the main ideas and key points related to the user's query: {question}. When possible, provide examples. If the question is related to coding, provide code snippets.
+        3. Once you're done ingesting, provide a through answer. Focus on the main ideas and key points related to the user's query. When possible, provide examples. If the question is related to coding, provide code snippets.
 
         4. You can use the knowledge obtained by analyzing the information provided to craft an answer doing some assumptions as long as you are based on facts.
 
         5. Provide relevant URLs (exclusively extraced from the data provided to you) as reference for further reading. Take into consideration only URLs when the associated score is above 3.
 
-        [CHAT HISTORY]
-        {chat_history}
-        
         Format your response as follows:
         
         [Your direct answer to the user's question based on the search results]
@@ -249,31 +440,308 @@ def summarize_results(html_payload, question, model_id, chat_history):
         
         Remember to base your responses solely on the provided data and maintain a neutral, informative tone. Output in markdown format.
     """
-    logr(f"PROMPT: {PROMPT}")
-    if model_id.startswith("gemini"):
-        search_result_analysis = gemini_inference.run_text_inference(html_payload, PROMPT, 'string', model_id)
-    else:
-        search_result_analysis = claude_inference.run_text_inference(html_payload, PROMPT, 'string', model_id)
+
+def summarize_results(html_payload, question, model_id, chat_history, cache_context=False):
+    """Answers question from the serialized search results.
+
+    cache_context caches the instructions and results on the provider side, for results
+    that later calls will send again (follow-up questions).
+    """
+    PROMPT = summary_prompt()
+    QUESTION = summary_question(question, chat_history)
+    logr(f"PROMPT: {PROMPT}{QUESTION}")
+    # Answers are not memoized: regenerating one should give a fresh completion
+    with tracing.span("summarize", model=model_id, payload_chars=len(html_payload)):
+        search_result_analysis = model_router.run_text_inference(html_payload, PROMPT, 'string', model_id, cache=False, question=QUESTION, cache_context=cache_context)
 
     return search_result_analysis
 
-def gennie_answer(question, model_id, num_results, start_index, date_restrict, chat_history):
-    query = get_search_query(question, 'gemini-1.5-flash-001') # Query improvement only run on gemini flash
+def summarize_results_stream(html_payload, question, model_id, chat_history, cache_context=False):
+    PROMPT = summary_prompt()
+    QUESTION = summary_question(question, chat_history)
+    logr(f"PROMPT: {PROMPT}{QUESTION}")
+    with tracing.span("summarize", model=model_id, payload_chars=len(html_payload)):
+        yield from model_router.stream_text_inference(html_payload, PROMPT, 'string', model_id, question=QUESTION, cache_context=cache_context)
+
+async def summarize_results_async(html_payload, question, model_id, chat_history, timeout=None, cache_context=False):
+    PROMPT = summary_prompt()
+    QUESTION = summary_question(question, chat_history)
+    logr(f"PROMPT: {PROMPT}{QUESTION}")
+    with tracing.span("summarize", model=model_id, payload_chars=len(html_payload)):
+        return await model_router.run_text_inference_async(html_payload, PROMPT, 'string', model_id, timeout=timeout, cache=False,
+                                                           question=QUESTION, cache_context=cache_context)
+
+def process_search_results(json_data, question, model_id, max_workers=1, result_timeout=None, verbose=True, evaluate=True, streaming_fetch=False, deadline=None):
+    """Builds a SearchResult (fetch, convert, relevance) for every search item.
+
+    With max_workers > 1 the items are processed on a thread pool so fetching, conversion
+    and relevance scoring overlap across results. A result still running result_timeout
+    seconds after it started is dropped, and the whole batch is capped at result_timeout
+    per wave of workers, so stragglers never hold up the summarization step. deadline
+    (a time.time() value) is a hard stop for the whole batch: results not finished by
+    then are dropped. With either limit set, a single worker still runs the items on
+    the pool so they can be dropped. Results are returned in the original search order.
+    """
+    search_results = []
+    if max_workers <= 1 and result_timeout is None and deadline is None:
+        for json_item in json_data:
+            try:
+                search_results.append(SearchResult(json_item, question, model_id, verbose, evaluate, streaming_fetch=streaming_fetch))
+            except Exception as e:
+                logr(f"error while trying to process: {json_item.get('link')} - {e}")
+        return search_results
+
+    started = {}
+    def process_item(index, json_item):
+        started[index] = time.time()
+        return SearchResult(json_item, question, model_id, verbose, evaluate, streaming_fetch=streaming_fetch)
+
+    batch_deadline = deadline
+    if result_timeout is not None:
+        waves = -(-len(json_data) // max(1, max_workers))
+        batch_deadline = min(filter(None, [deadline, time.time() + result_timeout * waves]))
+
+    completed = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="gennie-result")
+    try:
+        # Each item runs in a copy of this context so its spans nest under the caller's
+        futures = {executor.submit(contextvars.copy_context().run, process_item, i, item): i for i, item in enumerate(json_data)}
+        pending = set(futures)
+        while pending:
+            timeout = None
+            if batch_deadline is not None:
+                deadlines = [started[futures[f]] + result_timeout for f in pending if futures[f] in started] if result_timeout is not None else []
+                timeout = max(0, min(deadlines + [batch_deadline]) - time.time())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                try:
+                    completed[index] = future.result()
+                except Exception as e:
+                    logr(f"error while trying to process: {json_data[index].get('link')} - {e}")
+            if batch_deadline is None:
+                continue
+            now = time.time()
+            for future in list(pending):
+                index = futures[future]
+                running_too_long = result_timeout is not None and index in started and now - started[index] > result_timeout
+                if running_too_long or now >= batch_deadline:
+                    reason = f"after {result_timeout}s" if running_too_long else "at the batch deadline"
+                    logr(f"dropping straggler {reason}: {json_data[index].get('link')}")
+                    future.cancel()
+                    pending.discard(future)
+    finally:
+        # Do not block on stragglers; their threads finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return [completed[i] for i in sorted(completed)]
+
+class SearchBudget:
+    """Limits shared by every round of one answer: wall-clock seconds, LLM calls and fetched pages.
+
+    A limit of None is unbounded. Each processed search result is charged as one fetched
+    page, plus one LLM call for its relevance score unless batch scoring charges the calls
+    it makes. max_seconds is enforced within a round through deadline().
+    """
+    def __init__(self, max_seconds=None, max_llm_calls=None, max_pages=None):
+        self.max_seconds = max_seconds
+        self.max_llm_calls = max_llm_calls
+        self.max_pages = max_pages
+        self.started = time.time()
+        self.llm_calls = 0
+        self.pages = 0
+
+    def charge(self, llm_calls=0, pages=0):
+        self.llm_calls += llm_calls
+        self.pages += pages
+
+    def deadline(self):
+        """Absolute time.time() at which the budget runs out, or None."""
+        if self.max_seconds is None:
+            return None
+        return self.started + self.max_seconds
+
+    def remaining_seconds(self):
+        if self.max_seconds is None:
+            return None
+        return max(0, self.max_seconds - (time.time() - self.started))
+
+    def allowance(self, wanted, reserve_llm_calls=0):
+        # How many more results can be processed, keeping reserve_llm_calls for later steps
+        if self.max_pages is not None:
+            wanted = min(wanted, self.max_pages - self.pages)
+        if self.max_llm_calls is not None:
+            wanted = min(wanted, self.max_llm_calls - self.llm_calls - reserve_llm_calls)
+        return max(0, wanted)
+
+    def exhausted(self, reserve_llm_calls=0):
+        if self.remaining_seconds() == 0:
+            return "time"
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return "pages"
+        if self.max_llm_calls is not None and self.llm_calls + reserve_llm_calls >= self.max_llm_calls:
+            return "llm calls"
+        return None
+
+INDEX_TOP_K = 8
+
+class IndexedPassage(SearchResult):
+    """A chunk retrieved from a local documentation index, usable wherever a SearchResult is."""
+    def __init__(self, hit):
+        self.json_data = hit
+        self.title = hit["title"]
+        self.link = hit["url"]
+        self.raw_content = None
+        self.markdown = hit["text"]
+        self.relevance = f"Retrieved from the local documentation index (similarity {hit['score']:.2f})"
+        self.relevance_score = None
+
+def search_local_index(question, index_path, k=INDEX_TOP_K):
+    """Returns the top k chunks of the index at index_path, or [] when even the best one
+    is not similar enough to question to answer from."""
+    # Imported here: the index needs numpy, web search does not
+    import vector_index
+    index = vector_index.open_index(index_path)
+    with tracing.span("local_index", kind=index.kind, k=k) as span:
+        hits = index.search(question, k)
+        span.set(best_score=hits[0]["score"] if hits else None)
+    if not hits or hits[0]["score"] < index.min_score:
+        logr(f"local index has no close match (best {hits[0]['score'] if hits else 0:.2f}), searching the web")
+        return []
+    hits = [hit for hit in hits if hit["score"] >= index.min_score]
+    logr(f"local index returned {len(hits)} chunks")
+    return [IndexedPassage(hit) for hit in hits]
+
+def gather_search_results(question, model_id, num_results, start_index, date_restrict, max_workers=1, result_timeout=None, relevance_model_id=None, batch_relevance=False, streaming_fetch=False,
+                          max_rounds=1, budget=None, min_score=context_packer.MIN_RELEVANCE_SCORE, min_relevant_results=2):
+    """Searches, fetches and scores results for a question.
+
+    With max_rounds > 1 the search deepens while fewer than min_relevant_results results
+    score min_score or more: odd rounds fetch the next page of the current query, even
+    rounds ask for a follow-up query that differs from the ones already tried. Every
+    round shares budget (a SearchBudget), and URLs already processed are skipped.
+    One LLM call is always kept in reserve for the summarization.
+    """
+    budget = budget or SearchBudget()
+    relevance_model_id = relevance_model_id or model_id
+    GOOGLE_SEARCH_API_KEY = os.getenv("GOOGLE_SEARCH_API_KEY")
+    SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
+    queries, seen_urls, search_results = [], set(), []
+    query, page_start, query_exhausted = None, start_index, True
+    for round_number in range(max_rounds):
+        if query is None or round_number % 2 == 0 or query_exhausted:
+            reason = budget.exhausted(reserve_llm_calls=2) if round_number else None
+            if reason:
+                logr(f'search budget exhausted ({reason}) after {round_number} rounds')
+                break
+            query = get_search_query(question, 'gemini-1.5-flash-001', previous_queries=queries) # Query improvement only run on gemini flash
+            budget.charge(llm_calls=1)
+            queries.append(query)
+            page_start = start_index
+        else:
+            page_start += num_results
+        limit = budget.allowance(num_results, reserve_llm_calls=1)
+        if limit == 0:
+            break
+        json_data = google_search(query, GOOGLE_SEARCH_API_KEY, SEARCH_ENGINE_ID, num_results=num_results, start_index=page_start, date_restrict=date_restrict)
+        query_exhausted = len(json_data) < num_results
+        fresh, fresh_urls = [], set()
+        for json_item in json_data:
+            url = normalize_url(json_item.get('link', ''))
+            if url not in seen_urls and url not in fresh_urls:
+                fresh_urls.add(url)
+                fresh.append(json_item)
+        # Results cut by the budget stay unseen, so a later round may still process them
+        fresh = fresh[:limit]
+        seen_urls.update(normalize_url(json_item.get('link', '')) for json_item in fresh)
+        logr(f'Google search has brought to you {len(json_data)} results ({len(fresh)} new)')
+        if fresh:
+            # Relevance scoring can run on a cheaper/faster model than the final answer
+            round_results = process_search_results(fresh, question, relevance_model_id, max_workers=max_workers, result_timeout=result_timeout,
+                                                   evaluate=not batch_relevance, streaming_fetch=streaming_fetch, deadline=budget.deadline())
+            budget.charge(llm_calls=0 if batch_relevance else len(fresh), pages=len(fresh))
+            if batch_relevance:
+                evaluate_relevance_batch(round_results, question, relevance_model_id, verbose=True, budget=budget)
+            search_results.extend(round_results)
+            logr(f'{len(round_results)} of {len(fresh)} results processed')
+        relevant = sum(1 for r in search_results if (r.relevance_score or 0) >= min_score)
+        if round_number + 1 < max_rounds:
+            if relevant >= min_relevant_results:
+                break
+            reason = budget.exhausted(reserve_llm_calls=1)
+            if reason:
+                logr(f'search budget exhausted ({reason}) after {round_number + 1} rounds')
+                break
+            logr(f'only {relevant} relevant results so far, deepening the search')
+    if page_cache.get_default_cache():
+        logr(f'page cache: {page_cache.get_default_cache().summary()}')
+    return search_results
+
+def gennie_answer(question, model_id, num_results, start_index, date_restrict, chat_history, max_workers=1, result_timeout=None, relevance_model_id=None, batch_relevance=False, context_token_budget=None, streaming_fetch=False,
+                  max_rounds=1, budget=None, index_path=None, index_k=INDEX_TOP_K):
+    with tracing.span("answer", model=model_id):
+        search_results = search_local_index(question, index_path, index_k) if index_path else []
+        search_results = search_results or gather_search_results(question, model_id, num_results, start_index, date_restrict, max_workers=max_workers,
+                                               result_timeout=result_timeout, relevance_model_id=relevance_model_id, batch_relevance=batch_relevance,
+                                               streaming_fetch=streaming_fetch, max_rounds=max_rounds, budget=budget)
+        payload = serialize_search_results(search_results, question, context_token_budget)
+        answer = summarize_results(payload, question, model_id, chat_history)
+    return answer
+
+def gennie_answer_stream(question, model_id, num_results, start_index, date_restrict, chat_history, max_workers=1, result_timeout=None, relevance_model_id=None, batch_relevance=False, context_token_budget=None, streaming_fetch=False,
+                         max_rounds=1, budget=None, index_path=None, index_k=INDEX_TOP_K):
+    """Same pipeline as gennie_answer, but yields the answer text as the model produces it."""
+    with tracing.span("answer", model=model_id, stream=True):
+        search_results = search_local_index(question, index_path, index_k) if index_path else []
+        search_results = search_results or gather_search_results(question, model_id, num_results, start_index, date_restrict, max_workers=max_workers,
+                                               result_timeout=result_timeout, relevance_model_id=relevance_model_id, batch_relevance=batch_relevance,
+                                               streaming_fetch=streaming_fetch, max_rounds=max_rounds, budget=budget)
+        payload = serialize_search_results(search_results, question, context_token_budget)
+        yield from summarize_results_stream(payload, question, model_id, chat_history)
+
+async def gennie_answer_async(question, model_id, num_results, start_index, date_restrict, chat_history, llm_timeout=None, relevance_model_id=None, context_token_budget=None,
+                              index_path=None, index_k=INDEX_TOP_K):
+    """asyncio counterpart of gennie_answer.
+
+    Fetching and conversion run in worker threads, relevance scoring is awaited
+    concurrently for all results (bounded by the shared inference semaphore), and each
+    LLM call is limited to llm_timeout seconds. Cancelling the task cancels in-flight calls.
+    The async LLM clients opened on the running loop are closed before returning, since
+    each asyncio.run starts a new loop they could not be reused on.
+    """
+    try:
+        with tracing.span("answer", model=model_id):
+            return await _gennie_answer_async(question, model_id, num_results, start_index, date_restrict, chat_history, llm_timeout,
+                                              relevance_model_id, context_token_budget, index_path, index_k)
+    finally:
+        await llm_clients.aclose_clients()
+
+async def _gennie_answer_async(question, model_id, num_results, start_index, date_restrict, chat_history, llm_timeout, relevance_model_id,
+                               context_token_budget, index_path, index_k):
+    if index_path:
+        search_results = await asyncio.to_thread(search_local_index, question, index_path, index_k)
+        if search_results:
+            payload = serialize_search_results(search_results, question, context_token_budget)
+            return await summarize_results_async(payload, question, model_id, chat_history, timeout=llm_timeout)
+    query = await get_search_query_async(question, 'gemini-1.5-flash-001', timeout=llm_timeout) # Query improvement only run on gemini flash
     GOOGLE_SEARCH_API_KEY = os.getenv("GOOGLE_SEARCH_API_KEY")
     SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
-    json_data = google_search(query, GOOGLE_SEARCH_API_KEY, SEARCH_ENGINE_ID, num_results=num_results, start_index=start_index, date_restrict=date_restrict)
+    json_data = await asyncio.to_thread(google_search, query, GOOGLE_SEARCH_API_KEY, SEARCH_ENGINE_ID, num_results=num_results, start_index=start_index, date_restrict=date_restrict)
     logr(f'Google search has brought to you {len(json_data)} results')
+    fetched = await asyncio.gather(
+        *(asyncio.to_thread(SearchResult, json_item, question, relevance_model_id or model_id, True, False) for json_item in json_data),
+        return_exceptions=True,
+    )
     search_results = []
-    for json_item in json_data:
-        try:
-            s = SearchResult(json_item, question, model_id, True)
-            search_results.append(s)
-        except:
-            logr(f'error while trying to process: {s.link}')
-    
-    payload = serialize_search_results(search_results)
-    answer = summarize_results(payload, question, model_id, chat_history)
-    return answer
+    for json_item, result in zip(json_data, fetched):
+        if isinstance(result, Exception):
+            logr(f"error while trying to process: {json_item.get('link')} - {result}")
+        else:
+            search_results.append(result)
+    await asyncio.gather(*(result.evaluate_relevance_async(timeout=llm_timeout) for result in search_results))
+
+    payload = serialize_search_results(search_results, question, context_token_budget)
+    return await summarize_results_async(payload, question, model_id, chat_history, timeout=llm_timeout)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Web search and analysis tool")
@@ -284,6 +752,19 @@ if __name__ == "__main__":
     parser.add_argument("--date_restrict", type=validate_date_restrict, default="y2", 
                         help="Date restrict parameter for search results (e.g., 'd5', 'w2', 'm6', 'y1')")
     parser.add_argument("--chat_history", type=str, default=None, help="Chat History to be included in the summarization")
+    parser.add_argument("--relevance_model_id", type=str, default=None, help="Model ID for relevance scoring (defaults to --model_id)")
+    parser.add_argument("--batch_relevance", action="store_true", help="Score several search results per LLM call")
+    parser.add_argument("--context_token_budget", type=int, default=None, help="Token budget for the search results sent to summarization")
+    parser.add_argument("--streaming_fetch", action="store_true", help="Convert pages to markdown while they download, without holding the full HTML")
+    parser.add_argument("--max_rounds", type=int, default=1, help="Search rounds (next page / follow-up query) while results score low on relevance")
+    parser.add_argument("--max_seconds", type=float, default=None, help="Wall-clock budget for the search rounds")
+    parser.add_argument("--max_llm_calls", type=int, default=None, help="LLM call budget for the whole answer")
+    parser.add_argument("--max_pages", type=int, default=None, help="Budget of fetched pages across all search rounds")
+    parser.add_argument("--index_path", type=str, default=None, help="Local documentation index (vector_index.py or bm25_index.py) tried before web search")
+    parser.add_argument("--index_k", type=int, default=INDEX_TOP_K, help="Chunks retrieved from the local index")
+    parser.add_argument("--stream", action="store_true", help="Print the answer as it is generated")
+    parser.add_argument("--max_workers", type=int, default=1, help="Number of search results processed concurrently")
+    parser.add_argument("--result_timeout", type=float, default=None, help="Seconds a single search result may take before it is dropped")
     args = parser.parse_args()
     model_id = args.model_id
     question = args.question
@@ -292,6 +773,15 @@ if __name__ == "__main__":
     date_restrict = args.date_restrict
     chat_history = args.chat_history
     
-    answer = gennie_answer(question, model_id, num_results, start_index, date_restrict, chat_history)
-    print(answer)
-
+    options = dict(max_workers=args.max_workers, result_timeout=args.result_timeout,
+                   relevance_model_id=args.relevance_model_id, batch_relevance=args.batch_relevance,
+                   context_token_budget=args.context_token_budget, streaming_fetch=args.streaming_fetch,
+                   max_rounds=args.max_rounds, budget=SearchBudget(args.max_seconds, args.max_llm_calls, args.max_pages),
+                   index_path=args.index_path, index_k=args.index_k)
+    if args.stream:
+        for chunk in gennie_answer_stream(question, model_id, num_results, start_index, date_restrict, chat_history, **options):
+            print(chunk, end="", flush=True)
+        print()
+    else:
+        answer = gennie_answer(question, model_id, num_results, start_index, date_restrict, chat_history, **options)
+        print(answer)
\ No newline at end of file
@@ -0,0 +1,301 @@
+import argparse
+import contextlib
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Modules
+import gennie_core
+import http_session
+import tracing
+from shared import log_message as logr
+
+WORKERS = 4
+# Questions admitted beyond the ones being answered; more are turned away with 503
+QUEUE_SIZE = 16
+# Requests a single user may have open at once; more are turned away with 429
+PER_USER = 2
+# Seconds a request waits for its answer before giving up with 504
+ANSWER_TIMEOUT = 300
+RETRY_AFTER = 2
+# Pipeline options a request may set
+OPTIONS = ("max_workers", "result_timeout", "relevance_model_id", "batch_relevance", "context_token_budget", "streaming_fetch", "max_rounds")
+
+class ServiceBusy(Exception):
+    pass
+
+class UserLimitExceeded(ServiceBusy):
+    pass
+
+def pipeline_answer(question, model_id, num_results, date_restrict, chat_history, **options):
+    """Default answer_fn: the gennie_core pipeline, yielding the answer as it is generated."""
+    return gennie_core.gennie_answer_stream(question, model_id, num_results, 1, date_restrict, chat_history, **options)
+
+class Flight:
+    """One pipeline run, shared by every request asking the same question while it runs.
+
+    Chunks are kept as they are produced, so a request joining late replays the answer
+    from the start and then follows it live.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.created_at = time.time()
+        self.condition = threading.Condition()
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.error = error
+            self.done = True
+            self.condition.notify_all()
+
+    def stream(self, timeout=None):
+        """Yields the answer chunks; raises the pipeline's error, or TimeoutError after timeout seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        position = 0
+        while True:
+            with self.condition:
+                while position >= len(self.chunks) and not self.done:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"no answer after {timeout}s")
+                    self.condition.wait(remaining)
+                chunks = self.chunks[position:]
+                done, error = self.done, self.error
+            position += len(chunks)
+            yield from chunks
+            if done:
+                if error:
+                    raise error
+                return
+
+    def result(self, timeout=None):
+        return "".join(self.stream(timeout))
+
+class AnswerService:
+    """Answers questions on a worker pool, coalescing identical questions in flight.
+
+    answer_fn(question, model_id, num_results, date_restrict, chat_history, **options)
+    returns the answer as a string or an iterable of chunks; it defaults to the gennie_core
+    pipeline and can be swapped for a stub. Requests for a question (same normalized text,
+    model, settings and history) already being answered share that run instead of
+    starting another. At most workers + queue_size runs are admitted at once, and each
+    user may hold per_user open requests.
+    """
+    def __init__(self, answer_fn=pipeline_answer, workers=WORKERS, queue_size=QUEUE_SIZE, per_user=PER_USER):
+        self.answer_fn = answer_fn
+        self.capacity = workers + queue_size
+        self.per_user = per_user
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gennie-service")
+        self.flights = {}
+        self.users = Counter()
+        self.running = 0
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(question, model_id, num_results, date_restrict, chat_history, **options):
+        normalized = re.sub(r"\s+", " ", question).strip().lower()
+        request = [normalized, model_id, num_results, date_restrict, chat_history, sorted(options.items())]
+        return hashlib.sha256(json.dumps(request, default=str).encode()).hexdigest()
+
+    def _count(self, outcome):
+        # Caller holds self.lock
+        self.counts[outcome] += 1
+        tracing.counter("gennie_service_requests_total", outcome=outcome)
+
+    @contextlib.contextmanager
+    def admit(self, user, question, model_id, num_results=5, date_restrict="y2", chat_history=None, **options):
+        """Admits a request and yields (flight, coalesced); the user's slot is held until the block exits.
+
+        Raises UserLimitExceeded when user already has per_user open requests and
+        ServiceBusy when a new run would exceed the admission capacity.
+        """
+        key = self.key(question, model_id, num_results, date_restrict, chat_history, **options)
+        with self.lock:
+            if self.users[user] >= self.per_user:
+                self._count("user_limit")
+                raise UserLimitExceeded(f"{user} already has {self.users[user]} requests open")
+            flight = self.flights.get(key)
+            # A finished run may not have been removed yet; its answer is not reused
+            coalesced = flight is not None and not flight.done
+            if coalesced:
+                self._count("coalesced")
+            else:
+                if len(self.flights) >= self.capacity:
+                    self._count("busy")
+                    raise ServiceBusy(f"{len(self.flights)} questions are already being answered")
+                flight = self.flights[key] = Flight(key)
+                self._count("started")
+                self.executor.submit(self._run, flight, (question, model_id, num_results, date_restrict, chat_history), options)
+            self.users[user] += 1
+        try:
+            yield flight, coalesced
+        finally:
+            with self.lock:
+                self.users[user] -= 1
+                if not self.users[user]:
+                    del self.users[user]
+
+    def _run(self, flight, args, options):
+        tracing.observe("gennie_service_queue_seconds", time.time() - flight.created_at)
+        with self.lock:
+            self.running += 1
+        try:
+            answer = self.answer_fn(*args, **options)
+            for chunk in [answer] if isinstance(answer, str) else answer:
+                flight.append(chunk)
+            flight.finish()
+        except Exception as e:
+            logr(f"Failed to answer {args[0]!r}: {e}")
+            flight.finish(e)
+        finally:
+            with self.lock:
+                self.running -= 1
+                if self.flights.get(flight.key) is flight:
+                    del self.flights[flight.key]
+                if flight.error:
+                    self._count("failed")
+
+    def answer(self, user, question, model_id, num_results=5, date_restrict="y2", chat_history=None, timeout=ANSWER_TIMEOUT, **options):
+        with self.admit(user, question, model_id, num_results, date_restrict, chat_history, **options) as (flight, _):
+            return flight.result(timeout)
+
+    def stats(self):
+        with self.lock:
+            return {"running": self.running, "queued": len(self.flights) - self.running, "users": len(self.users),
+                    "capacity": self.capacity, "requests": dict(self.counts)}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None
+    answer_timeout = ANSWER_TIMEOUT
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/health":
+            self._send_json(200, self.service.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/answer":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            question = body["question"].strip()
+            options = body.get("options") or {}
+            unknown = set(options) - set(OPTIONS)
+            if not question or unknown:
+                raise ValueError(f"unknown options: {sorted(unknown)}" if unknown else "empty question")
+        except (ValueError, KeyError, AttributeError) as e:
+            self._send_json(400, {"error": f"invalid request: {e}"})
+            return
+        user = self.headers.get("X-User-Id") or body.get("user") or self.client_address[0]
+        request = {k: body[k] for k in ("model_id", "num_results", "date_restrict", "chat_history") if k in body}
+        request.setdefault("model_id", "gemini-1.5-flash-001")
+        try:
+            with self.service.admit(user, question, **request, **options) as (flight, coalesced):
+                if body.get("stream"):
+                    self._stream(flight, coalesced)
+                else:
+                    self._send_json(200, {"answer": flight.result(self.answer_timeout), "coalesced": coalesced})
+        except UserLimitExceeded as e:
+            self._send_json(429, {"error": str(e)}, {"Retry-After": str(RETRY_AFTER)})
+        except ServiceBusy as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": str(RETRY_AFTER)})
+        except TimeoutError as e:
+            self._send_json(504, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _stream(self, flight, coalesced):
+        # Waiting for the first chunk lets an early failure still get its own status code;
+        # after the headers are sent, errors can only end the stream
+        chunks = flight.stream(self.answer_timeout)
+        first = next(chunks, "")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Gennie-Coalesced", str(coalesced).lower())
+        self.end_headers()
+        try:
+            for chunk in itertools.chain([first], chunks):
+                data = chunk.encode("utf-8")
+                if data:
+                    self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client left; the run goes on for the other requests sharing it
+            pass
+        except Exception as e:
+            logr(f"Answer stream ended early: {e}")
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(service, host="0.0.0.0", port=8080, answer_timeout=ANSWER_TIMEOUT):
+    handler = type("Handler", (_Handler,), {"service": service, "answer_timeout": answer_timeout})
+    return ThreadingHTTPServer((host, port), handler)
+
+def remote_answer_stream(service_url, question, model_id, num_results, date_restrict, chat_history=None, user=None, timeout=ANSWER_TIMEOUT, **options):
+    """Streams an answer from a running gennie_service; raises ServiceBusy when it turns the request away."""
+    payload = {"question": question, "model_id": model_id, "num_results": num_results, "date_restrict": date_restrict,
+               "chat_history": chat_history, "stream": True, "options": options}
+    response = http_session.post(f"{service_url.rstrip('/')}/answer", json=payload, headers={"X-User-Id": user} if user else None,
+                                 stream=True, timeout=(10, timeout))
+    if response.status_code in (429, 503):
+        raise (UserLimitExceeded if response.status_code == 429 else ServiceBusy)(response.json().get("error"))
+    response.raise_for_status()
+    yield from response.iter_content(chunk_size=None, decode_unicode=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Gennie answer service")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Questions answered at the same time")
+    parser.add_argument("--queue_size", type=int, default=QUEUE_SIZE, help="Questions waiting for a worker before new ones are turned away")
+    parser.add_argument("--per_user", type=int, default=PER_USER, help="Open requests allowed per user")
+    parser.add_argument("--answer_timeout", type=float, default=ANSWER_TIMEOUT, help="Seconds a request waits for its answer")
+    args = parser.parse_args()
+
+    service = AnswerService(workers=args.workers, queue_size=args.queue_size, per_user=args.per_user)
+    server = make_server(service, args.host, args.port, args.answer_timeout)
+    logr(f"Gennie service listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 import json
+import os
+import uuid
 import streamlit as st
 from collections import deque
 
 from shared import log_message as logr
-import gennie_core
+import conversation
+import gennie_service
+
+# Answers come from a running gennie_service.py when set, ex: http://localhost:8080
+SERVICE_URL = os.getenv("GENNIE_SERVICE_URL")
 
 # Initialize the deque to store the latest 5 interactions
 interactions = deque(maxlen=5)
@@ -33,8 +39,12 @@ def main():
         date_restrict = f"{date_reference}{results_max_age}"
         
         # Add checkbox for including history
-        include_history = st.checkbox("Include History")
-        
+        include_history = st.checkbox("Include History", help="Answer follow-ups from the results already fetched, searching again only when needed")
+
+        if st.button("New conversation"):
+            for key in ("messages", "history", "conversation"):
+                st.session_state.pop(key, None)
+
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -47,29 +57,53 @@ def main():
     # Logic for Uploading image
     if 'history' not in st.session_state:
         st.session_state.history = deque(maxlen=5)
+
+    # Search results and turns of the current chat; follow-ups are answered from them
+    if 'conversation' not in st.session_state:
+        st.session_state.conversation = conversation.ConversationSession(model_id)
+
+    # Identifies this browser session to the answer service's per-user limits
+    if 'user_id' not in st.session_state:
+        st.session_state.user_id = uuid.uuid4().hex
         
     if prompt := st.chat_input("What is up?"):
-        with st.spinner('Processing response...'):
-            # Reset pagination for new question
-            user_message = {"role": "user", "content": prompt}
-            st.session_state.messages.append(user_message)
-            history = json.dumps(list(st.session_state.history)) if include_history else None
-            response = gennie_core.gennie_answer(user_message["content"], model_id, num_google_search_results, 1, date_restrict, history)
-            # response = prompt
-            # time.sleep(5)
-            if not response:
-                st.error("Some error has ocurred")
-                return
-            assistant_message = {"role": "assistant", "content": response}
-            st.session_state.messages.append(assistant_message)
-            message = f"Question: {prompt} \n{response}"
-            st.session_state.history.append(message)
-            with st.chat_message("user"):
-                st.write(prompt)
-            with st.chat_message("assistant"):
-                st.write(response)
-            logr(f"History: {st.session_state.history}")
-
+        # Reset pagination for new question
+        user_message = {"role": "user", "content": prompt}
+        history = json.dumps(list(st.session_state.history)) if include_history else None
+        with st.chat_message("user"):
+            st.write(prompt)
+        with st.chat_message("assistant"):
+            with st.spinner('Processing response...'):
+                # Tokens are rendered as they arrive; results are fetched concurrently
+                if SERVICE_URL:
+                    stream = gennie_service.remote_answer_stream(SERVICE_URL, user_message["content"], model_id, num_google_search_results, date_restrict, history,
+                                                                 user=st.session_state.user_id, max_workers=num_google_search_results,
+                                                                 context_token_budget=conversation.context_token_budget(model_id))
+                else:
+                    session = st.session_state.conversation
+                    session.model_id, session.num_results, session.date_restrict = model_id, num_google_search_results, date_restrict
+                    session.search_options["max_workers"] = num_google_search_results
+                    if not include_history:
+                        session.reset()
+                    stream = session.ask_stream(user_message["content"])
+                try:
+                    response = st.write_stream(stream)
+                except gennie_service.ServiceBusy as e:
+                    logr(f"Answer service busy: {e}")
+                    st.warning("Gennie is busy right now, please ask again in a moment")
+                    return
+                except Exception as e:
+                    logr(f"Failed to generate the answer: {e}")
+                    response = None
+        if not response:
+            st.error("Some error has ocurred")
+            return
+        # The question is kept only once it has an answer, so a turned-away one is not replayed
+        assistant_message = {"role": "assistant", "content": response}
+        st.session_state.messages.extend([user_message, assistant_message])
+        message = f"Question: {prompt} \n{response}"
+        st.session_state.history.append(message)
+        logr(f"History: {st.session_state.history}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
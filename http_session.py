@@ -0,0 +1,79 @@
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 20
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_TIMEOUT = 120
+
+# Requests in flight per host
+DEFAULT_HOST_CONCURRENCY = 8
+HOST_CONCURRENCY = {
+    "www.googleapis.com": 10,
+    "api.usescraper.com": 4,
+}
+
+class _Retry(Retry):
+    # POST is not idempotent, so it is only retried on 429, where the server did not act
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == "POST":
+            return bool(self.total) and status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = defaultdict(lambda: None)
+_host_slots_lock = threading.Lock()
+
+def get_session():
+    """Process-wide requests.Session with keep-alive pools and retries.
+
+    Retries back off exponentially and honor Retry-After on 429/503. When retries are
+    exhausted the last response is returned instead of raising.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = _Retry(
+                total=MAX_RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUSES,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+def _host_slot(url):
+    host = urlsplit(url).hostname or ""
+    with _host_slots_lock:
+        slot = _host_slots[host]
+        if slot is None:
+            slot = threading.BoundedSemaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+            _host_slots[host] = slot
+    return slot
+
+def request(method, url, **kwargs):
+    # With stream=True the host slot is released once headers arrive, not after the body
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    with _host_slot(url):
+        return get_session().request(method, url, **kwargs)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def head(url, **kwargs):
+    return request("HEAD", url, **kwargs)
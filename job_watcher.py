@@ -0,0 +1,176 @@
+import hmac
+import json
+import secrets
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Modules
+from shared import log_message as logr
+
+SUCCEEDED = {"succeeded", "completed", "done"}
+FAILED = {"failed", "cancelled", "canceled", "error", "expired"}
+# Header carrying the shared secret, for senders that cannot put it in the path
+SECRET_HEADER = "X-Webhook-Token"
+
+class JobFailed(Exception):
+    pass
+
+class JobTimeout(Exception):
+    pass
+
+class WebhookReceiver:
+    """Small HTTP server that receives job status callbacks.
+
+    Expects POSTed JSON with the job id ("id" or "job_id") and its "status". Callbacks must
+    carry the shared secret, as the last path segment (see callback_url) or in the
+    X-Webhook-Token header; others are refused with 403, and callbacks without a status are
+    ignored. Watchers waiting on a job wake up as soon as its callback arrives. The server
+    listens on localhost by default; a tunnel or reverse proxy makes it reachable.
+    """
+    def __init__(self, host="127.0.0.1", port=8765, secret=None):
+        self.secret = secret or secrets.token_urlsafe(16)
+        self.statuses = {}
+        self.events = {}
+        self.lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not receiver.authorized(self.path, self.headers.get(SECRET_HEADER)):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                try:
+                    body = json.loads(body or b"{}")
+                    job_id = body.get("id") or body.get("job_id")
+                    if job_id and body.get("status"):
+                        receiver.notify(job_id, body)
+                    self.send_response(204)
+                except (ValueError, AttributeError):
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def authorized(self, path, token=None):
+        supplied = token or path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        return hmac.compare_digest(supplied.encode(), self.secret.encode())
+
+    def callback_url(self, base_url):
+        """The URL to hand to the job API, given the public URL that reaches this server."""
+        return f"{base_url.rstrip('/')}/{self.secret}"
+
+    def start(self):
+        self.thread.start()
+        logr(f"webhook receiver listening on port {self.server.server_port}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _event(self, job_id):
+        with self.lock:
+            return self.events.setdefault(job_id, threading.Event())
+
+    def notify(self, job_id, info):
+        with self.lock:
+            self.statuses[job_id] = info
+        self._event(job_id).set()
+
+    def wait(self, job_id, timeout):
+        event = self._event(job_id)
+        if event.wait(timeout):
+            event.clear()
+            with self.lock:
+                return self.statuses.get(job_id)
+        return None
+
+class JobWatcher:
+    """Waits for scrape jobs to reach a terminal state.
+
+    Polls get_job_info(job_id, token) with an interval that starts at initial_interval and
+    grows by backoff (up to max_interval) while the status does not change. A job whose
+    info cannot be read max_missing times in a row, or that is still running after
+    timeout seconds, raises JobTimeout; a failed job raises JobFailed. With a
+WebhookReceiver, callbacks end the wait immediately and polling only acts as a fallback;
+    a callback reporting a terminal status is confirmed with one get_job_info call first.
+    """
+    def __init__(self, get_job_info, token, initial_interval=2, max_interval=30, backoff=1.5, timeout=3600,
+                 max_missing=5, receiver=None, progress=None):
+        self.get_job_info = get_job_info
+        self.token = token
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_missing = max_missing
+        self.receiver = receiver
+        self.progress = progress or (lambda job_id, status, info: logr(f"job {job_id} status: {status}"))
+
+    def watch(self, job_id):
+        deadline = time.time() + self.timeout
+        interval = self.initial_interval
+        last_status, missing = None, 0
+        info = None
+        while True:
+            if info is None:
+                try:
+                    info = self.get_job_info(job_id, self.token)
+                except requests.exceptions.RequestException as e:
+                    logr(f"job {job_id}: failed to read status - {e}")
+            status = (info or {}).get("status")
+            if status is None:
+                missing += 1
+                if missing >= self.max_missing:
+                    raise JobTimeout(f"job {job_id}: no status after {missing} attempts")
+            else:
+                missing = 0
+                if status != last_status:
+                    self.progress(job_id, status, info)
+                    interval = self.initial_interval
+                    last_status = status
+                else:
+                    interval = min(self.max_interval, interval * self.backoff)
+                if status in SUCCEEDED:
+                    return info
+                if status in FAILED:
+                    raise JobFailed(f"job {job_id} ended with status: {status}")
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise JobTimeout(f"job {job_id} still {last_status} after {self.timeout}s")
+            wait = min(interval, remaining)
+            info = self.receiver.wait(job_id, wait) if self.receiver else time.sleep(wait)
+            if (info or {}).get("status") in SUCCEEDED | FAILED:
+                # A callback only ends the wait early; the final status is read from the job API
+                info = None
+
+    def watch_many(self, job_ids, max_workers=None):
+        """Watches jobs concurrently; returns {job_id: info} for succeeded jobs and
+        {job_id: exception} for the others."""
+        job_ids = list(job_ids)
+        results = {}
+        lock = threading.Lock()
+        def watch_one(job_id):
+            try:
+                outcome = self.watch(job_id)
+            except (JobFailed, JobTimeout) as e:
+                logr(f"job {job_id} did not succeed: {e}")
+                outcome = e
+            with lock:
+                results[job_id] = outcome
+                logr(f"{len(results)}/{len(job_ids)} jobs finished")
+            return outcome
+        if not job_ids:
+            return results
+        with ThreadPoolExecutor(max_workers=max_workers or len(job_ids)) as executor:
+            list(executor.map(watch_one, job_ids))
+        return results
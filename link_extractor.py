@@ -0,0 +1,114 @@
+import fnmatch
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+# Modules
+from shared import log_message as logr
+from shared import normalize_url
+
+# Patterns are matched against the URL path; globs by default, regexes when prefixed with "re:"
+DEFAULT_EXCLUDES = [
+    "*release-notes*",
+    "*/reference/*",
+    "*/reference",
+    "re:/(rest|rpc|sdk|apis)(/|$)",
+    "*.pdf",
+    "*.zip",
+]
+
+class LinkParser(HTMLParser):
+    """Collects the href of every anchor, honoring <base href>."""
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ('a', 'base'):
+            return
+        href = dict(attrs).get('href')
+        if not href:
+            return
+        if tag == 'base':
+            self.base_url = urljoin(self.base_url, href.strip())
+        else:
+            self.links.append(urljoin(self.base_url, href.strip()))
+
+def compile_patterns(patterns):
+    """Turns glob and "re:" patterns into a list of path matchers."""
+    matchers = []
+    for pattern in patterns or []:
+        if pattern.startswith("re:"):
+            matchers.append(re.compile(pattern[3:]).search)
+        else:
+            matchers.append(re.compile(fnmatch.translate(pattern)).match)
+    return matchers
+
+def extract_links(html, base_url, same_domain=True, path_prefix=None, excludes=DEFAULT_EXCLUDES):
+    """Returns the normalized, deduplicated http(s) links of html in document order.
+
+    same_domain keeps only links on the host of base_url, path_prefix keeps only paths under
+    it, and links whose path matches any of excludes are dropped.
+    """
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+    parser = LinkParser(base_url)
+    parser.feed(html)
+    parser.close()
+    host = urlsplit(base_url).hostname
+    excluded = compile_patterns(excludes)
+    seen = set()
+    links = []
+    for link in parser.links:
+        parts = urlsplit(link)
+        if parts.scheme not in ('http', 'https'):
+            continue
+        if same_domain and parts.hostname != host:
+            continue
+        url = normalize_url(link)
+        path = urlsplit(url).path
+        if path_prefix and not (path == path_prefix.rstrip('/') or path.startswith(path_prefix.rstrip('/') + '/')):
+            continue
+        if any(matches(path) for matches in excluded):
+            continue
+        if url in seen:
+            continue
+        seen.add(url)
+        links.append(url)
+    return links
+
+def rerank_prompt(topic, links):
+    numbered = "\n".join(f"{i}. {link}" for i, link in enumerate(links))
+    return f"""
+        You are ranking documentation pages about {topic}.
+        Order the numbered URLs below from most to least useful for someone learning {topic}.
+        Leave out pages that are not documentation about {topic}.
+        Reply with the numbers only, separated by commas, and nothing else.
+
+        {numbered}
+        """
+
+def rerank_links(links, topic, model_id, limit=None):
+    """Asks the model to reorder links; only the extracted candidates can be returned.
+
+    Falls back to the original order when the model call fails or returns nothing usable.
+    """
+    # Imported here so extraction works without any provider SDK installed
+    import model_router
+    if not links:
+        return links
+    try:
+        reply = model_router.run_text_inference("", rerank_prompt(topic, links), "string", model_id)
+    except Exception as e:
+        logr(f"error: failed to rerank links - {e}")
+        return links[:limit] if limit else links
+    ranked, seen = [], set()
+    for number in re.findall(r"\d+", reply or ""):
+        index = int(number)
+        if index < len(links) and index not in seen:
+            seen.add(index)
+            ranked.append(links[index])
+    if not ranked:
+        ranked = links
+    return ranked[:limit] if limit else ranked
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# GENNIE_LLM_CACHE=off disables the cache
+DEFAULT_PATH = os.getenv("GENNIE_LLM_CACHE", os.path.expanduser("~/.cache/gennie/llm.sqlite"))
+DEFAULT_TTL = int(os.getenv("GENNIE_LLM_CACHE_TTL", 7 * 24 * 3600))
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("GENNIE_LLM_CACHE_MEMORY_ENTRIES", 1024))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+def make_key(provider, model_id, prompt, payload, **settings):
+    """Hashes everything that changes a completion: provider, model, prompt, payload and
+    generation settings (temperature, max_tokens, ...)."""
+    material = json.dumps([provider, model_id, prompt, payload, settings], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+class LLMCache:
+    """Two tier response cache: an in-memory LRU in front of a SQLite table."""
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, memory_entries=DEFAULT_MEMORY_ENTRIES):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[1]
+            row = self.db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._remember(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return row[0]
+            self.memory.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock:
+            self._remember(key, response, now)
+            self.db.execute("INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)", (key, response, now))
+            self.db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self.db.commit()
+
+    def _remember(self, key, response, created_at):
+        # Caller holds self.lock
+        self.memory[key] = (created_at, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    global _default_cache
+    if DEFAULT_PATH.lower() in ("off", "none", "0", ""):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+    return _default_cache
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+
+# Modules
+from shared import log_message as logr
+
+# Keep-alive pool shared by every request made through one SDK client
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+HTTP_KEEPALIVE_EXPIRY = 60
+
+_clients = {}
+_lock = threading.Lock()
+# Async clients hold connections bound to one event loop, so they are kept per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+def _fingerprint(*credentials):
+    # Credentials are part of the registry key, but never stored in clear text
+    return hashlib.sha256("\0".join(str(c) for c in credentials).encode()).hexdigest()
+
+def _get_or_create(key, factory, registry=None):
+    registry = _clients if registry is None else registry
+    client = registry.get(key)
+    if client is None:
+        with _lock:
+            client = registry.get(key)
+            if client is None:
+                client = factory()
+                registry[key] = client
+                logr(f"llm client created: {key[0]} {key[1] or ''}".rstrip())
+    return client
+
+def _get_or_create_async(key, factory):
+    loop = asyncio.get_running_loop()
+    with _lock:
+        registry = _async_clients.setdefault(loop, {})
+    return _get_or_create(key, factory, registry)
+
+def _http_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+def _http_client():
+    import httpx
+    return httpx.Client(limits=_http_limits())
+
+def _async_http_client():
+    import httpx
+    return httpx.AsyncClient(limits=_http_limits())
+
+def anthropic_client(api_key=None):
+    api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+    def factory():
+        from anthropic import Anthropic
+        return Anthropic(api_key=api_key, http_client=_http_client())
+    return _get_or_create(("claude", None, _fingerprint(api_key)), factory)
+
+def openai_client(api_key=None):
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    def factory():
+        from openai import OpenAI
+        return OpenAI(api_key=api_key, http_client=_http_client())
+    return _get_or_create(("openai", None, _fingerprint(api_key)), factory)
+
+def gemini_model(model_id, project=None, location=None):
+    project = project or os.getenv("VERTEX_IA_PROJECT")
+    location = location or os.getenv("VERTEX_IA_REGION")
+    def factory():
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+        # vertexai.init sets process-wide defaults, so it runs under the registry lock
+        # right before the model captures them
+        vertexai.init(project=project, location=location)
+        return GenerativeModel(model_id)
+    return _get_or_create(("gemini", model_id, _fingerprint(project, location)), factory)
+
+def async_anthropic_client(api_key=None):
+    api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+    def factory():
+        from anthropic import AsyncAnthropic
+        return AsyncAnthropic(api_key=api_key, http_client=_async_http_client())
+    return _get_or_create_async(("claude", None, _fingerprint(api_key)), factory)
+
+def async_openai_client(api_key=None):
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    def factory():
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=api_key, http_client=_async_http_client())
+    return _get_or_create_async(("openai", None, _fingerprint(api_key)), factory)
+
+def async_gemini_model(model_id, project=None, location=None):
+    project = project or os.getenv("VERTEX_IA_PROJECT")
+    location = location or os.getenv("VERTEX_IA_REGION")
+    def factory():
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+        vertexai.init(project=project, location=location)
+        return GenerativeModel(model_id)
+    return _get_or_create_async(("gemini", model_id, _fingerprint(project, location)), factory)
+
+def get_client(provider, model_id=None, **credentials):
+    """Returns the shared client for a provider.
+
+    Clients are keyed by provider, model and credentials. Anthropic and OpenAI clients
+    are model agnostic and shared across models; Gemini clients are GenerativeModel
+    instances, one per model.
+    """
+    if provider == "claude":
+        return anthropic_client(**credentials)
+    if provider == "openai":
+        return openai_client(**credentials)
+    if provider == "gemini":
+        return gemini_model(model_id, **credentials)
+    raise ValueError(f"Unknown provider: {provider}")
+
+async def aclose_clients():
+    """Closes the async clients created on the running event loop.
+
+    Their connection pools are bound to that loop, so call this before the loop ends,
+    ex: at the end of the coroutine given to asyncio.run.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = list(_async_clients.pop(loop, {}).values())
+    for client in clients:
+        # AsyncAnthropic and AsyncOpenAI close with a coroutine; GenerativeModel holds no pool
+        close = getattr(client, "close", None)
+        if close:
+            try:
+                result = close()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logr(f"Failed to close async llm client: {e}")
+
+def close_clients():
+    # Async clients are closed by aclose_clients on their own event loop
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                logr(f"Failed to close llm client: {e}")
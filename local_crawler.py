@@ -0,0 +1,249 @@
+import argparse
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import requests
+from bs4 import BeautifulSoup
+
+# Modules
+import http_session
+from link_extractor import DEFAULT_EXCLUDES, extract_links
+from shared import scraper_api, html2markdown, normalize_url, write_scraped_items, SCRAPER_ENDPOINT, HTML_PARSER
+from shared import log_message as logr
+
+USER_AGENT = "gennie-crawler/1.0"
+PAGE_LIMIT = 100
+MAX_DEPTH = 1
+MAX_WORKERS = 8
+# Minimum seconds between two requests to the same host; robots.txt Crawl-delay wins when larger
+HOST_DELAY = 0.2
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class HostPoliteness:
+    """Spaces requests to each host by a minimum delay and applies its robots.txt rules."""
+    def __init__(self, delay=HOST_DELAY, respect_robots=True):
+        self.delay = delay
+        self.respect_robots = respect_robots
+        self.robots = {}
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def _robots(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            if origin in self.robots:
+                return self.robots[origin]
+        parser = RobotFileParser(f"{origin}/robots.txt")
+        try:
+            response = http_session.get(parser.url, headers={"User-Agent": USER_AGENT}, timeout=10)
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code == 200:
+                parser.parse(response.text.splitlines())
+            else:
+                parser.allow_all = True
+        except requests.exceptions.RequestException as e:
+            logr(f"Failed to read {parser.url}, crawling without it: {e}")
+            parser.allow_all = True
+        with self.lock:
+            return self.robots.setdefault(origin, parser)
+
+    def allowed(self, url):
+        return not self.respect_robots or self._robots(url).can_fetch(USER_AGENT, url)
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        delay = self.delay
+        if self.respect_robots:
+            delay = max(delay, self._robots(url).crawl_delay(USER_AGENT) or 0)
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(host, 0))
+            self.next_slot[host] = slot + delay
+        if slot > now:
+            time.sleep(slot - now)
+
+class LocalCrawler:
+    """Breadth-first crawler behind a bounded thread pool.
+
+    Starts from urls and follows links on the same domain (optionally under path_prefix) up
+    to max_depth hops, fetching at most page_limit pages. Pages come from plain HTTP or,
+    with fetcher="scraper", from the scraper_api endpoint for pages that need a browser.
+    """
+    def __init__(self, urls, output_format="markdown", page_limit=PAGE_LIMIT, max_depth=MAX_DEPTH, max_workers=MAX_WORKERS,
+                 host_delay=HOST_DELAY, respect_robots=True, fetcher="http", endpoint=SCRAPER_ENDPOINT,
+                 excludes=DEFAULT_EXCLUDES, path_prefix=None):
+        self.urls = urls
+        self.output_format = output_format
+        self.page_limit = page_limit
+        self.max_depth = max_depth
+        self.max_workers = max_workers
+        self.fetcher = fetcher
+        self.endpoint = endpoint
+        self.excludes = excludes
+        self.path_prefix = path_prefix
+        self.politeness = HostPoliteness(host_delay, respect_robots)
+        self.seen = set()
+        self.blocked = set()
+        self.data = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, url):
+        self.politeness.wait(url)
+        if self.fetcher == "scraper":
+            return scraper_api(url, "raw-html", 3000, endpoint=self.endpoint).content
+        response = http_session.get(url, headers={"User-Agent": USER_AGENT})
+        if response.status_code != 200 or "html" not in response.headers.get("Content-Type", "text/html"):
+            logr(f"Skipping {url}: {response.status_code} {response.headers.get('Content-Type')}")
+            return None
+        return response.text
+
+    def render(self, html):
+        if self.output_format == "markdown":
+            return html2markdown(html)
+        if self.output_format == "text":
+            return BeautifulSoup(html, HTML_PARSER).get_text("\n", strip=True)
+        return html
+
+    def visit(self, url, depth):
+        """Fetches one page and returns the links to crawl from it.
+
+        Any failure on the page (fetch, a scraper error reply, parsing) is counted in
+        errors and ends only this page, never the crawl.
+        """
+        try:
+            html = self.fetch(url)
+            if isinstance(html, bytes):
+                html = html.decode("utf-8", errors="replace")
+            if html and not isinstance(html, str):
+                # scraper_api reports failures as a dict instead of the page
+                raise ValueError(f"no HTML returned: {str(html)[:200]}")
+            if html:
+                text = self.render(html)
+                links = extract_links(html, url, path_prefix=self.path_prefix, excludes=self.excludes) if depth < self.max_depth else []
+        except Exception as e:
+            logr(f"Failed to crawl {url}: {e}")
+            html = None
+        if not html:
+            with self.lock:
+                self.errors += 1
+            return []
+        with self.lock:
+            self.data.append({"url": url, "text": text})
+        return links
+
+    def _claim(self, url):
+        # Reserves a page for url; None when already seen, disallowed or over the page limit
+        url = normalize_url(url)
+        with self.lock:
+            if url in self.seen or url in self.blocked or len(self.seen) >= self.page_limit:
+                return None
+        if not self.politeness.allowed(url):
+            logr(f"robots.txt disallows {url}")
+            with self.lock:
+                self.blocked.add(url)
+            return None
+        with self.lock:
+            if url in self.seen or len(self.seen) >= self.page_limit:
+                return None
+            self.seen.add(url)
+            return url
+
+    def run(self, progress=None):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            for url in self.urls:
+                url = self._claim(url)
+                if url:
+                    pending[executor.submit(self.visit, url, 0)] = 0
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    depth = pending.pop(future)
+                    for link in future.result():
+                        link = self._claim(link)
+                        if link:
+                            pending[executor.submit(self.visit, link, depth + 1)] = depth + 1
+                if progress:
+                    progress(len(self.data), len(self.seen))
+        return self.data
+
+def create_scrape_job(urls, token=None, output_format="markdown", webhook_url=None, **options):
+    """Starts a crawl in a background thread and returns its job ID.
+
+    Mirrors usescraper_wrapper.create_scrape_job; token and webhook_url are accepted for
+    compatibility and ignored. options are passed to LocalCrawler.
+    """
+    job_id = uuid.uuid4().hex
+    crawler = LocalCrawler(urls, output_format, **options)
+    job = {"id": job_id, "status": "running", "created_at": time.time(), "crawler": crawler}
+    with _jobs_lock:
+        _jobs[job_id] = job
+
+    def run():
+        try:
+            crawler.run()
+            job["status"] = "succeeded"
+        except Exception as e:
+            logr(f"Crawl job {job_id} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["finished_at"] = time.time()
+
+    threading.Thread(target=run, daemon=True).start()
+    logr(f"Crawl job created with ID: {job_id}")
+    return job_id
+
+def get_job_info(job_id, token=None):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        logr(f"Error: unknown job {job_id}")
+        return None
+    crawler = job["crawler"]
+    info = {k: v for k, v in job.items() if k != "crawler"}
+    info["progress"] = {"scraped": len(crawler.data), "queued": len(crawler.seen), "failed": crawler.errors}
+    return info
+
+def get_scraped_data(job_id, token=None, output_path=None, json_output=False):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        logr(f"Error: unknown job {job_id}")
+        return None
+    result = {"data": list(job["crawler"].data)}
+    if output_path:
+        count = write_scraped_items(result['data'], output_path, json_output, resume_key=job_id)
+        logr(f"Scraped data saved to: {output_path} ({count} items)")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl URLs locally')
+    parser.add_argument('urls', nargs='+', help='Start URLs')
+    parser.add_argument('--output_format', '-o', default='markdown', choices=['text', 'html', 'markdown'], help='Output format for crawled content')
+    parser.add_argument('--page_limit', type=int, default=PAGE_LIMIT, help='Maximum number of pages')
+    parser.add_argument('--max_depth', type=int, default=MAX_DEPTH, help='Maximum link hops from the start URLs')
+    parser.add_argument('--max_workers', type=int, default=MAX_WORKERS, help='Concurrent fetches')
+    parser.add_argument('--host_delay', type=float, default=HOST_DELAY, help='Seconds between requests to the same host')
+    parser.add_argument('--ignore_robots', action='store_true', help='Do not apply robots.txt')
+    parser.add_argument('--fetcher', default='http', choices=['http', 'scraper'], help='Fetch with plain HTTP or the scraper_api endpoint')
+    parser.add_argument('--parse', '-p', action='store_true', help='Save the page texts instead of the JSON data')
+    parser.add_argument('--output_path', '-op', default=f'/mnt/genai/scraper_downloads/{int(time.time())}-localcrawl.md',
+                        help='Path to save the scraped data')
+    args = parser.parse_args()
+
+    crawler = LocalCrawler(args.urls, args.output_format, args.page_limit, args.max_depth, args.max_workers,
+                           args.host_delay, not args.ignore_robots, args.fetcher)
+    data = crawler.run(progress=lambda scraped, queued: logr(f"{scraped} pages scraped, {queued} queued"))
+    write_scraped_items(data, args.output_path, json_output=args.parse)
+    logr(f"Scraped {len(data)} pages to: {args.output_path}")
+
+if __name__ == '__main__':
+    main()
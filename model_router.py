@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Modules
+from shared import log_message as logr
+import llm_cache
+import tracing
+
+# Model id prefix -> provider
+MODEL_PREFIXES = [
+    ("gemini", "gemini"),
+    ("claude", "claude"),
+    ("gpt", "openai"),
+    ("chatgpt", "openai"),
+    ("o1", "openai"),
+]
+
+# Provider -> inference module, imported on first use so a provider's SDK is only
+# required when one of its models is actually called
+PROVIDER_MODULES = {
+    "gemini": "gemini_inference",
+    "claude": "claude_inference",
+    "openai": "openai_inference",
+}
+
+# Requests per minute per provider, overridable with GENNIE_RPM_<PROVIDER>
+RATE_LIMITS = {
+    "gemini": 300,
+    "claude": 50,
+    "openai": 500,
+}
+
+# Models tried, in order, when the primary one is throttled or too slow
+FALLBACK_MODELS = {
+    "gemini-1.5-pro-001": ["gemini-1.5-flash-001"],
+    "claude-3-opus-20240229": ["claude-3-5-sonnet-20240620"],
+    "claude-3-5-sonnet-20240620": ["gemini-1.5-pro-001"],
+}
+
+# Seconds a call may wait on its provider's rate limit before failing over
+MAX_QUEUE_WAIT = 5
+
+THROTTLING_ERRORS = ("RateLimitError", "ResourceExhausted", "TooManyRequests", "OverloadedError")
+
+class ModelThrottled(Exception):
+    pass
+
+class RateLimiter:
+    """Token bucket allowing rate_per_minute calls, with bursts up to burst calls."""
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1, rate_per_minute // 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, max_wait=None):
+        waited = 0
+        while True:
+            wait = self._reserve()
+            if wait == 0:
+                return True
+            if max_wait is not None and waited + wait > max_wait:
+                return False
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, max_wait=None):
+        waited = 0
+        while True:
+            wait = self._reserve()
+            if wait == 0:
+                return True
+            if max_wait is not None and waited + wait > max_wait:
+                return False
+            await asyncio.sleep(wait)
+            waited += wait
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_timeout_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="model-router")
+
+def resolve_provider(model_id):
+    for prefix, provider in MODEL_PREFIXES:
+        if model_id.startswith(prefix):
+            return provider
+    raise ValueError(f"No provider registered for model: {model_id}")
+
+def get_backend(model_id):
+    return importlib.import_module(PROVIDER_MODULES[resolve_provider(model_id)])
+
+def get_rate_limiter(provider):
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            rate = int(os.getenv(f"GENNIE_RPM_{provider.upper()}", RATE_LIMITS.get(provider, 60)))
+            limiter = RateLimiter(rate)
+            _limiters[provider] = limiter
+    return limiter
+
+def is_throttled(error):
+    if type(error).__name__ in THROTTLING_ERRORS:
+        return True
+    return 429 in (getattr(error, "status_code", None), getattr(error, "code", None))
+
+def _candidates(model_id, fallback_model_ids):
+    if fallback_model_ids is None:
+        fallback_model_ids = FALLBACK_MODELS.get(model_id, [])
+    return [model_id] + [m for m in fallback_model_ids if m != model_id]
+
+def _should_fail_over(error):
+    return isinstance(error, (ModelThrottled, FutureTimeoutError, asyncio.TimeoutError)) or is_throttled(error)
+
+def _cache_key(payload, prompt, type, model_id, **settings):
+    if type == "file":
+        with open(payload, "rb") as f:
+            payload = hashlib.sha256(f.read()).hexdigest()
+    return llm_cache.make_key(resolve_provider(model_id), model_id, prompt, payload, type=type, **settings)
+
+def _record_call(provider, model_id, started_at, error=None):
+    # started_at is None for failed calls, whose latency is not recorded
+    outcome = error.__class__.__name__ if error else "ok"
+    tracing.counter("gennie_llm_calls_total", provider=provider, model=model_id, outcome=outcome)
+    if started_at is not None:
+        tracing.observe("gennie_llm_seconds", time.perf_counter() - started_at, provider=provider, model=model_id)
+
+def _cached_response(cache, payload, prompt, type, model_id, temperature, max_tokens, question):
+    response_cache = llm_cache.get_default_cache() if cache else None
+    if response_cache is None:
+        return None, None, None
+    settings = {"question": question} if question is not None else {}
+    key = _cache_key(payload, prompt, type, model_id, temperature=temperature, max_tokens=max_tokens, **settings)
+    cached = response_cache.get(key)
+    tracing.counter("gennie_llm_cache_requests_total", result="miss" if cached is None else "hit")
+    return response_cache, key, cached
+
+def run_text_inference(payload, prompt, type, model_id, verbose=False, fallback_model_ids=None, timeout=None, max_queue_wait=MAX_QUEUE_WAIT, temperature=1, max_tokens=None, cache=True,
+                       question=None, cache_context=False):
+    """Runs a text inference on the provider serving model_id.
+
+    Each call first takes a slot from its provider's rate limiter. When the primary model
+    is throttled (rate limiter or a 429 from the API) or does not answer within timeout
+    seconds, the call fails over to the next model in fallback_model_ids (FALLBACK_MODELS
+    by default). The last candidate always waits for its rate limit instead of failing.
+
+    Responses are memoized in llm_cache, keyed by provider, model, prompt, payload and
+    generation settings; pass cache=False for calls whose output should not be reused.
+    Only answers from the primary model are cached.
+
+    Providers receive the prompt (static instructions) first, then the payload, then
+    question, the part that changes from call to call. That order keeps the instructions
+    and payload a stable prefix, which providers can reuse between calls. With
+    cache_context the prefix is also cached explicitly on the provider side (Anthropic
+    cache breakpoints, Vertex cached content), for payloads that will be sent again,
+    such as the search context of a conversation.
+    """
+    response_cache, key, cached = _cached_response(cache, payload, prompt, type, model_id, temperature, max_tokens, question)
+    if cached is not None:
+        return cached
+    candidates = _candidates(model_id, fallback_model_ids)
+    for position, candidate in enumerate(candidates):
+        is_last = position == len(candidates) - 1
+        provider = resolve_provider(candidate)
+        try:
+            if not get_rate_limiter(provider).acquire(None if is_last else max_queue_wait):
+                raise ModelThrottled(f"{provider} rate limit reached")
+            backend = get_backend(candidate)
+            call_args = (payload, prompt, type, candidate, verbose)
+            call_kwargs = {"temperature": temperature, "max_tokens": max_tokens, "question": question, "cache_context": cache_context}
+            started_at = time.perf_counter()
+            if timeout is None:
+                response = backend.run_text_inference(*call_args, **call_kwargs)
+            else:
+                future = _timeout_pool.submit(backend.run_text_inference, *call_args, **call_kwargs)
+                # A timed out call keeps running in the pool; only its result is discarded
+                response = future.result(timeout=timeout)
+            _record_call(provider, candidate, started_at)
+        except Exception as e:
+            _record_call(provider, candidate, None, e)
+            if is_last or not _should_fail_over(e):
+                raise
+            logr(f"{candidate} throttled or slow ({e.__class__.__name__}), failing over to {candidates[position + 1]}")
+            continue
+        if response_cache and response is not None and candidate == model_id:
+            response_cache.put(key, response)
+        return response
+
+async def run_text_inference_async(payload, prompt, type, model_id, verbose=False, timeout=None, fallback_model_ids=None, max_queue_wait=MAX_QUEUE_WAIT, temperature=1, max_tokens=None, cache=True,
+                                   question=None, cache_context=False):
+    response_cache, key, cached = _cached_response(cache, payload, prompt, type, model_id, temperature, max_tokens, question)
+    if cached is not None:
+        return cached
+    candidates = _candidates(model_id, fallback_model_ids)
+    for position, candidate in enumerate(candidates):
+        is_last = position == len(candidates) - 1
+        provider = resolve_provider(candidate)
+        try:
+            if not await get_rate_limiter(provider).acquire_async(None if is_last else max_queue_wait):
+                raise ModelThrottled(f"{provider} rate limit reached")
+            backend = get_backend(candidate)
+            started_at = time.perf_counter()
+            response = await backend.run_text_inference_async(payload, prompt, type, candidate, verbose, timeout=timeout, temperature=temperature,
+                                                              max_tokens=max_tokens, question=question, cache_context=cache_context)
+            _record_call(provider, candidate, started_at)
+        except Exception as e:
+            _record_call(provider, candidate, None, e)
+            if is_last or not _should_fail_over(e):
+                raise
+            logr(f"{candidate} throttled or slow ({e.__class__.__name__}), failing over to {candidates[position + 1]}")
+            continue
+        if response_cache and response is not None and candidate == model_id:
+            response_cache.put(key, response)
+        return response
+
+def stream_text_inference(payload, prompt, type, model_id, verbose=False, fallback_model_ids=None, max_queue_wait=MAX_QUEUE_WAIT, temperature=1, max_tokens=None,
+                          question=None, cache_context=False):
+    """Streaming counterpart of run_text_inference, yielding text chunks as they arrive.
+
+    Failover only happens before the first chunk; once text has been yielded errors
+    propagate to the caller. Streamed responses are never cached.
+    """
+    candidates = _candidates(model_id, fallback_model_ids)
+    for position, candidate in enumerate(candidates):
+        is_last = position == len(candidates) - 1
+        provider = resolve_provider(candidate)
+        started = False
+        try:
+            if not get_rate_limiter(provider).acquire(None if is_last else max_queue_wait):
+                raise ModelThrottled(f"{provider} rate limit reached")
+            backend = get_backend(candidate)
+            started_at = time.perf_counter()
+            for chunk in backend.stream_text_inference(payload, prompt, type, candidate, verbose, temperature=temperature, max_tokens=max_tokens,
+                                                       question=question, cache_context=cache_context):
+                if not started:
+                    tracing.observe("gennie_llm_first_chunk_seconds", time.perf_counter() - started_at, provider=provider, model=candidate)
+                started = True
+                yield chunk
+            _record_call(provider, candidate, started_at)
+            return
+        except Exception as e:
+            _record_call(provider, candidate, None, e)
+            if started or is_last or not _should_fail_over(e):
+                raise
+            logr(f"{candidate} throttled or slow ({e.__class__.__name__}), failing over to {candidates[position + 1]}")
+
+def count_chars_and_tokens(model_id, content):
+    return get_backend(model_id).count_chars_and_tokens(model_id, content)
+
+def token_counter(model_id):
+    """Returns a text -> token count function for model_id, the count_tokens argument
+    of context_packer.pack_search_results. Each count is a provider call."""
+    return lambda text: count_chars_and_tokens(model_id, text)["num_tokens"]
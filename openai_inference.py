@@ -2,13 +2,15 @@ import argparse
 import os
 import tiktoken
 import tempfile
-from openai import OpenAI
 from bs4 import BeautifulSoup
 
 from pydub import AudioSegment
 
 # Modules
 from shared import log_message as logr
+import llm_clients
+from async_inference import bounded
+import tracing
 
 def count_chars_and_tokens(model_id, content):
     encoding = tiktoken.encoding_for_model(model_id)
@@ -16,21 +18,40 @@ def count_chars_and_tokens(model_id, content):
     num_chars = len(content)
     return { "num_chars" : num_chars, "num_tokens" : num_tokens } 
 
-def run_text_inference(payload, prompt, type, model_id, verbose=False):
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+def extract_body_text(payload, type):
     # Extract the body content using BeautifulSoup if payload is from a file
     if type == "file":
         with open(payload, "r") as html_file:
             payload = html_file.read()
         soup = BeautifulSoup(payload, 'html.parser')
-        body_text = soup.body.get_text()
-    else:
-        body_text = payload
+        return soup.body.get_text()
+    return payload
+
+MAX_TOKENS = 16384
+
+def build_message(body_text, prompt, question=None):
+    """Instructions, then the content, then the question.
+
+    OpenAI caches long prompt prefixes automatically, so keeping what calls repeat
+    (instructions and content) ahead of what changes (the question) lets them hit.
+    """
+    parts = [prompt] + ([f"Content: {body_text}"] if body_text else []) + ([question] if question else [])
+    return "\n\n".join(parts)
+
+def _record_usage(model_id, usage):
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        tracing.record_usage("openai", model_id, usage.prompt_tokens, usage.completion_tokens,
+                             cache_read=getattr(details, "cached_tokens", None))
 
-    # Prepare the message for OpenAI Chat Completion
-    message = f"Content: {body_text}\n\n{prompt}"
+def run_text_inference(payload, prompt, type, model_id, verbose=False, temperature=1, max_tokens=None, question=None, cache_context=False):
+    # Shared OpenAI client (pooled keep-alive connections)
+    client = llm_clients.openai_client()
+
+    body_text = extract_body_text(payload, type)
+
+    # Prepare the message for OpenAI Chat Completion (prefix caching is automatic, cache_context needs nothing)
+    message = build_message(body_text, prompt, question)
 
     # Generate content using the Chat Completions API
     response = client.chat.completions.create(
@@ -38,16 +59,58 @@ def run_text_inference(payload, prompt, type, model_id, verbose=False):
         messages=[
             {"role": "user", "content": message}
         ],
-        max_tokens=16384,
-        temperature=1,
+        max_tokens=max_tokens or MAX_TOKENS,
+        temperature=temperature,
     )
+    _record_usage(model_id, response.usage)
     # Log and return the response
     if verbose:
         print(response.choices[0].message.content)
     return response.choices[0].message.content
 
+def stream_text_inference(payload, prompt, type, model_id, verbose=False, temperature=1, max_tokens=None, question=None, cache_context=False):
+    """Generator variant of run_text_inference yielding text as it is produced."""
+    client = llm_clients.openai_client()
+    body_text = extract_body_text(payload, type)
+    message = build_message(body_text, prompt, question)
+    stream = client.chat.completions.create(
+        model=model_id,
+        messages=[
+            {"role": "user", "content": message}
+        ],
+        max_tokens=max_tokens or MAX_TOKENS,
+        temperature=temperature,
+        stream=True,
+        # The final chunk then carries the token usage, with no choices
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if chunk.usage:
+            _record_usage(model_id, chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            if verbose:
+                print(chunk.choices[0].delta.content, end="", flush=True)
+            yield chunk.choices[0].delta.content
+
+async def run_text_inference_async(payload, prompt, type, model_id, verbose=False, timeout=None, temperature=1, max_tokens=None, question=None, cache_context=False):
+    client = llm_clients.async_openai_client()
+    body_text = extract_body_text(payload, type)
+    message = build_message(body_text, prompt, question)
+    response = await bounded(client.chat.completions.create(
+        model=model_id,
+        messages=[
+            {"role": "user", "content": message}
+        ],
+        max_tokens=max_tokens or MAX_TOKENS,
+        temperature=temperature,
+    ), timeout)
+    _record_usage(model_id, response.usage)
+    if verbose:
+        print(response.choices[0].message.content)
+    return response.choices[0].message.content
+
 def transcribe_audio(file_path, model="whisper-1", sampled=False):
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = llm_clients.openai_client()
     temp_file_path = None
     try:
         if sampled:
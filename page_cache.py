@@ -0,0 +1,175 @@
+import email.utils
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import requests
+
+# Modules
+import http_session
+from shared import log_message as logr
+from shared import normalize_url
+
+# GENNIE_PAGE_CACHE=off disables the cache
+DEFAULT_PATH = os.getenv("GENNIE_PAGE_CACHE", os.path.expanduser("~/.cache/gennie/pages.sqlite"))
+DEFAULT_TTL = int(os.getenv("GENNIE_PAGE_CACHE_TTL", 24 * 3600))
+DEFAULT_MAX_BYTES = int(os.getenv("GENNIE_PAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+REVALIDATE_TIMEOUT = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    html TEXT,
+    markdown TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at);
+"""
+
+def url_key(url):
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+class PageCache:
+    """On-disk cache of fetched HTML and the markdown derived from it.
+
+    Entries are keyed by the hash of the normalized URL. Entries older than ttl are
+    revalidated against the origin with ETag/Last-Modified before being served, and the
+    least recently used entries are evicted once the cache grows past max_bytes.
+    """
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "expired": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def get(self, url):
+        key = url_key(url)
+        with self.lock:
+            row = self.db.execute("SELECT * FROM pages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        entry = dict(row)
+        now = time.time()
+        if now - entry["fetched_at"] > self.ttl:
+            if not self._revalidate(key, entry):
+                self._count("expired")
+                self._count("misses")
+                return None
+            self._count("revalidated")
+            entry["fetched_at"] = now
+        with self.lock:
+            self.db.execute("UPDATE pages SET accessed_at = ?, fetched_at = ? WHERE key = ?", (now, entry["fetched_at"], key))
+            self.db.commit()
+        self._count("hits")
+        return entry
+
+    def put(self, url, html=None, markdown=None, etag=None, last_modified=None):
+        now = time.time()
+        size = len(html or '') + len(markdown or '')
+        with self.lock:
+            self.db.execute(
+                """INSERT INTO pages (key, url, html, markdown, etag, last_modified, fetched_at, accessed_at, size)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET
+                       html = excluded.html,
+                       markdown = excluded.markdown,
+                       etag = COALESCE(excluded.etag, pages.etag),
+                       last_modified = COALESCE(excluded.last_modified, pages.last_modified),
+                       fetched_at = excluded.fetched_at,
+                       accessed_at = excluded.accessed_at,
+                       size = excluded.size""",
+                (url_key(url), normalize_url(url), html, markdown, etag, last_modified, now, now, size),
+            )
+            self.db.commit()
+            self._evict()
+
+    def put_markdown(self, url, markdown):
+        with self.lock:
+            self.db.execute(
+                "UPDATE pages SET markdown = ?, size = LENGTH(COALESCE(html, '')) + ? WHERE key = ?",
+                (markdown, len(markdown or ''), url_key(url)),
+            )
+            self.db.commit()
+            self._evict()
+
+    def _evict(self):
+        # Caller holds self.lock
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM pages ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+        self.db.commit()
+
+    def _revalidate(self, key, entry):
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = http_session.head(entry["url"], headers=headers, allow_redirects=True, timeout=REVALIDATE_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logr(f"Failed to revalidate {entry['url']}: {e}")
+            return False
+        if response.status_code == 304:
+            return True
+        if response.status_code != 200:
+            return False
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        unchanged = False
+        if etag and entry["etag"]:
+            unchanged = etag == entry["etag"]
+        elif last_modified:
+            try:
+                modified_at = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                unchanged = modified_at <= entry["fetched_at"]
+            except (TypeError, ValueError):
+                unchanged = False
+        if etag or last_modified:
+            # When the page changed these describe the copy stored by the next put()
+            with self.lock:
+                self.db.execute("UPDATE pages SET etag = ?, last_modified = ? WHERE key = ?", (etag, last_modified, key))
+                self.db.commit()
+        return unchanged
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def summary(self):
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            return dict(self.stats, entries=entries, bytes=size)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    global _default_cache
+    if DEFAULT_PATH.lower() in ("off", "none", "0", ""):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PageCache()
+    return _default_cache
@@ -1,10 +1,15 @@
 import requests
+import codecs
 import json
 import re
 import datetime
 import os
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from bs4 import BeautifulSoup
 
+import http_session
+
 def ensure_folder(folder_path):
   """
   Checks if a folder exists and creates it if it doesn't.
@@ -41,45 +46,488 @@ def convert_integer_to_decimal(number):
 def convert_string_to_list(url_string):
     return [url.strip().strip('"') for url in url_string.split(',')]
 
-def html2markdown(html):
-    soup = BeautifulSoup(html, 'html.parser')
+def normalize_url(url):
+    """Normalizes a URL so equivalent spellings map to the same key.
+
+    Lowercases scheme and host, drops default ports, fragments and empty queries,
+    sorts query parameters and removes the trailing slash from non-root paths.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ''))
+
+SCRAPER_ENDPOINT = "http://192.168.100.9:3002/navigate"
+
+# lxml is several times faster than the pure-Python html.parser; fall back when missing
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# Markers pushed on the html2markdown work stack next to elements
+_LITERAL = 0
+_LIST_ITEM = 1
+_LIST_ITEM_END = 2
+
+def html2markdown(html, parser=None):
+    """Converts an HTML document to markdown.
+
+    The tree is walked with an explicit stack (no recursion limit on deep DOMs) and all
+    output goes to a single buffer. List items are rendered into the same buffer and
+    collapsed in place once their subtree is done.
+    """
+    soup = BeautifulSoup(html, parser or HTML_PARSER)
     # Remove unnecessary elements
     for element in soup(['script', 'style', 'header', 'footer', 'nav']):
         element.decompose()
     body = soup.body if soup.body else soup
-    def convert_element(element):
-        if element.name is None:
-            return element.string
-        if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-            return f"{'#' * int(element.name[1])} {element.get_text().strip()}\n\n"
-        if element.name == 'p':
-            return f"{element.get_text().strip()}\n\n"
-        if element.name == 'a':
-            return f"[{element.get_text()}]({element.get('href', '')})"
-        if element.name == 'img':
-            return f"![{element.get('alt', '')}]({element.get('src', '')})"
-        if element.name in ['ul', 'ol']:
-            items = []
-            for i, li in enumerate(element.find_all('li', recursive=False)):
-                prefix = '- ' if element.name == 'ul' else f"{i+1}. "
-                items.append(f"{prefix}{convert_element(li).strip()}")
-            return '\n'.join(items) + '\n\n'
-        if element.name in ['strong', 'b']:
-            return f"**{element.get_text()}**"
-        if element.name in ['em', 'i']:
-            return f"*{element.get_text()}*"
-        if element.name == 'code':
-            return f"`{element.get_text()}`"
-        if element.name == 'pre':
-            return f"```\n{element.get_text()}\n```\n\n"
-        return ''.join(convert_element(child) for child in element.children)
-    markdown = convert_element(body)
+    out = []
+    stack = [body]
+    while stack:
+        item = stack.pop()
+        if type(item) is tuple:
+            if item[0] == _LITERAL:
+                out.append(item[1])
+            elif item[0] == _LIST_ITEM:
+                _, li, prefix = item
+                stack.append((_LIST_ITEM_END, len(out), prefix))
+                stack.extend(reversed(li.contents))
+            else:
+                _, start, prefix = item
+                text = ''.join(out[start:]).strip()
+                del out[start:]
+                out.append(f"{prefix}{text}")
+            continue
+        name = item.name
+        if name is None:
+            out.append(str(item))
+        elif name in HEADINGS:
+            out.append(f"{'#' * int(name[1])} {item.get_text().strip()}\n\n")
+        elif name == 'p':
+            out.append(f"{item.get_text().strip()}\n\n")
+        elif name == 'a':
+            out.append(f"[{item.get_text()}]({item.get('href', '')})")
+        elif name == 'img':
+            out.append(f"![{item.get('alt', '')}]({item.get('src', '')})")
+        elif name in ('ul', 'ol'):
+            tasks = []
+            for i, li in enumerate(item.find_all('li', recursive=False)):
+                if i:
+                    tasks.append((_LITERAL, '\n'))
+                tasks.append((_LIST_ITEM, li, '- ' if name == 'ul' else f"{i+1}. "))
+            tasks.append((_LITERAL, '\n\n'))
+            stack.extend(reversed(tasks))
+        elif name in ('strong', 'b'):
+            out.append(f"**{item.get_text()}**")
+        elif name in ('em', 'i'):
+            out.append(f"*{item.get_text()}*")
+        elif name == 'code':
+            out.append(f"`{item.get_text()}`")
+        elif name == 'pre':
+            out.append(f"```\n{item.get_text()}\n```\n\n")
+        else:
+            stack.extend(reversed(item.contents))
+    markdown = ''.join(out)
     # Clean up extra newlines
     markdown = re.sub(r'\n{3,}', '\n\n', markdown)
     return markdown.strip()
   
+class MarkdownStreamConverter(HTMLParser):
+    """Incremental (SAX-style) counterpart of html2markdown.
+
+    HTML is fed in chunks and markdown is written out as soon as each element closes,
+    so no DOM is built: memory holds the open-element stack, the text of the element
+    being converted and any unfinished list item. Skipped subtrees (script, style, nav,
+    ...) are discarded while parsing. Implied end tags are approximated for li and p.
+    """
+    SKIPPED = {'script', 'style', 'header', 'footer', 'nav', 'head', 'title', 'noscript', 'template'}
+    CAPTURED = HEADINGS | {'p', 'a', 'strong', 'b', 'em', 'i', 'code', 'pre'}
+    VOID = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self, write=None):
+        super().__init__(convert_charrefs=True)
+        self.output = [] if write is None else None
+        self.write = write or self.output.append
+        self.open = []          # [tag, role] for every open element
+        self.skip_depth = 0
+        self.capture = None     # [tag, attrs, texts] of the element whose text is collected
+        self.targets = []       # buffers of the list items being rendered
+        self.lists = []         # [tag, item_count] of the open lists
+        self.pending = ''       # trailing whitespace held back until more text arrives
+        self.started = False
+        self.blank = ''         # text run seen so far between two tags, while it is only whitespace
+        self.in_text = False    # the current text run has non-whitespace and is passed through
+
+    def _emit(self, text):
+        # Mirrors html2markdown's final newline collapsing and strip, incrementally
+        text = self.pending + text
+        body = text.rstrip()
+        if not body:
+            self.pending = text
+            return
+        self.pending = text[len(body):]
+        if not self.started:
+            body = body.lstrip()
+            self.started = True
+        self.write(re.sub(r'\n{3,}', '\n\n', body))
+
+    def _out(self, text):
+        if self.targets:
+            self.targets[-1].append(text)
+        else:
+            self._emit(text)
+
+    def _in_list_container(self):
+        # Directly inside <ul>/<ol>: only <li> children are converted
+        return bool(self.open) and self.open[-1][1] == 'list'
+
+    def _end_text(self):
+        # BeautifulSoup turns a whitespace-only string between two tags into a single
+        # newline or space (outside pre/textarea); runs are held until a tag ends them
+        if self.blank:
+            blank = self.blank
+            if not any(tag in ('pre', 'textarea') for tag, _ in self.open):
+                blank = '\n' if '\n' in blank else ' '
+            self._data(blank)
+        self.blank = ''
+        self.in_text = False
+
+    def handle_starttag(self, tag, attrs):
+        self._end_text()
+        if self.skip_depth:
+            if tag not in self.VOID:
+                self.open.append([tag, 'skipped'])
+            return
+        if tag == 'li' and self.lists:
+            self._close_implied_item()
+        elif tag == 'p' and self.capture and self.capture[0] == 'p':
+            # A new <p> closes the open paragraph
+            self._close_element(next(i for i, (_, role) in enumerate(self.open) if role == 'capture'))
+        if self._in_list_container() and tag != 'li' or tag in self.SKIPPED:
+            if tag not in self.VOID:
+                self.skip_depth += 1
+                self.open.append([tag, 'skip'])
+            return
+        if self.capture:
+            if tag not in self.VOID:
+                self.open.append([tag, None])
+            return
+        if tag in self.VOID:
+            if tag == 'img':
+                attrs = dict(attrs)
+                self._out(f"![{attrs.get('alt') or ''}]({attrs.get('src') or ''})")
+            return
+        if tag in self.CAPTURED:
+            self.capture = [tag, dict(attrs), []]
+            self.open.append([tag, 'capture'])
+        elif tag in ('ul', 'ol'):
+            self.lists.append([tag, 0])
+            self.open.append([tag, 'list'])
+        elif tag == 'li' and self._in_list_container():
+            self.targets.append([])
+            self.open.append([tag, 'item'])
+        else:
+            self.open.append([tag, None])
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in self.VOID:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._end_text()
+        for index in range(len(self.open) - 1, -1, -1):
+            if self.open[index][0] == tag:
+                self._close_element(index)
+                return
+
+    def handle_data(self, data):
+        if not self.in_text:
+            self.blank += data
+            if not self.blank.strip(self.ASCII_SPACES):
+                return
+            data, self.blank, self.in_text = self.blank, '', True
+        self._data(data)
+
+    def handle_comment(self, data):
+        self._end_text()
+
+    def handle_decl(self, decl):
+        self._end_text()
+
+    def handle_pi(self, data):
+        self._end_text()
+
+    def _data(self, data):
+        if self.skip_depth or self._in_list_container():
+            return
+        if self.capture:
+            self.capture[2].append(data)
+        else:
+            self._out(data)
+
+    def _close_implied_item(self):
+        # A new <li> closes the previous item of the same list
+        for index in range(len(self.open) - 1, -1, -1):
+            role = self.open[index][1]
+            if role == 'item':
+                self._close_element(index)
+                return
+            if role in ('list', 'skip'):
+                return
+
+    def _close_element(self, index):
+        while len(self.open) > index:
+            tag, role = self.open.pop()
+            if role == 'skip':
+                self.skip_depth -= 1
+            elif role == 'capture':
+                self._finish_capture()
+            elif role == 'item':
+                text = ''.join(self.targets.pop()).strip()
+                list_tag, count = self.lists[-1]
+                prefix = '- ' if list_tag == 'ul' else f"{count + 1}. "
+                self._out(f"{chr(10) if count else ''}{prefix}{text}")
+                self.lists[-1][1] += 1
+            elif role == 'list':
+                self.lists.pop()
+                self._out('\n\n')
+
+    def _finish_capture(self):
+        tag, attrs, texts = self.capture
+        self.capture = None
+        text = ''.join(texts)
+        if tag in HEADINGS:
+            self._out(f"{'#' * int(tag[1])} {text.strip()}\n\n")
+        elif tag == 'p':
+            self._out(f"{text.strip()}\n\n")
+        elif tag == 'a':
+            self._out(f"[{text}]({attrs.get('href') or ''})")
+        elif tag in ('strong', 'b'):
+            self._out(f"**{text}**")
+        elif tag in ('em', 'i'):
+            self._out(f"*{text}*")
+        elif tag == 'code':
+            self._out(f"`{text}`")
+        elif tag == 'pre':
+            self._out(f"```\n{text}\n```\n\n")
+
+    def close(self):
+        super().close()
+        self._end_text()
+        self._close_element(0)
+        # Trailing whitespace is dropped, like html2markdown's strip()
+        self.pending = ''
+        return ''.join(self.output) if self.output is not None else None
+
+def html2markdown_stream(chunks, write=None, encoding='utf-8'):
+    """Converts an iterable of HTML chunks (str or bytes) to markdown without building a DOM.
+
+    Markdown pieces are passed to write as they are produced; without write the full
+    markdown is returned.
+    """
+    converter = MarkdownStreamConverter(write)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for chunk in chunks:
+        converter.feed(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+    converter.feed(decoder.decode(b'', final=True))
+    return converter.close()
+
+def stream_raw_html(url, chunk_size=64 * 1024, pageLoadTimeout=0, endpoint=SCRAPER_ENDPOINT):
+    """Fetches url through the scraper endpoint, yielding the raw HTML in chunks."""
+    payload = {
+        "url": url,
+        "mode": "full-body-load",
+        "selector": False,
+        "screenshot": False,
+        "save_html": False,
+        "sessionState_enable": False,
+        "sessionStateFolder": "session-data/tmp",
+        "outputMode": "raw-html",
+        "structuredOutput": False,
+        "pageLoadTimeout": pageLoadTimeout
+    }
+    with http_session.post(endpoint, headers={"Content-Type": "application/json"}, json=payload, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+
+class _JSONStream:
+    """Incremental reader over a stream of JSON text chunks."""
+    DELIMITERS = ' \t\r\n,:]}'
+
+    def __init__(self, chunks, encoding):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def more(self):
+        if self.exhausted:
+            return False
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                # Drop consumed text so the buffer only holds the value being decoded
+                self.buffer = self.buffer[self.pos:] + text
+                self.pos = 0
+                return True
+        self.exhausted = True
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b'', final=True)
+        self.pos = 0
+        return False
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                raise ValueError("unexpected end of JSON stream")
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"expected one of {chars!r} at {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number may continue in the next chunk ("1." decodes as 1), so it is only
+                # finished by a delimiter or the end of the stream
+                number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.exhausted or not number or (end < len(self.buffer) and self.buffer[end] in self.DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self.more()
+
+    def items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+def iter_json_array(chunks, key='data', encoding='utf-8'):
+    """Yields the items of a streamed JSON array one at a time.
+
+    chunks is an iterable of str or bytes holding either an array or an object whose
+    key member is the array, ex: a scrape job's {"data": [...]} response.
+    """
+    stream = _JSONStream(chunks, encoding)
+    if stream.peek() == '[':
+        yield from stream.items()
+        return
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        name = stream.value()
+        stream.expect(':')
+        if name == key and stream.peek() == '[':
+            yield from stream.items()
+            return
+        stream.value()
+        if stream.expect(',}') == '}':
+            return
+
+CHECKPOINT_EVERY = 16
+
+def manifest_path(output_path):
+    return f"{output_path}.manifest.jsonl"
+
+def write_scraped_items(items, output_path, json_output=True, resume_key=None):
+    """Writes scraped items to output_path and returns how many were written.
+
+    With json_output each item's text is written followed by a blank line, otherwise each
+    item is written as a JSON line. Writes go to a .part file that replaces output_path only
+    once every item is in, next to a <output_path>.manifest.jsonl with the url, byte offset
+    and length of each item. When resume_key is given, progress is checkpointed and a later
+    call with the same key skips the items already written.
+    """
+    folder = os.path.dirname(output_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    part_path = f"{output_path}.part"
+    manifest = manifest_path(output_path)
+    manifest_part_path = f"{manifest}.part"
+    checkpoint_path = f"{output_path}.checkpoint"
+
+    completed, offset, manifest_offset = 0, 0, 0
+    if resume_key and all(os.path.exists(p) for p in (checkpoint_path, part_path, manifest_part_path)):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("key") == resume_key:
+            completed, offset, manifest_offset = checkpoint["completed"], checkpoint["offset"], checkpoint["manifest_offset"]
+            log_message(f"Resuming {output_path} after {completed} items")
+
+    def save_checkpoint():
+        out.flush()
+        index_file.flush()
+        with open(f"{checkpoint_path}.tmp", 'w') as f:
+            json.dump({"key": resume_key, "completed": completed, "offset": out.tell(), "manifest_offset": index_file.tell()}, f)
+        os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+    with open(part_path, 'r+b' if completed else 'wb') as out, open(manifest_part_path, 'r+b' if completed else 'wb') as index_file:
+        # Anything past the checkpoint is a partially written item
+        out.truncate(offset)
+        out.seek(offset)
+        index_file.truncate(manifest_offset)
+        index_file.seek(manifest_offset)
+        for index, item in enumerate(items):
+            if index < completed:
+                continue
+            if json_output:
+                data = (item.get('text') or '').encode()
+                separator = b"\n\n"
+            else:
+                data = json.dumps(item).encode()
+                separator = b"\n"
+            start = out.tell()
+            out.write(data + separator)
+            entry = {"index": index, "url": item.get('url'), "offset": start, "length": len(data)}
+            index_file.write((json.dumps(entry) + "\n").encode())
+            completed = index + 1
+            if resume_key and completed % CHECKPOINT_EVERY == 0:
+                save_checkpoint()
+        out.flush()
+        os.fsync(out.fileno())
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    # The manifest goes first so a complete output always has its manifest
+    os.replace(manifest_part_path, manifest)
+    os.replace(part_path, output_path)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return completed
+
 class scraper_api:
-    def __init__(self, url , outputMode="raw-html", pageLoadTimeout=0, structured=False, sessionStateFolder="session-data/tmp", mode="full-body-load", selector=False, endpoint="http://192.168.100.9:3002/navigate", screenshot=False, save_html=False, sessionState_enable=False):
+    def __init__(self, url , outputMode="raw-html", pageLoadTimeout=0, structured=False, sessionStateFolder="session-data/tmp", mode="full-body-load", selector=False, endpoint=SCRAPER_ENDPOINT, screenshot=False, save_html=False, sessionState_enable=False):
         self.url = url
         self.mode = mode
         self.selector = selector
@@ -110,7 +558,7 @@ class scraper_api:
             "pageLoadTimeout": self.pageLoadTimeout
         }
         try:
-            response = requests.post(self.endpoint, headers=headers, json=payload)
+            response = http_session.post(self.endpoint, headers=headers, json=payload)
             # response.raise_for_status()  # Raises an HTTPError for bad responses
             if response.status_code == 200:
                 self.content = response.content
@@ -121,4 +569,15 @@ class scraper_api:
             else:
                 self.content = {"error": "Failed to process job", "status_code": response.status_code}
         except requests.exceptions.RequestException as e:
-            self.content = {"error": f"Connection error: {str(e)}"}
\ No newline at end of file
+            self.content = {"error": f"Connection error: {str(e)}"}
+
+class web_crawler(scraper_api):
+    """scraper_api returning the structured JSON output (html_body, ...) as a dict."""
+    def __init__(self, url, **kwargs):
+        kwargs.setdefault("structured", True)
+        super().__init__(url, **kwargs)
+
+    def process(self):
+        super().process()
+        if isinstance(self.content, bytes):
+            self.content = json.loads(self.content)
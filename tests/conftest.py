@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests never read or write the on-disk page and LLM caches
+os.environ["GENNIE_PAGE_CACHE"] = "off"
+os.environ["GENNIE_LLM_CACHE"] = "off"
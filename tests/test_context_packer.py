@@ -0,0 +1,38 @@
+import sys
+import types
+
+import context_packer
+import model_router
+
+class Result:
+    def __init__(self, name, markdown, score):
+        self.link = f"https://example.com/{name}"
+        self.markdown = markdown
+        self.relevance_score = score
+
+    def to_string(self, content=None):
+        return f"URL: {self.link}\nContent: {self.markdown if content is None else content}\n"
+
+def test_low_scores_are_dropped_and_unscored_results_kept_last():
+    results = [Result("unscored", "u", None), Result("low", "l", 3), Result("best", "b", 5), Result("good", "g", 4)]
+    assert [r.link.rsplit("/", 1)[1] for r in context_packer.rank_search_results(results)] == ["best", "good", "unscored"]
+
+def test_long_pages_keep_their_best_passages_in_order():
+    markdown = "\n\n".join(["intro about cooking " * 20, "cloud run concurrency is 80 by default", "unrelated footer " * 20, "set concurrency with gcloud run deploy"])
+    extracted = context_packer.extract_passages(markdown, "What is Cloud Run concurrency?", 40)
+    assert extracted == "cloud run concurrency is 80 by default\n\nset concurrency with gcloud run deploy"
+
+def test_packed_results_fit_the_budget():
+    results = [Result(str(i), "word " * 2000, 5 - i % 2) for i in range(6)]
+    packed = context_packer.pack_search_results(results, "word", 1000)
+    assert context_packer.estimate_tokens(packed) <= 1000 + len(results)
+
+def test_a_provider_token_counter_can_be_passed(monkeypatch):
+    backend = types.ModuleType("fake_inference")
+    backend.count_chars_and_tokens = lambda model_id, content: {"num_chars": len(content), "num_tokens": len(content.split())}
+    monkeypatch.setitem(sys.modules, "fake_inference", backend)
+    monkeypatch.setitem(model_router.PROVIDER_MODULES, "gemini", "fake_inference")
+    count_tokens = model_router.token_counter("gemini-test")
+    assert count_tokens("three words here") == 3
+    packed = context_packer.pack_search_results([Result("a", "word " * 100, 5)], "word", 40, count_tokens=count_tokens)
+    assert count_tokens(packed) <= 40
@@ -0,0 +1,80 @@
+import types
+
+import pytest
+
+import conversation
+import gennie_core
+import model_router
+
+def test_gemini_context_is_large_enough_for_vertex_caching():
+    # gemini_inference.CONTEXT_CACHE_MIN_TOKENS; the module needs the Vertex AI SDK to import
+    assert conversation.context_token_budget("gemini-1.5-flash-001") > 32768
+    assert conversation.context_token_budget("claude-3-5-sonnet-20240620") == conversation.CONTEXT_TOKEN_BUDGET
+
+def test_payload_uses_the_budget_of_the_current_model(monkeypatch):
+    budgets = []
+    monkeypatch.setattr(gennie_core, "gather_search_results", lambda *args, **kwargs: [])
+    monkeypatch.setattr(gennie_core, "serialize_search_results", lambda results, question, budget: budgets.append(budget) or "payload")
+    session = conversation.ConversationSession("claude-3-5-sonnet-20240620")
+    session._prepare("first question")
+    session.model_id = "gemini-1.5-pro-001"
+    session.payload = None
+    session._prepare("second question")
+    conversation.ConversationSession("gemini-1.5-pro-001", context_token_budget=1000)._prepare("question")
+    assert budgets == [conversation.CONTEXT_TOKEN_BUDGET, conversation.GEMINI_CONTEXT_TOKEN_BUDGET, 1000]
+
+class Result:
+    def __init__(self, url, markdown, score=5):
+        self.link = url
+        self.markdown = markdown
+        self.relevance_score = score
+
+    def to_string(self, content=None):
+        return f"URL: {self.link}\nContent: {self.markdown if content is None else content}\n"
+
+@pytest.fixture
+def chat(monkeypatch):
+    """A session whose searches return results[question]; route holds the router's next reply."""
+    chat = types.SimpleNamespace(searches=[], route="ANSWER", compactions=[], results={})
+    def gather_search_results(question, *args, **kwargs):
+        chat.searches.append(question)
+        return chat.results.get(question, [])
+    def run_text_inference(payload, prompt, type, model_id, **kwargs):
+        if prompt == conversation.sufficiency_prompt():
+            return chat.route
+        chat.compactions.append(payload)
+        return f"summary {len(chat.compactions)}"
+    monkeypatch.setattr(gennie_core, "gather_search_results", gather_search_results)
+    monkeypatch.setattr(gennie_core, "serialize_search_results", lambda results, question, budget: [r.link for r in results])
+    monkeypatch.setattr(gennie_core, "summarize_results", lambda payload, question, *args, **kwargs: f"answer to {question}")
+    monkeypatch.setattr(model_router, "run_text_inference", run_text_inference)
+    chat.session = conversation.ConversationSession("gemini-1.5-flash-001", max_recent_turns=2)
+    return chat
+
+def test_follow_up_is_answered_from_the_retained_results(chat):
+    chat.results["cloud run concurrency"] = [Result("https://cloud.example/run/concurrency", "80 requests per instance")]
+    chat.session.ask("cloud run concurrency")
+    payload = chat.session.payload
+    assert chat.session.ask("and how do I change it?") == "answer to and how do I change it?"
+    assert chat.searches == ["cloud run concurrency"]
+    assert chat.session.payload is payload
+
+def test_search_reply_merges_new_results_without_duplicates(chat):
+    chat.results["cloud run concurrency"] = [Result("https://cloud.example/run/concurrency", "80 requests per instance")]
+    chat.results["cloud run pricing"] = [Result("https://cloud.example/run/concurrency/", "the same page again"),
+                                         Result("https://cloud.example/run/pricing", "billed per 100ms")]
+    chat.session.ask("cloud run concurrency")
+    chat.route = "SEARCH: cloud run pricing"
+    chat.session.ask("what does it cost?")
+    assert chat.searches == ["cloud run concurrency", "cloud run pricing"]
+    assert chat.session.payload == ["https://cloud.example/run/concurrency", "https://cloud.example/run/pricing"]
+
+def test_older_turns_are_folded_into_the_summary(chat):
+    chat.results["first"] = [Result("https://cloud.example/run", "Cloud Run")]
+    for question in ("first", "second", "third"):
+        chat.session.ask(question)
+    history = chat.session.history()
+    assert len(chat.compactions) == 1 and "Question: first" in chat.compactions[0]
+    assert chat.session.summary == "summary 1"
+    assert [turn["question"] for turn in chat.session.turns] == ["second", "third"]
+    assert history.startswith("Summary of the earlier conversation: summary 1") and "Question: first" not in history
@@ -0,0 +1,48 @@
+import types
+
+import pytest
+
+import gcp_docs_scraper
+import token_counter
+
+PAGES = {
+    "https://cloud.google.com/run/docs": b'<a href="/run/docs/quickstart">Quickstart</a> <a href="/storage/docs">Storage</a>',
+    "https://cloud.google.com/storage/docs": b'<a href="/storage/docs/buckets">Buckets</a>',
+}
+
+class StubScraperApi:
+    """scraper_api replying with the page, or with its error dict for unknown URLs."""
+    def __init__(self, url, outputMode="raw-html", pageLoadTimeout=0):
+        self.url = url
+        self.content = PAGES.get(url, {"error": "Failed to process job", "status_code": 502})
+
+@pytest.fixture(autouse=True)
+def stub_scraper_api(monkeypatch):
+    monkeypatch.setattr(gcp_docs_scraper, "scraper_api", StubScraperApi)
+
+def test_discover_links_scopes_to_the_product():
+    topic, links = gcp_docs_scraper.discover_links("https://cloud.google.com/run/docs", None, "model")
+    assert topic == "run"
+    assert links == ["https://cloud.google.com/run/docs/quickstart"]
+
+def test_failed_fetch_is_skipped_instead_of_parsed():
+    assert gcp_docs_scraper.discover_links("https://cloud.google.com/gone/docs", None, "model") is None
+
+def test_failed_download_is_left_out_of_token_counting(monkeypatch, tmp_path):
+    def get_scraped_data(job_id, token, output_path, json_output=False):
+        if job_id == "job-storage":
+            return None
+        with open(output_path, "w") as f:
+            f.write("[]")
+        return 0
+    backend = types.SimpleNamespace(create_scrape_job=lambda links, token, output_format, webhook_url=None: f"job-{links[0].split('/')[3]}",
+                                    get_job_info=lambda job_id, token: {"status": "succeeded"},
+                                    get_scraped_data=get_scraped_data)
+    monkeypatch.setitem(gcp_docs_scraper.BACKENDS, "stub", backend)
+    counted = []
+    monkeypatch.setattr(token_counter, "count_file_tokens", lambda path, model_id: counted.append(path) or
+                        {"documents": [], "num_chars": 0, "num_tokens": 0, "estimated": False})
+    urls = ["https://cloud.google.com/run/docs", "https://cloud.google.com/storage/docs"]
+    output_paths = gcp_docs_scraper.main(urls, None, "token", str(tmp_path), "model", backend="stub")
+    assert [path.endswith("-run-scrapejob.md") for path in output_paths] == [True]
+    assert counted == output_paths
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+import gennie_service
+
+class StubAnswer:
+    """answer_fn that yields two chunks, holding the second until release is set."""
+    def __init__(self, fail=False):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+
+    def __call__(self, question, model_id, num_results, date_restrict, chat_history, **options):
+        self.calls.append(question)
+        self.started.set()
+        yield f"answer to {question}"
+        assert self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        yield "."
+
+@pytest.fixture
+def stub():
+    return StubAnswer()
+
+@pytest.fixture
+def service(stub):
+    service = gennie_service.AnswerService(stub, workers=1, queue_size=1, per_user=1)
+    yield service
+    stub.release.set()
+    service.close()
+
+def test_identical_questions_share_one_run(service, stub):
+    with service.admit("alice", "What is RAG?", "model") as (first, coalesced):
+        assert not coalesced
+        with service.admit("bob", "  what is  rag? ", "model") as (second, coalesced):
+            assert coalesced and second is first
+            stub.release.set()
+            assert second.result(5) == first.result(5) == "answer to What is RAG?."
+    assert stub.calls == ["What is RAG?"]
+    assert service.stats()["requests"] == {"started": 1, "coalesced": 1}
+
+def test_late_request_replays_the_answer_from_the_start(service, stub):
+    with service.admit("alice", "q", "model") as (flight, _):
+        assert stub.started.wait(5)
+        with service.admit("bob", "q", "model") as (late, coalesced):
+            chunks = late.stream(5)
+            assert coalesced and next(chunks) == "answer to q"
+            stub.release.set()
+            assert list(chunks) == ["."]
+
+def test_user_limit_and_capacity(service, stub):
+    with service.admit("alice", "q1", "model"):
+        with pytest.raises(gennie_service.UserLimitExceeded):
+            with service.admit("alice", "q2", "model"):
+                pass
+        with service.admit("bob", "q2", "model"):
+            with pytest.raises(gennie_service.ServiceBusy):
+                with service.admit("carol", "q3", "model"):
+                    pass
+    # Slots are given back when the requests leave
+    assert service.stats()["users"] == 0
+
+def test_pipeline_error_reaches_every_waiter():
+    stub = StubAnswer(fail=True)
+    service = gennie_service.AnswerService(stub, workers=1, queue_size=1, per_user=1)
+    try:
+        with service.admit("alice", "q", "model") as (flight, _):
+            stub.release.set()
+            with pytest.raises(RuntimeError, match="model unavailable"):
+                flight.result(5)
+            # The failed run is not reused by the next request
+            with service.admit("bob", "q", "model") as (retry, coalesced):
+                assert not coalesced and retry is not flight
+    finally:
+        stub.release.set()
+        service.close()
+    assert service.counts["failed"] == 1
+
+def test_answer_times_out(service):
+    with pytest.raises(TimeoutError):
+        service.answer("alice", "q", "model", timeout=0.2)
+
+def test_http_service_streams_and_turns_requests_away(service, stub):
+    server = gennie_service.make_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        stream = gennie_service.remote_answer_stream(url, "q", "model", 5, "y2", user="alice")
+        assert next(stream) == "answer to q"
+        # The shared session retries a 429 after Retry-After, but a full service answers 503 at once
+        with service.admit("bob", "queued", "model"):
+            with pytest.raises(gennie_service.ServiceBusy):
+                next(gennie_service.remote_answer_stream(url, "other", "model", 5, "y2", user="carol"))
+        stub.release.set()
+        assert "".join(stream) == "."
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,58 @@
+import random
+
+from bench_html2markdown import legacy_html2markdown
+from shared import html2markdown, html2markdown_stream
+
+WORDS = ["cloud", "run", "concurrency", "default", "80", "deploy", "gcloud", "&amp;", "x < y", "  ", "\n"]
+INLINE = ["a", "strong", "b", "em", "i", "code", "span"]
+BLOCK = ["p", "h1", "h2", "h3", "div", "pre", "ul", "ol", "script", "nav", "footer"]
+
+def random_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 4)))
+
+def random_element(rng, depth, well_formed=False, inline=False):
+    if depth <= 0 or rng.random() < 0.3:
+        if rng.random() < 0.1:
+            return f'<img alt="{rng.choice(WORDS[:4])}" src="/img.png">'
+        return random_text(rng)
+    tag = rng.choice(INLINE if inline else BLOCK + INLINE)
+    if tag in ("ul", "ol"):
+        items = "".join(f"<li>{random_children(rng, depth - 1, well_formed)}</li>" for _ in range(rng.randint(0, 3)))
+        return f"<{tag}>{items}</{tag}>"
+    attrs = ' href="https://example.com/page"' if tag == "a" else ""
+    # Well-formed documents keep block elements out of paragraphs, headings and inline elements
+    inline = well_formed and tag not in ("div", "script", "nav", "footer")
+    return f"<{tag}{attrs}>{random_children(rng, depth - 1, well_formed, inline)}</{tag}>"
+
+def random_children(rng, depth, well_formed=False, inline=False):
+    return "".join(random_element(rng, depth, well_formed, inline) for _ in range(rng.randint(0, 3)))
+
+def random_document(rng, well_formed=False):
+    return f"<html><head><title>t</title></head><body>{random_children(rng, 5, well_formed)}</body></html>"
+
+def test_matches_the_legacy_converter_with_html_parser():
+    rng = random.Random(10)
+    for _ in range(300):
+        html = random_document(rng)
+        assert html2markdown(html, "html.parser") == legacy_html2markdown(html), html
+
+def test_renders_nested_lists_in_place():
+    html = "<ul><li>one <strong>bold</strong></li><li>two<ol><li>a</li><li>b</li></ol></li></ul><p>after</p>"
+    assert html2markdown(html, "html.parser") == "- one **bold**\n- two1. a\n2. b\n\nafter"
+
+def test_deep_documents_do_not_hit_the_recursion_limit():
+    html = "<div>" * 5000 + "deep text" + "</div>" * 5000
+    assert html2markdown(html, "html.parser") == "deep text"
+
+def test_stream_converter_matches_html2markdown_in_random_chunks():
+    rng = random.Random(11)
+    for _ in range(300):
+        html = random_document(rng, well_formed=True)
+        cuts = sorted(rng.sample(range(1, len(html)), min(len(html) - 1, rng.randint(0, 12))))
+        chunks = [html[start:end] for start, end in zip([0] + cuts, cuts + [len(html)])]
+        assert html2markdown_stream(chunks) == html2markdown(html, "html.parser"), html
+
+def test_stream_converter_decodes_bytes_split_inside_a_character():
+    data = "<p>café ünïcode</p>".encode("utf-8")
+    chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+    assert html2markdown_stream(chunks) == "café ünïcode"
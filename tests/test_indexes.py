@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import bm25_index
+import shared
+import vector_index
+
+DOCS = {
+    "run": [("https://cloud.example/run/concurrency", "Cloud Run sends up to 80 concurrent requests to each instance by default.")],
+    "storage": [("https://cloud.example/storage/classes", "Nearline storage suits data read less than once a month.")],
+    "pubsub": [("https://cloud.example/pubsub/retention", "Pub/Sub keeps unacknowledged messages for seven days.")],
+}
+
+@pytest.fixture
+def scrapes(tmp_path):
+    paths = {}
+    for name, pages in DOCS.items():
+        path = str(tmp_path / f"{name}-scrapejob.md")
+        shared.write_scraped_items([{"url": url, "text": f"# {name}\n\n{text}"} for url, text in pages], path)
+        paths[name] = path
+    return paths
+
+def test_bm25_finds_documents_added_in_separate_segments(scrapes, tmp_path):
+    index = bm25_index.BM25Index.create(str(tmp_path / "bm25"))
+    index.add_files([scrapes["run"]])
+    index.add_files([scrapes["storage"], scrapes["pubsub"]])
+    assert len(index.segments) == 3
+    assert index.search("concurrent requests per instance", k=1)[0]["url"] == "https://cloud.example/run/concurrency"
+    assert index.search("unacknowledged messages", k=1)[0]["url"] == "https://cloud.example/pubsub/retention"
+
+def test_bm25_records_files_in_the_same_meta_write_as_their_chunks(scrapes, tmp_path, monkeypatch):
+    index = bm25_index.BM25Index.create(str(tmp_path / "bm25"))
+    writes = []
+    original = bm25_index._write_json
+    def tracked(path, data):
+        writes.append(data)
+        original(path, data)
+    monkeypatch.setattr(bm25_index, "_write_json", tracked)
+    index.add_files([scrapes["run"], scrapes["storage"]])
+    assert len(writes) == 2
+    assert all(len(meta["segments"]) == len(meta["sources"]) for meta in writes)
+    assert index.add_files([scrapes["run"]]) == 0
+
+def test_bm25_merges_segments_past_the_limit(scrapes, tmp_path, monkeypatch):
+    monkeypatch.setattr(bm25_index, "MAX_SEGMENTS", 2)
+    index = bm25_index.BM25Index.create(str(tmp_path / "bm25"))
+    index.add_files(list(scrapes.values()))
+    assert len(index.segments) == 1
+    assert [name for name in os.listdir(index.index_path) if name.startswith("segment-")] == index.meta["segments"]
+    assert index.search("nearline storage", k=1)[0]["url"] == "https://cloud.example/storage/classes"
+
+def test_open_index_sees_segments_added_by_another_writer(scrapes, tmp_path):
+    path = str(tmp_path / "bm25")
+    bm25_index.BM25Index.create(path).add_files([scrapes["run"]])
+    reader = vector_index.open_index(path)
+    assert vector_index.open_index(path) is reader
+    assert reader.search("unacknowledged messages") == []
+
+    # A separate process, ex: gcp_docs_scraper, adds to the index
+    bm25_index.BM25Index(path).add_files([scrapes["pubsub"]])
+    refreshed = vector_index.open_index(path)
+    assert refreshed is not reader
+    assert refreshed.search("unacknowledged messages", k=1)[0]["url"] == "https://cloud.example/pubsub/retention"
+
+def test_open_index_sees_a_rebuilt_vector_index(scrapes, tmp_path):
+    path = str(tmp_path / "vectors")
+    vector_index.VectorIndex.build([scrapes["run"]], path, vector_index.HashingEmbedder.name)
+    assert len(vector_index.open_index(path)) == 1
+    vector_index.VectorIndex.build(list(scrapes.values()), path, vector_index.HashingEmbedder.name)
+    index = vector_index.open_index(path)
+    assert len(index) == 3
+    assert index.search("nearline storage", k=1)[0]["url"] == "https://cloud.example/storage/classes"
+
+def test_reopen_closes_the_replaced_index(scrapes, tmp_path):
+    path = str(tmp_path / "vectors")
+    vector_index.VectorIndex.build([scrapes["run"]], path, vector_index.HashingEmbedder.name)
+    old = vector_index.open_index(path)
+    vector_index.VectorIndex.build(list(scrapes.values()), path, vector_index.HashingEmbedder.name)
+    assert vector_index.open_index(path) is not old
+    assert old.chunks_file.closed
+    assert not os.path.exists(f"{path}.replaced")
+
+def test_open_index_keeps_the_open_copy_while_a_rebuild_swaps_folders(scrapes, tmp_path):
+    path = str(tmp_path / "vectors")
+    vector_index.VectorIndex.build([scrapes["run"]], path, vector_index.HashingEmbedder.name)
+    index = vector_index.open_index(path)
+    # The moment between moving the old folder aside and moving the new one in
+    os.replace(path, f"{path}.replaced")
+    assert vector_index.open_index(path) is index
+    assert index.search("concurrent requests", k=1)[0]["url"] == "https://cloud.example/run/concurrency"
+    with pytest.raises(FileNotFoundError):
+        vector_index.open_index(str(tmp_path / "missing"))
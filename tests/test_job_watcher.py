@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import job_watcher
+
+@pytest.fixture
+def receiver():
+    receiver = job_watcher.WebhookReceiver(port=0, secret="s3cret").start()
+    yield receiver
+    receiver.stop()
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def post(receiver, path, body, headers=None):
+    return requests.post(f"http://127.0.0.1:{receiver.server.server_port}{path}", json=body, headers=headers, timeout=5).status_code
+
+def test_callbacks_need_the_secret(receiver):
+    assert post(receiver, "/", {"id": "job", "status": "failed"}) == 403
+    assert post(receiver, "/wrong", {"id": "job", "status": "failed"}) == 403
+    assert not receiver.statuses
+    assert post(receiver, "/s3cret", {"id": "job", "status": "running"}) == 204
+    assert post(receiver, "/hook", {"id": "job", "status": "failed"}, {job_watcher.SECRET_HEADER: "s3cret"}) == 204
+    assert receiver.statuses["job"]["status"] == "failed"
+    assert receiver.callback_url("https://example.com/hook/") == "https://example.com/hook/s3cret"
+
+def test_callback_without_status_is_ignored(receiver):
+    assert post(receiver, "/s3cret", {"id": "job"}) == 204
+    assert "job" not in receiver.statuses
+
+def test_terminal_callback_is_confirmed_with_the_job_api(receiver):
+    statuses = iter(["running", "running", "succeeded"])
+    polls = []
+    def get_job_info(job_id, token):
+        polls.append(job_id)
+        return {"status": next(statuses)}
+    watcher = job_watcher.JobWatcher(get_job_info, "token", initial_interval=60, timeout=10, receiver=receiver,
+                                     progress=lambda *args: None)
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(info=watcher.watch("job")))
+    thread.start()
+    # A forged or early success wakes the watcher, which asks the job API instead of trusting it
+    wait_until(lambda: polls)
+    receiver.notify("job", {"id": "job", "status": "succeeded"})
+    wait_until(lambda: len(polls) == 2)
+    assert thread.is_alive()
+    receiver.notify("job", {"id": "job", "status": "succeeded"})
+    thread.join(5)
+    assert result["info"] == {"status": "succeeded"} and len(polls) == 3
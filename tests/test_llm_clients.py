@@ -0,0 +1,30 @@
+import asyncio
+
+import llm_clients
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+def test_async_clients_are_shared_within_a_loop_and_closed_with_it():
+    async def answer():
+        first = llm_clients._get_or_create_async(("fake", None, "key"), FakeAsyncClient)
+        second = llm_clients._get_or_create_async(("fake", None, "key"), FakeAsyncClient)
+        assert first is second
+        await llm_clients.aclose_clients()
+        return first
+
+    client = asyncio.run(answer())
+    assert client.closed
+    assert not any(("fake", None, "key") in registry for registry in llm_clients._async_clients.values())
+
+def test_each_loop_gets_its_own_client():
+    async def create():
+        client = llm_clients._get_or_create_async(("fake", None, "key"), FakeAsyncClient)
+        await llm_clients.aclose_clients()
+        return client
+
+    assert asyncio.run(create()) is not asyncio.run(create())
@@ -0,0 +1,88 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import local_crawler
+
+PAGES = {
+    "/robots.txt": "User-agent: *\nDisallow: /docs/private\n",
+    "/docs": '<h1>Docs</h1><a href="/docs/a">A</a> <a href="/docs/b">B</a> <a href="/docs/missing">gone</a> '
+              '<a href="/docs/private">secret</a> <a href="https://elsewhere.example/docs/c">offsite</a>',
+    "/docs/a": '<p>Page A</p><a href="/docs/deeper">deeper</a>',
+    "/docs/b": "<p>Page B</p>",
+    "/docs/private": "<p>Private</p>",
+    "/docs/deeper": "<p>Too deep</p>",
+}
+
+class StubSite(BaseHTTPRequestHandler):
+    def do_GET(self):
+        page = PAGES.get(self.path)
+        self.send_response(200 if page is not None else 404)
+        self.send_header("Content-Type", "text/plain" if self.path.endswith(".txt") else "text/html")
+        body = (page or "not found").encode()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # Scraper endpoint that always fails
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSite)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+def crawled(crawler, site):
+    return sorted(item["url"].replace(site, "") for item in crawler.data)
+
+def test_crawls_the_site_within_depth_and_robots(site):
+    crawler = local_crawler.LocalCrawler([f"{site}/docs"], host_delay=0, max_depth=1)
+    crawler.run()
+    assert crawled(crawler, site) == ["/docs", "/docs/a", "/docs/b"]
+    assert crawler.errors == 1
+    assert next(item["text"] for item in crawler.data if item["url"].endswith("/docs/b")) == "Page B"
+
+def test_page_limit_bounds_the_crawl(site):
+    crawler = local_crawler.LocalCrawler([f"{site}/docs"], host_delay=0, max_depth=2, page_limit=2)
+    crawler.run()
+    assert len(crawler.seen) == 2
+
+def test_a_page_failing_to_render_does_not_stop_the_crawl(site):
+    class FailingCrawler(local_crawler.LocalCrawler):
+        def render(self, html):
+            if "Page A" in html:
+                raise ValueError("parser error")
+            return super().render(html)
+
+    crawler = FailingCrawler([f"{site}/docs"], host_delay=0)
+    crawler.run()
+    assert crawled(crawler, site) == ["/docs", "/docs/b"]
+    assert crawler.errors == 2
+
+def test_scraper_errors_are_counted_per_page(site):
+    crawler = local_crawler.LocalCrawler([f"{site}/docs/a", f"{site}/docs/b"], host_delay=0, fetcher="scraper", endpoint=f"{site}/navigate")
+    assert crawler.run() == []
+    assert crawler.errors == 2
+
+def test_job_api_reports_progress_and_data(site, tmp_path):
+    job_id = local_crawler.create_scrape_job([f"{site}/docs"], host_delay=0)
+    crawler = local_crawler._jobs[job_id]["crawler"]
+    for _ in range(200):
+        info = local_crawler.get_job_info(job_id)
+        if info["status"] != "running":
+            break
+        threading.Event().wait(0.05)
+    assert info["status"] == "succeeded"
+    assert info["progress"] == {"scraped": 3, "queued": len(crawler.seen), "failed": 1}
+    assert len(local_crawler.get_scraped_data(job_id, output_path=str(tmp_path / "crawl.md"))["data"]) == 3
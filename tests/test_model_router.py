@@ -0,0 +1,99 @@
+import sys
+import time
+import types
+
+import pytest
+
+import model_router
+
+class RateLimitError(Exception):
+    pass
+
+@pytest.fixture
+def backends(monkeypatch):
+    """Routes gemini and claude models to fake backends; behaviours[model_id] decides each answer."""
+    behaviours = {}
+    calls = []
+
+    def run_text_inference(payload, prompt, type, model_id, verbose=False, **settings):
+        calls.append(model_id)
+        behaviour = behaviours.get(model_id, "ok")
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        if behaviour == "slow":
+            time.sleep(0.5)
+        return f"{model_id}: {payload}"
+
+    def stream_text_inference(payload, prompt, type, model_id, verbose=False, **settings):
+        calls.append(model_id)
+        behaviour = behaviours.get(model_id, "ok")
+        if behaviour == "fail_after_first_chunk":
+            yield "partial"
+            raise RateLimitError("throttled mid-stream")
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        yield from (model_id, ": ", payload)
+
+    module = types.ModuleType("fake_inference")
+    module.run_text_inference = run_text_inference
+    module.stream_text_inference = stream_text_inference
+    monkeypatch.setitem(sys.modules, "fake_inference", module)
+    monkeypatch.setattr(model_router, "PROVIDER_MODULES", {"gemini": "fake_inference", "claude": "fake_inference"})
+    monkeypatch.setattr(model_router, "_limiters", {})
+    return behaviours, calls
+
+def test_rate_limiter_allows_a_burst_then_waits_for_tokens():
+    limiter = model_router.RateLimiter(6000, burst=2)
+    assert limiter.acquire(max_wait=0)
+    assert limiter.acquire(max_wait=0)
+    assert not limiter.acquire(max_wait=0)
+    started = time.monotonic()
+    assert limiter.acquire(max_wait=1)
+    assert time.monotonic() - started < 0.5
+
+def test_throttled_model_fails_over_to_the_next_candidate(backends):
+    behaviours, calls = backends
+    behaviours["claude-a"] = RateLimitError("429")
+    response = model_router.run_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"], cache=False)
+    assert response == "gemini-b: text"
+    assert calls == ["claude-a", "gemini-b"]
+
+def test_other_errors_are_raised_without_failover(backends):
+    behaviours, calls = backends
+    behaviours["claude-a"] = ValueError("bad request")
+    with pytest.raises(ValueError):
+        model_router.run_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"], cache=False)
+    assert calls == ["claude-a"]
+
+def test_the_last_candidate_raises_when_throttled(backends):
+    behaviours, _ = backends
+    behaviours["claude-a"] = behaviours["gemini-b"] = RateLimitError("429")
+    with pytest.raises(RateLimitError):
+        model_router.run_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"], cache=False)
+
+def test_exhausted_rate_limit_fails_over_without_calling_the_model(backends):
+    _, calls = backends
+    model_router._limiters["claude"] = limiter = model_router.RateLimiter(1, burst=1)
+    assert limiter.acquire(max_wait=0)
+    response = model_router.run_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"], max_queue_wait=0, cache=False)
+    assert response == "gemini-b: text"
+    assert calls == ["gemini-b"]
+
+def test_slow_model_fails_over_after_timeout(backends):
+    behaviours, _ = backends
+    behaviours["claude-a"] = "slow"
+    response = model_router.run_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"], timeout=0.05, cache=False)
+    assert response == "gemini-b: text"
+
+def test_stream_fails_over_before_the_first_chunk_only(backends):
+    behaviours, calls = backends
+    behaviours["claude-a"] = RateLimitError("429")
+    assert "".join(model_router.stream_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"])) == "gemini-b: text"
+
+    behaviours["claude-a"] = "fail_after_first_chunk"
+    chunks = []
+    with pytest.raises(RateLimitError):
+        for chunk in model_router.stream_text_inference("text", "prompt", "string", "claude-a", fallback_model_ids=["gemini-b"]):
+            chunks.append(chunk)
+    assert chunks == ["partial"]
+    assert calls[-1] == "claude-a"
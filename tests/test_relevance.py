@@ -0,0 +1,58 @@
+import json
+
+import gennie_core
+
+def make_result(title, markdown):
+    result = gennie_core.SearchResult({"title": title, "link": ""}, "question", "gemini-test", evaluate=False)
+    result.link = f"https://example.com/{title}"
+    result.markdown = markdown
+    return result
+
+def test_parse_batch_scores_reads_the_array_inside_prose():
+    response = 'Here you go:\n```json\n[{"id": 0, "evaluation": " on topic ", "score": 5}, {"id": 1, "evaluation": "meh", "score": "2"}]\n```'
+    assert gennie_core.parse_batch_scores(response, {0, 1}) == {0: (5, "on topic"), 1: (2, "meh")}
+
+def test_parse_batch_scores_drops_invalid_entries():
+    response = json.dumps([
+        {"id": 0, "evaluation": "too high", "score": 9},
+        {"id": 1, "evaluation": "no score"},
+        {"id": 7, "evaluation": "unknown id", "score": 3},
+        "not an object",
+        {"id": "2", "evaluation": "string id", "score": 4.0},
+    ])
+    assert gennie_core.parse_batch_scores(response, {0, 1, 2}) == {2: (4, "string id")}
+
+def test_infinite_score_only_drops_its_own_entry():
+    response = '[{"id": 0, "evaluation": "off the charts", "score": Infinity}, {"id": 1, "evaluation": "fine", "score": 3}]'
+    assert gennie_core.parse_batch_scores(response, {0, 1}) == {1: (3, "fine")}
+
+def test_parse_batch_scores_without_an_array_returns_nothing():
+    assert gennie_core.parse_batch_scores("I cannot help with that", {0}) == {}
+    assert gennie_core.parse_batch_scores("[not json]", {0}) == {}
+
+def test_unscored_documents_fall_back_to_individual_calls(monkeypatch):
+    calls = []
+
+    def run_text_inference(payload, prompt, type, model_id, **settings):
+        calls.append(payload)
+        if payload.startswith("[DOCUMENT"):
+            # Document 1 is missing from the reply
+            return json.dumps([{"id": 0, "evaluation": "relevant", "score": 5}])
+        return "evaluation : somewhat related,\nscore : 3"
+
+    monkeypatch.setattr(gennie_core.model_router, "run_text_inference", run_text_inference)
+    results = [make_result("a", "alpha content"), make_result("b", "beta content")]
+    gennie_core.evaluate_relevance_batch(results, "question", "gemini-test")
+    assert [r.relevance_score for r in results] == [5, 3]
+    assert len(calls) == 2 and calls[1] == "beta content"
+
+def test_failed_batch_call_scores_every_document_individually(monkeypatch):
+    def run_text_inference(payload, prompt, type, model_id, **settings):
+        if payload.startswith("[DOCUMENT"):
+            raise RuntimeError("provider down")
+        return "evaluation : fine,\nscore : 4"
+
+    monkeypatch.setattr(gennie_core.model_router, "run_text_inference", run_text_inference)
+    results = [make_result("a", "alpha content"), make_result("b", "beta content")]
+    gennie_core.evaluate_relevance_batch(results, "question", "gemini-test")
+    assert [r.relevance_score for r in results] == [4, 4]
@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+import shared
+
+DOCUMENT = {"status": "ok", "count": 3, "data": [
+    {"url": "https://example.com/a", "text": "café — \"quoted\" [brackets] {braces}", "score": 1.25},
+    {"url": "https://example.com/b", "text": "", "size": -12345, "ratio": 2.5e-3, "tags": [1, 22, 333]},
+    {"url": "https://example.com/c", "text": "last", "ok": True, "missing": None},
+]}
+
+def test_items_match_json_loads_for_every_split_point():
+    text = json.dumps(DOCUMENT)
+    data = text.encode("utf-8")
+    for cut in range(1, len(data)):
+        assert list(shared.iter_json_array([data[:cut], data[cut:]])) == DOCUMENT["data"], cut
+
+def test_items_match_json_loads_one_character_at_a_time():
+    text = json.dumps(DOCUMENT["data"], indent=2)
+    assert list(shared.iter_json_array(list(text))) == DOCUMENT["data"]
+
+@pytest.mark.parametrize("chunks, expected", [
+    (["1", ".", "5"], 1.5),
+    (["-", "12", "e", "3"], -12e3),
+    (["12", "34"], 1234),
+    (["0.2", "5 "], 0.25),
+])
+def test_numbers_split_across_chunks_are_read_whole(chunks, expected):
+    assert shared._JSONStream(chunks, "utf-8").value() == expected
+    assert list(shared.iter_json_array(["["] + chunks + ["]"])) == [expected]
+
+def items(count):
+    return [{"url": f"https://example.com/{i}", "text": f"page {i}"} for i in range(count)]
+
+def interrupted(items, after):
+    for index, item in enumerate(items):
+        if index == after:
+            raise ConnectionError("stream dropped")
+        yield item
+
+def read_output(path):
+    with open(path) as f:
+        text = f.read()
+    with open(shared.manifest_path(path)) as f:
+        manifest = [json.loads(line) for line in f]
+    return text, manifest
+
+def test_resume_skips_the_items_already_written(tmp_path):
+    expected_path = str(tmp_path / "expected.md")
+    shared.write_scraped_items(items(40), expected_path)
+
+    path = str(tmp_path / "job.md")
+    with pytest.raises(ConnectionError):
+        shared.write_scraped_items(interrupted(items(40), 21), path, resume_key="job-1")
+    assert not os.path.exists(path)
+    # Items past the last checkpoint (16) were written to the .part file and are truncated on resume
+    assert shared.write_scraped_items(items(40), path, resume_key="job-1") == 40
+    assert read_output(path)[0] == read_output(expected_path)[0]
+    assert [entry["offset"] for entry in read_output(path)[1]] == [entry["offset"] for entry in read_output(expected_path)[1]]
+    assert not os.path.exists(f"{path}.checkpoint")
+
+def test_another_key_starts_over(tmp_path):
+    path = str(tmp_path / "job.md")
+    with pytest.raises(ConnectionError):
+        shared.write_scraped_items(interrupted(items(40), 20), path, resume_key="job-1")
+    written = []
+    def tracked():
+        for item in items(5):
+            written.append(item["url"])
+            yield item
+    assert shared.write_scraped_items(tracked(), path, json_output=False, resume_key="job-2") == 5
+    text, manifest = read_output(path)
+    assert [json.loads(line) for line in text.splitlines()] == items(5)
+    assert len(manifest) == 5
@@ -0,0 +1,68 @@
+import json
+import time
+
+import pytest
+
+import gennie_core
+
+class FakeResult(gennie_core.SearchResult):
+    """Takes item["seconds"] to "fetch" and scores every page 1, so searches keep deepening."""
+    def _process_single_result(self, item):
+        time.sleep(item.get("seconds", 0))
+        self.title = item["title"]
+        self.link = item["link"]
+        self.markdown = f"content of {self.link}"
+        if self.evaluate:
+            self.relevance_score = 1
+
+def items(names, seconds=0):
+    return [{"title": name, "link": f"https://example.com/{name}", "seconds": seconds} for name in names]
+
+@pytest.fixture
+def search(monkeypatch):
+    """pages[start_index] is the list of items google_search returns; llm_calls counts batch calls."""
+    pages = {}
+    llm_calls = []
+
+    def run_text_inference(payload, prompt, type, model_id, **settings):
+        llm_calls.append(payload)
+        return json.dumps([{"id": i, "evaluation": "off topic", "score": 1} for i in range(payload.count("[DOCUMENT "))])
+
+    monkeypatch.setattr(gennie_core, "SearchResult", FakeResult)
+    monkeypatch.setattr(gennie_core, "get_search_query", lambda question, model_id, previous_queries=None: f"query {len(previous_queries or [])}")
+    monkeypatch.setattr(gennie_core, "google_search", lambda query, key, engine, num_results, start_index, date_restrict: pages.get(start_index, []))
+    monkeypatch.setattr(gennie_core.model_router, "run_text_inference", run_text_inference)
+    return pages, llm_calls
+
+def test_time_budget_holds_across_waves_of_workers(search):
+    pages, _ = search
+    pages[1] = items("abcdefgh", seconds=0.4)
+    started = time.time()
+    results = gennie_core.gather_search_results("q", "gemini-test", 8, 1, "y2", max_workers=4, budget=gennie_core.SearchBudget(max_seconds=0.6))
+    assert time.time() - started < 0.75
+    assert len(results) == 4
+
+def test_time_budget_holds_without_workers(search):
+    pages, _ = search
+    pages[1] = items("abcd", seconds=0.2)
+    started = time.time()
+    results = gennie_core.gather_search_results("q", "gemini-test", 4, 1, "y2", max_workers=1, budget=gennie_core.SearchBudget(max_seconds=0.3))
+    assert time.time() - started < 0.38
+    assert len(results) == 1
+
+def test_batch_relevance_charges_the_calls_it_makes(search):
+    pages, llm_calls = search
+    pages[1] = items("abc")
+    budget = gennie_core.SearchBudget()
+    gennie_core.gather_search_results("q", "gemini-test", 3, 1, "y2", batch_relevance=True, budget=budget)
+    assert len(llm_calls) == 1
+    # The search query, then one batch for three pages
+    assert budget.llm_calls == 2 and budget.pages == 3
+
+def test_results_cut_by_the_budget_can_come_back_in_a_later_round(search):
+    pages, _ = search
+    pages[1] = items("abc")
+    pages[4] = items("cd")
+    budget = gennie_core.SearchBudget(max_llm_calls=4)
+    results = gennie_core.gather_search_results("q", "gemini-test", 3, 1, "y2", batch_relevance=True, max_rounds=2, budget=budget)
+    assert [r.title for r in results] == ["a", "b", "c"]
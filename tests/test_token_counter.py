@@ -0,0 +1,51 @@
+import io
+import sys
+import types
+
+import shared
+import token_counter
+
+def count_words(text):
+    return len(text.split())
+
+def test_chunks_rebuild_the_text_without_splitting_words():
+    text = " ".join(f"word{i}" for i in range(5000))
+    chunks = list(token_counter.iter_chunks(io.StringIO(text), 1000))
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 1000 + 10 for chunk in chunks)
+    assert sum(count_words(chunk) for chunk in chunks) == 5000
+
+def test_local_tokenizer_counts_every_chunk(monkeypatch, tmp_path):
+    monkeypatch.setattr(token_counter, "local_tokenizer", lambda model_id: count_words)
+    path = tmp_path / "scrape.md"
+    path.write_text("alpha beta gamma\n" * 3000)
+    result = token_counter.count_file_tokens(str(path), "gpt-test", max_workers=3, chunk_chars=4096)
+    assert result == {"num_chars": 17 * 3000, "num_tokens": 9000, "estimated": False, "documents": []}
+
+def test_documents_are_counted_from_the_scrape_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(token_counter, "local_tokenizer", lambda model_id: count_words)
+    path = str(tmp_path / "scrape.md")
+    shared.write_scraped_items([{"url": "https://example.com/a", "text": "one two"}, {"url": "https://example.com/b", "text": "three " * 50}], path)
+    result = token_counter.count_file_tokens(path, "gpt-test")
+    assert [(d["url"], d["num_tokens"]) for d in result["documents"]] == [("https://example.com/a", 2), ("https://example.com/b", 50)]
+    assert result["num_tokens"] == 52
+
+def test_without_a_local_tokenizer_samples_are_extrapolated(monkeypatch, tmp_path):
+    calls = []
+    def remote(text):
+        calls.append(len(text))
+        return count_words(text)
+    monkeypatch.setattr(token_counter, "local_tokenizer", lambda model_id: None)
+    monkeypatch.setattr(token_counter, "remote_counter", lambda model_id: remote)
+    path = tmp_path / "scrape.md"
+    path.write_text("abcd " * 20000)
+    result = token_counter.count_file_tokens(str(path), "gemini-test", chunk_chars=1000, max_samples=10)
+    assert result["estimated"]
+    assert len(calls) <= 10
+    assert abs(result["num_tokens"] - 20000) < 200
+
+def test_offline_tiktoken_falls_back_to_remote_counting(monkeypatch):
+    def encoding_for_model(model_id):
+        raise ConnectionError("encoding download failed")
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(encoding_for_model=encoding_for_model))
+    assert token_counter.local_tokenizer("gpt-4o") is None
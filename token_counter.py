@@ -0,0 +1,154 @@
+import argparse
+import io
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules
+import model_router
+from shared import convert_integer_to_decimal, manifest_path
+from shared import log_message as logr
+
+# Characters per chunk; chunks end on whitespace so words are not split between counts
+CHUNK_CHARS = 256 * 1024
+MAX_WORKERS = os.cpu_count() or 4
+# Remote count_tokens calls made, at most, for a provider without a local tokenizer
+MAX_SAMPLES = 16
+
+def local_tokenizer(model_id):
+    """Returns a function counting the tokens of a text locally, or None when the model's
+    provider has no local tokenizer (Gemini) or its library is missing."""
+    provider = model_router.resolve_provider(model_id)
+    try:
+        if provider == "openai":
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model_id)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        if provider == "claude":
+            import llm_clients
+            tokenizer = llm_clients.anthropic_client().get_tokenizer()
+            return lambda text: len(tokenizer.encode(text).ids)
+    except Exception as e:
+        # Also covers tiktoken failing to download its encoding when offline
+        logr(f"No local tokenizer for {model_id}: {e}")
+    return None
+
+def remote_counter(model_id):
+    return model_router.token_counter(model_id)
+
+def iter_chunks(text_file, chunk_chars=CHUNK_CHARS):
+    """Yields the text of an open file in chunks of about chunk_chars, cut on whitespace."""
+    carry = ""
+    while True:
+        block = text_file.read(chunk_chars)
+        if not block:
+            break
+        text = carry + block
+        cut = max(text.rfind("\n", len(text) // 2), text.rfind(" ", len(text) // 2))
+        if cut <= 0:
+            cut = len(text) - 1
+        carry = text[cut + 1:]
+        yield text[:cut + 1]
+    if carry:
+        yield carry
+
+def iter_units(path, chunk_chars=CHUNK_CHARS, per_document=True):
+    """Yields (url, text) for each document listed in path's manifest, or (None, chunk)
+    for each chunk of path when there is no manifest."""
+    manifest = manifest_path(path)
+    if per_document and os.path.exists(manifest):
+        with open(path, "rb") as data, open(manifest) as index:
+            for line in index:
+                entry = json.loads(line)
+                data.seek(entry["offset"])
+                yield entry.get("url"), data.read(entry["length"]).decode("utf-8", errors="replace")
+        return
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for chunk in iter_chunks(f, chunk_chars):
+            yield None, chunk
+
+def _count(counter, text, chunk_chars):
+    # Long documents are counted in chunks so remote calls stay small
+    if len(text) <= chunk_chars:
+        return counter(text)
+    return sum(counter(piece) for piece in iter_chunks(io.StringIO(text), chunk_chars))
+
+def count_file_tokens(path, model_id, max_workers=MAX_WORKERS, chunk_chars=CHUNK_CHARS, max_samples=MAX_SAMPLES, per_document=True):
+    """Counts the characters and tokens of a (possibly huge) text file without loading it.
+
+    The file is read in chunks, or per document when a scrape manifest sits next to it,
+    and counted in parallel with the model's local tokenizer. Without one, up to
+    max_samples evenly spaced units are counted remotely and the tokens per character
+    they show are extrapolated to the rest; "estimated" is then True.
+
+    Returns {"num_chars", "num_tokens", "estimated", "documents"}, where documents holds
+    {"url", "num_chars", "num_tokens"} per document when a manifest was used.
+    """
+    counter = local_tokenizer(model_id)
+    stride = 1
+    if counter is None:
+        counter = remote_counter(model_id)
+        manifest = manifest_path(path)
+        if per_document and os.path.exists(manifest):
+            with open(manifest) as f:
+                units = sum(1 for _ in f)
+        else:
+            units = math.ceil(os.path.getsize(path) / chunk_chars)
+        stride = max(1, math.ceil(units / max_samples))
+
+    units = []
+    sampled_chars = sampled_tokens = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        def collect():
+            nonlocal sampled_chars, sampled_tokens
+            unit, future = in_flight.popleft()
+            unit["num_tokens"] = future.result()
+            sampled_chars += unit["num_chars"]
+            sampled_tokens += unit["num_tokens"]
+        for index, (url, text) in enumerate(iter_units(path, chunk_chars, per_document)):
+            unit = {"url": url, "num_chars": len(text), "num_tokens": None}
+            units.append(unit)
+            if index % stride == 0:
+                in_flight.append((unit, executor.submit(_count, counter, text, chunk_chars)))
+                # Bounds the text held in memory to what the workers are counting
+                if len(in_flight) >= 2 * max_workers:
+                    collect()
+        while in_flight:
+            collect()
+
+    ratio = sampled_tokens / sampled_chars if sampled_chars else 0
+    for unit in units:
+        if unit["num_tokens"] is None:
+            unit["num_tokens"] = round(unit["num_chars"] * ratio)
+    documents = [unit for unit in units if unit["url"] is not None]
+    return {
+        "num_chars": sum(unit["num_chars"] for unit in units),
+        "num_tokens": sum(unit["num_tokens"] for unit in units),
+        "estimated": stride > 1,
+        "documents": documents,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the tokens of a large text file")
+    parser.add_argument("path", help="Text file, ex: a scrape job download")
+    parser.add_argument("-m", "--model", type=str, default="gemini-1.5-flash-001", help="Model whose tokenizer is used")
+    parser.add_argument("--max_workers", type=int, default=MAX_WORKERS, help="Parallel counters")
+    parser.add_argument("--max_samples", type=int, default=MAX_SAMPLES, help="Remote counts when no local tokenizer exists")
+    parser.add_argument("--documents", action="store_true", help="Print the count of each document")
+    args = parser.parse_args()
+
+    r = count_file_tokens(args.path, args.model, args.max_workers, max_samples=args.max_samples)
+    if args.documents:
+        for document in r["documents"]:
+            logr(f"{document['url']}: {convert_integer_to_decimal(document['num_tokens'])} tokens")
+    logr(f"characters: {convert_integer_to_decimal(r['num_chars'])}")
+    logr(f"tokens: {convert_integer_to_decimal(r['num_tokens'])}{' (estimated)' if r['estimated'] else ''}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Modules
+from shared import log_message as logr
+
+# Tracing stays off (every call is a no-op) unless one of these is set or configure() is called
+TRACE_FILE = os.getenv("GENNIE_TRACE_FILE")
+METRICS_PORT = os.getenv("GENNIE_METRICS_PORT")
+
+# Histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_enabled = False
+_trace_file = None
+_metrics_server = None
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_current_span = contextvars.ContextVar("gennie_span", default=None)
+
+class _NoopSpan:
+    def set(self, **attributes):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """Times a pipeline stage; the duration goes to gennie_stage_seconds{stage=name} and,
+    with a trace file, the span is written there with its attributes and parent."""
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "start", "started_at", "token")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.token = _current_span.set(self)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        try:
+            _current_span.reset(self.token)
+        except ValueError:
+            # Exited from another context, ex: a generator resumed elsewhere
+            pass
+        observe("gennie_stage_seconds", duration, stage=self.name)
+        if _trace_file:
+            record = {
+                "type": "span", "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "start": self.started_at, "duration": duration,
+                "attributes": self.attributes, "error": exc_type.__name__ if exc_type else None,
+            }
+            _write(record)
+        return False
+
+def enabled():
+    return _enabled
+
+def span(name, **attributes):
+    """Context manager timing the stage name; attributes (and later set() calls) are
+    attached to the span. Returns a shared no-op object while tracing is off."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def counter(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """Adds value to the histogram name."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect_left(BUCKETS, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+def record_usage(provider, model_id, input_tokens=None, output_tokens=None, **other_tokens):
+    """Counts the tokens a provider reported for one call."""
+    if not _enabled:
+        return
+    for kind, tokens in dict(other_tokens, input=input_tokens, output=output_tokens).items():
+        if tokens:
+            counter("gennie_llm_tokens_total", tokens, provider=provider, model=model_id, kind=kind)
+
+def snapshot():
+    """Current counters and histograms as plain dicts."""
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in _counters.items()]
+        histograms = [
+            {"name": name, "labels": dict(labels), "buckets": dict(zip([*BUCKETS, "+Inf"], counts)), "sum": total, "count": count}
+            for (name, labels), (counts, total, count) in _histograms.items()
+        ]
+    return {"counters": counters, "histograms": histograms}
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+def render_prometheus():
+    """Counters and histograms in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in _histograms.items())
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), (counts, total, count) in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip([*BUCKETS, "+Inf"], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+def _write(record):
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        if _trace_file:
+            _trace_file.write(line)
+            _trace_file.flush()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def configure(trace_file=None, metrics_port=None):
+    """Turns tracing on, writing spans to trace_file (JSON lines) and/or serving
+    /metrics on metrics_port. Called at import with GENNIE_TRACE_FILE / GENNIE_METRICS_PORT."""
+    global _enabled, _trace_file, _metrics_server
+    with _lock:
+        if trace_file and _trace_file is None:
+            folder = os.path.dirname(trace_file)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            _trace_file = open(trace_file, "a")
+        _enabled = True
+    if metrics_port is not None and _metrics_server is None:
+        _metrics_server = ThreadingHTTPServer(("0.0.0.0", int(metrics_port)), _MetricsHandler)
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        logr(f"metrics served on http://0.0.0.0:{_metrics_server.server_port}/metrics")
+
+def shutdown():
+    """Writes a final metrics snapshot to the trace file and stops exporting."""
+    global _enabled, _trace_file, _metrics_server
+    if _trace_file:
+        _write(dict(type="metrics", time=time.time(), **snapshot()))
+    with _lock:
+        if _trace_file:
+            _trace_file.close()
+            _trace_file = None
+        _enabled = False
+    if _metrics_server:
+        _metrics_server.shutdown()
+        _metrics_server = None
+
+if TRACE_FILE or METRICS_PORT:
+    configure(TRACE_FILE, METRICS_PORT)
+    atexit.register(shutdown)
@@ -1,9 +1,12 @@
 import argparse
 import json
-import requests
-import os
 import time
 
+import requests
+
+import http_session
+from shared import iter_json_array, write_scraped_items
+
 def read_file_lines(file_path):
     with open(file_path, 'r') as file:
         lines = [line.strip() for line in file if line.strip()]
@@ -13,7 +16,7 @@ def log_message(message):
     timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
     print(f"[{int(time.time())}.{timestamp}] {message}")
     
-def create_scrape_job(urls, token, output_format):
+def create_scrape_job(urls, token, output_format, webhook_url=None):
     api_url = "https://api.usescraper.com/crawler/jobs"
     headers = {
         'Authorization': f'Bearer {token}',
@@ -30,9 +33,10 @@ def create_scrape_job(urls, token, output_format):
         "block_resources": True,
         "include_linked_files": False
     }
-    response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-    time.sleep(3)
-    if response.status_code >= 200:
+    if webhook_url:
+        payload["webhook_url"] = webhook_url
+    response = http_session.post(api_url, headers=headers, data=json.dumps(payload))
+    if 200 <= response.status_code < 300:
         result = response.json()
         # print(result)
         log_message(f"Crawl job created with ID: {result['id']}")
@@ -47,7 +51,7 @@ def get_job_info(job_id, token):
     headers = {
         'Authorization': f'Bearer {token}'
     }
-    response = requests.get(api_url, headers=headers)
+    response = http_session.get(api_url, headers=headers)
     if response.status_code == 200:
         result = response.json()
         # log_message(f"Job Info: {json.dumps(result, indent=2)}")
@@ -56,27 +60,30 @@ def get_job_info(job_id, token):
         log_message(f"Error: {response.status_code} - {response.text}")
         return None
 
-def get_scraped_data(job_id, token, output_path, json_output=False):
+def get_scraped_data(job_id, token, output_path, json_output=False, retries=2):
+    """Streams a job's data into output_path, item by item.
+
+    The JSON response is parsed incrementally, so memory stays flat however large the
+    crawl is. Progress is checkpointed: a retry, or a later run for the same job, resumes
+    after the last saved item. Returns the number of items written, or None on error.
+    """
     api_url = f"https://api.usescraper.com/crawler/jobs/{job_id}/data"
     headers = {
         'Authorization': f'Bearer {token}'
     }
-    response = requests.get(api_url, headers=headers)
-    if response.status_code == 200:
-        result = response.json()
-        if json_output:
-            parsed_data = []
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            f = open(output_path, 'a')
-            for item in result.get('data', []):
-                f.write(item.get('text', {}) + "\n\n")
-            log_message(f"Scraped data saved to: {output_path}")
-            f.close()
-        else:
-            json.dumps(result, indent=2)
-    
-    else:
-        log_message(f"Error: {response.status_code} - {response.text}")
+    for attempt in range(retries + 1):
+        try:
+            with http_session.get(api_url, headers=headers, stream=True) as response:
+                if response.status_code != 200:
+                    log_message(f"Error: {response.status_code} - {response.text}")
+                    return None
+                items = iter_json_array(response.iter_content(chunk_size=64 * 1024))
+                count = write_scraped_items(items, output_path, json_output, resume_key=job_id)
+            log_message(f"Scraped data saved to: {output_path} ({count} items)")
+            return count
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_message(f"Download of job {job_id} interrupted (attempt {attempt + 1}): {e}")
+    return None
         
 def main():
     parser = argparse.ArgumentParser(description='Crawl URLs using the Scraper API')
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import zlib
+import numpy as np
+
+# Modules
+import context_packer
+from token_counter import iter_units
+from shared import log_message as logr
+
+CHUNK_CHARS = 1500
+HASH_DIM = 1024
+BATCH_SIZE = 256
+# Rows scored at a time, so searching a large memory-mapped index stays within a few MB
+SEARCH_BLOCK = 65536
+SENTENCE_TRANSFORMERS_MODEL = "all-MiniLM-L6-v2"
+
+class HashingEmbedder:
+    """TF-IDF over unigrams and bigrams hashed into dim buckets; no model download needed."""
+    name = "hashing"
+    # Cosine similarity above which a chunk is taken as an answer source
+    min_score = 0.2
+
+    def __init__(self, dim=HASH_DIM, idf=None):
+        self.dim = dim
+        self.idf = idf
+
+    def config(self):
+        return {"name": self.name, "dim": self.dim}
+
+    def _features(self, text):
+        words = context_packer.tokenize(text)
+        terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term in terms:
+            vector[zlib.crc32(term.encode()) % self.dim] += 1
+        # Sublinear term frequency
+        np.log1p(vector, out=vector)
+        return vector
+
+    def embed_documents(self, texts):
+        # Raw term frequencies; fit() turns the stored rows into TF-IDF
+        return np.stack([self._features(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+    def fit(self, vectors, index_path):
+        df = np.zeros(self.dim, dtype=np.float64)
+        for start in range(0, len(vectors), SEARCH_BLOCK):
+            df += (vectors[start:start + SEARCH_BLOCK] > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(vectors)) / (1 + df)) + 1).astype(np.float32)
+        for start in range(0, len(vectors), SEARCH_BLOCK):
+            block = vectors[start:start + SEARCH_BLOCK] * self.idf
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            vectors[start:start + SEARCH_BLOCK] = block / np.maximum(norms, 1e-12)
+        np.save(os.path.join(index_path, "idf.npy"), self.idf)
+
+    def embed_query(self, text):
+        vector = self._features(text) * self.idf
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+class SentenceTransformerEmbedder:
+    """Dense embeddings from a local sentence-transformers model, run on CPU."""
+    name = "sentence-transformers"
+    min_score = 0.45
+
+    def __init__(self, model_name=SENTENCE_TRANSFORMERS_MODEL):
+        # Optional dependency: only needed when this embedder is selected
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def config(self):
+        return {"name": self.name, "model": self.model_name, "dim": self.dim}
+
+    def embed_documents(self, texts):
+        return self.model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    def fit(self, vectors, index_path):
+        pass
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def get_embedder(name="auto", index_path=None, **config):
+    """Builds an embedder by name; "auto" prefers sentence-transformers when installed.
+
+    With index_path, the state saved by a previous build (the IDF weights) is loaded.
+    """
+    if name in ("auto", SentenceTransformerEmbedder.name):
+        try:
+            return SentenceTransformerEmbedder(config.get("model", SENTENCE_TRANSFORMERS_MODEL))
+        except ImportError:
+            if name != "auto":
+                raise
+            logr("sentence-transformers is not installed, using hashed TF-IDF embeddings")
+    idf = np.load(os.path.join(index_path, "idf.npy")) if index_path else None
+    return HashingEmbedder(config.get("dim", HASH_DIM), idf)
+
+def document_title(url, text):
+    match = re.search(r"^#+ +(.+)$", text, re.MULTILINE)
+    return match.group(1).strip() if match else url
+
+def iter_chunks(paths, chunk_chars=CHUNK_CHARS):
+    """Yields {"url", "title", "text"} for every chunk of the scrape outputs in paths."""
+    for path in paths:
+        for url, text in iter_units(path):
+            url = url or f"file://{os.path.abspath(path)}"
+            title = document_title(url, text)
+            for chunk in context_packer.chunk_markdown(text, chunk_chars):
+                yield {"url": url, "title": title, "text": chunk}
+
+class VectorIndex:
+    """Chunks of scraped documentation and their embeddings, memory-mapped from disk.
+
+    An index folder holds vectors.f32 (count x dim float32 rows), chunks.jsonl with the
+    text of each row, offsets.npy locating each chunk in chunks.jsonl, and meta.json.
+    """
+    kind = "vector"
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(os.path.join(index_path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.embedder = get_embedder(index_path=index_path, **self.meta["embedder"])
+        self.min_score = self.embedder.min_score
+        count, dim = self.meta["count"], self.meta["embedder"]["dim"]
+        self.vectors = np.memmap(os.path.join(index_path, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim)) if count else np.zeros((0, dim), dtype=np.float32)
+        self.offsets = np.load(os.path.join(index_path, "offsets.npy"), mmap_mode="r")
+        self.lock = threading.Lock()
+        self.chunks_file = open(os.path.join(index_path, "chunks.jsonl"), "rb")
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, paths, index_path, embedder="auto", chunk_chars=CHUNK_CHARS, batch_size=BATCH_SIZE):
+        """Chunks and embeds the scrape outputs in paths into a new index at index_path.
+
+        The index is written to a temporary folder that replaces index_path when done; the
+        previous index is moved aside first and removed last, so readers never find a half
+        written one.
+        """
+        embedder = get_embedder(embedder) if isinstance(embedder, str) else embedder
+        building = f"{index_path}.building"
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        offsets, count = [], 0
+        with open(os.path.join(building, "vectors.f32"), "wb") as vectors_file, open(os.path.join(building, "chunks.jsonl"), "wb") as chunks_file:
+            batch = []
+            def flush():
+                nonlocal count
+                vectors_file.write(np.ascontiguousarray(embedder.embed_documents([c["text"] for c in batch]), dtype=np.float32).tobytes())
+                count += len(batch)
+                batch.clear()
+            for chunk in iter_chunks(paths, chunk_chars):
+                offsets.append(chunks_file.tell())
+                chunks_file.write((json.dumps(chunk) + "\n").encode())
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        if count:
+            vectors = np.memmap(os.path.join(building, "vectors.f32"), dtype=np.float32, mode="r+", shape=(count, embedder.dim))
+            embedder.fit(vectors, building)
+            vectors.flush()
+            del vectors
+        elif isinstance(embedder, HashingEmbedder):
+            np.save(os.path.join(building, "idf.npy"), np.ones(embedder.dim, dtype=np.float32))
+        np.save(os.path.join(building, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        with open(os.path.join(building, "meta.json"), "w") as f:
+            json.dump({"kind": cls.kind, "count": count, "chunk_chars": chunk_chars, "sources": [os.path.abspath(p) for p in paths],
+                       "embedder": embedder.config()}, f, indent=2)
+        replaced = f"{index_path}.replaced"
+        shutil.rmtree(replaced, ignore_errors=True)
+        if os.path.exists(index_path):
+            os.replace(index_path, replaced)
+        os.replace(building, index_path)
+        shutil.rmtree(replaced, ignore_errors=True)
+        logr(f"Indexed {count} chunks from {len(paths)} files into {index_path}")
+        return cls(index_path)
+
+    def chunk(self, position):
+        with self.lock:
+            self.chunks_file.seek(int(self.offsets[position]))
+            return json.loads(self.chunks_file.readline())
+
+    def close(self):
+        with self.lock:
+            self.chunks_file.close()
+
+    def search(self, query, k=5):
+        """Returns the k chunks most similar to query as dicts with url, title, text and score."""
+        if not len(self):
+            return []
+        query_vector = self.embedder.embed_query(query)
+        best_scores = np.empty(0, dtype=np.float32)
+        best_positions = np.empty(0, dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK):
+            scores = self.vectors[start:start + SEARCH_BLOCK] @ query_vector
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_positions = np.concatenate([best_positions, top + start])
+        order = np.argsort(-best_scores)[:k]
+        return [dict(self.chunk(best_positions[i]), score=float(best_scores[i])) for i in order]
+
+_open_indexes = {}
+_open_indexes_lock = threading.Lock()
+
+def open_index(index_path):
+    """Opens the index stored at index_path, a VectorIndex or, when its meta.json says
+    kind "bm25", a bm25_index.BM25Index. Both expose search(query, k).
+
+    Indexes are kept open per process and reopened when meta.json is replaced, so
+    segments added or a rebuild done by another process are picked up on the next call.
+    While a rebuild swaps the folder in, the index already open keeps being used.
+    """
+    meta_path = os.path.join(index_path, "meta.json")
+    with _open_indexes_lock:
+        opened = _open_indexes.get(index_path)
+        try:
+            stat = os.stat(meta_path)
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if opened is None or opened[0] != version:
+                with open(meta_path) as f:
+                    kind = json.load(f).get("kind", VectorIndex.kind)
+                if kind == "bm25":
+                    import bm25_index
+                    index = bm25_index.BM25Index(index_path)
+                else:
+                    index = VectorIndex(index_path)
+                if opened is not None:
+                    logr(f"{index_path} changed, reopened with {len(index)} chunks")
+                    opened[1].close()
+                opened = _open_indexes[index_path] = (version, index)
+        except FileNotFoundError:
+            if opened is None:
+                raise
+    return opened[1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Local vector index over scraped documentation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Index scrape outputs (*-scrapejob.md)")
+    build.add_argument("paths", nargs="+", help="Scrape output files")
+    build.add_argument("-i", "--index_path", required=True, help="Index folder")
+    build.add_argument("-e", "--embedder", default="auto", choices=["auto", HashingEmbedder.name, SentenceTransformerEmbedder.name])
+    build.add_argument("--chunk_chars", type=int, default=CHUNK_CHARS, help="Maximum characters per chunk")
+    search = subparsers.add_parser("search", help="Query an index")
+    search.add_argument("-i", "--index_path", required=True, help="Index folder")
+    search.add_argument("-q", "--query", required=True, help="Query text")
+    search.add_argument("-k", type=int, default=5, help="Number of chunks to return")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        VectorIndex.build(args.paths, args.index_path, args.embedder, args.chunk_chars)
+    else:
+        for hit in open_index(args.index_path).search(args.query, args.k):
+            logr(f"{hit['score']:.3f} {hit['url']} - {hit['title']}")
+
+if __name__ == "__main__":
+    main()